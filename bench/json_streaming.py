@@ -0,0 +1,114 @@
+"""Compares time to first byte and peak RSS of JSON representations
+encoded in one piece (the old `output_json`) and streamed in chunks.
+
+Usage: TESTING=1 python bench/json_streaming.py [DATASET] [COPIES]
+
+DATASET defaults to the test dataset. Its authorities are copied COPIES
+times (default 10000) to make a large dataset; other JSON documents
+(e.g. graphs) are used as is. Each measurement runs in a
+fresh process so that peak RSS is not affected by earlier runs.
+"""
+
+import json
+import multiprocessing
+import resource
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_DATASET = ROOT / "test" / "data" / "test-data.json"
+sys.path.insert(0, str(ROOT))
+
+
+def make_dataset(path, copies):
+    dataset = json.loads(Path(path).read_text())
+    if "authorities" not in dataset:
+        return dataset
+    authorities = dataset["authorities"]
+    dataset["authorities"] = {
+        f"{key}{i}": authority
+        for i in range(copies)
+        for key, authority in authorities.items()
+    }
+    # round trip so that copies don't share objects
+    return json.loads(json.dumps(dataset))
+
+
+def peak_rss_kib():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak_rss():
+    # supported by Linux 4.0 and later
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(variant, path, copies, results):
+    from periodo import app, representations
+
+    data = make_dataset(path, copies)
+
+    def old_output_json(data):
+        return representations.make_response(
+            json.dumps(representations.abbreviate_context(data), ensure_ascii=False)
+            + "\n",
+        )
+
+    output_json = (
+        old_output_json if variant == "one piece" else (representations.output_json)
+    )
+
+    with app.test_request_context("/d.json"):
+        reset = reset_peak_rss()
+        before = peak_rss_kib()
+        start = time.perf_counter()
+        response = output_json(data)
+        chunks = response.iter_encoded()
+        size = len(next(chunks))
+        first_byte = time.perf_counter() - start
+        for chunk in chunks:
+            size += len(chunk)
+        total = time.perf_counter() - start
+        after = peak_rss_kib()
+
+    results.put(
+        {
+            "variant": variant,
+            "bytes": size,
+            "first byte (s)": round(first_byte, 3),
+            "total (s)": round(total, 3),
+            "peak RSS increase (MiB)": round((after - before) / 1024, 1),
+            "peak RSS reset": reset,
+        }
+    )
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_DATASET
+    copies = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    context = multiprocessing.get_context("spawn")
+    for variant in ("one piece", "streamed"):
+        results = context.Queue()
+        process = context.Process(target=measure, args=(variant, path, copies, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            sys.exit(f"Measuring {variant} failed")
+        print(json.dumps(results.get()))
+
+
+if __name__ == "__main__":
+    main()
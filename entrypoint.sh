@@ -1,2 +1,3 @@
 #!/bin/sh
-gunicorn --bind :8080 --workers 2 periodo:app
+python -c "from periodo.commands import migrate; migrate()" &&
+exec gunicorn --bind :8080 --workers 2 periodo:app
@@ -80,7 +80,12 @@ app.wsgi_app = RemoveTransferEncodingHeaderMiddleware(app.wsgi_app)
 
 app.config.update(
     DATABASE=os.environ.get("DATABASE", "./db.sqlite"),
+    # where the latest version of the dataset is published for workers to
+    # map into memory (by default next to the database)
+    LATEST_DATASET_PATH=os.environ.get("LATEST_DATASET_PATH", None),
     CACHE_PURGER_URL=os.environ.get("CACHE_PURGER_URL", None),
+    # "url" to purge by URL path, or "tag" to purge by surrogate key
+    CACHE_PURGER=os.environ.get("CACHE_PURGER", "url"),
     CSV_QUERY=os.environ.get("CSV_QUERY", "./periods-as-csv.rq"),
     SERVER_NAME=os.environ.get("SERVER_NAME", DEV_SERVER_NAME),
     SERVER_VERSION=os.environ.get(
@@ -93,6 +98,50 @@ app.config.update(
     TRANSLATION_SERVICE=os.environ.get(
         "TRANSLATION_SERVICE", "http://periodo-translator-dev.flycast"
     ),
+    PREFERRED_URL_SCHEME=os.environ.get("PREFERRED_URL_SCHEME", "http"),
+    PRECOMPUTE_ARTIFACTS=json.loads(os.environ.get("PRECOMPUTE_ARTIFACTS", "true")),
+    # projections of the dataset (see projection.py) to precompute
+    PRECOMPUTED_PROJECTIONS=json.loads(
+        os.environ.get("PRECOMPUTED_PROJECTIONS", '["id,label,start,stop"]')
+    ),
+    PURGE_IN_BACKGROUND=json.loads(os.environ.get("PURGE_IN_BACKGROUND", "true")),
+    # maximum total size in bytes of stored derived representations
+    ARTIFACT_STORE_SIZE=int(os.environ.get("ARTIFACT_STORE_SIZE", 512 * 1024 * 1024)),
+    # seconds for which a stored derived representation may be served after
+    # it has become stale, while it is regenerated in the background
+    ARTIFACT_MAX_STALENESS=int(os.environ.get("ARTIFACT_MAX_STALENESS", 86400)),
+    # maximum total size in bytes of responses to requests for specific
+    # versions of resources kept in memory by each worker (0 to disable)
+    RESPONSE_CACHE_SIZE=int(os.environ.get("RESPONSE_CACHE_SIZE", 128 * 1024 * 1024)),
+    # maximum total size in bytes of files holding responses to requests
+    # for specific versions of resources (0 to disable), where they are
+    # kept (by default next to the database), the smallest response to
+    # keep in a file rather than in memory, and the nginx location from
+    # which to send the files, if nginx should send them
+    SNAPSHOT_STORE_SIZE=int(
+        os.environ.get("SNAPSHOT_STORE_SIZE", 4 * 1024 * 1024 * 1024)
+    ),
+    SNAPSHOT_DIR=os.environ.get("SNAPSHOT_DIR", None),
+    SNAPSHOT_MIN_SIZE=int(os.environ.get("SNAPSHOT_MIN_SIZE", 256 * 1024)),
+    SNAPSHOT_ACCEL_PREFIX=os.environ.get("SNAPSHOT_ACCEL_PREFIX", None),
+    # seconds for which each worker keeps the identities of users it has
+    # authenticated, and the maximum number it keeps
+    IDENTITY_CACHE_TTL=float(os.environ.get("IDENTITY_CACHE_TTL", 60)),
+    IDENTITY_CACHE_SIZE=int(os.environ.get("IDENTITY_CACHE_SIZE", 1024)),
+    # seconds to wait for another request generating the same expensive
+    # representation before generating it anyway (less than the 30 seconds
+    # after which gunicorn restarts a silent worker)
+    SINGLE_FLIGHT_TIMEOUT=float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", 20)),
+    # bearer token required to read /metrics (which is disabled if unset)
+    METRICS_TOKEN=os.environ.get("METRICS_TOKEN", None),
+    # maximum size in characters of text to be syntax-highlighted
+    HIGHLIGHT_MAX_SIZE=int(os.environ.get("HIGHLIGHT_MAX_SIZE", 1024 * 1024)),
+    # number of processes for syntax highlighting (0 to highlight in-process)
+    HIGHLIGHT_WORKERS=int(os.environ.get("HIGHLIGHT_WORKERS", 2)),
+    # maximum number of highlighting jobs queued or running per worker
+    HIGHLIGHT_QUEUE_SIZE=int(os.environ.get("HIGHLIGHT_QUEUE_SIZE", 8)),
+    # seconds to wait for highlighting before serving unhighlighted HTML
+    HIGHLIGHT_TIMEOUT=float(os.environ.get("HIGHLIGHT_TIMEOUT", 10)),
 )
 app.logger.info("finished app configuration")
 
@@ -105,6 +154,7 @@ def add_date_header(response):
 
 CORS_ALLOWED_HEADERS = [
     "If-Modified-Since",
+    "If-None-Match",
     "Authorization",
     "Content-Type",
 ]
@@ -118,10 +168,12 @@ CORS_ALLOWED_METHODS = [
 ]
 
 CORS_EXPOSED_HEADERS = [
+    "ETag",
     "Last-Modified",
     "Location",
     "Link",
     "X-Total-Count",
+    "X-Filtered-Count",
     "X-PeriodO-Server-Version",
 ]
 
@@ -169,7 +221,11 @@ def handle_not_found_error(_):
             {"Content-Type": "application/json"},
         )
     else:
-        return make_response(periodo.highlight.as_json(message), 404)
+        try:
+            html = periodo.highlight.as_json(message)
+        except periodo.highlight.HighlightingUnavailable:
+            html = periodo.highlight.as_json(message, plain=True)
+        return make_response(html, 404)
 
 
 @app.errorhandler(periodo.auth.AuthenticationFailed)
@@ -211,7 +267,9 @@ def load_identity():
 @identity_loaded.connect_via(app)
 def on_identity_loaded(_, identity):
     if identity.id is not None:
-        g.user = periodo.database.get_user(identity.id)
+        g.user = getattr(identity, "user", None) or periodo.database.get_user(
+            identity.id
+        )
 
 
 # end api setup ---------------------------------------------------------------
@@ -0,0 +1,329 @@
+import json
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import request, url_for, make_response, Response
+from periodo import (
+    app,
+    cache,
+    database,
+    identifier,
+    metrics,
+    provenance,
+    singleflight,
+)
+from typing import Callable, Optional
+from urllib.parse import urlencode
+
+# Derived representations are stored along with the headers set by the
+# functions that generated them, except for these
+UNSTORED_HEADERS = ("Content-Length", "Date")
+
+PRECOMPUTE_ENVIRON_KEY = "periodo.precompute"
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="precompute")
+
+
+def request_key(content_type: str) -> str:
+    query = urlencode(sorted(request.args.items(multi=True)))
+    return f"{content_type} {request.base_url}{'?' if query else ''}{query}"
+
+
+def get(key: str, version) -> Optional[sqlite3.Row]:
+    return database.query_db_for_one(
+        "SELECT headers, data FROM artifact WHERE key = ? AND version = ?",
+        (key, str(version)),
+    )
+
+
+def get_headers(key: str, version) -> Optional[sqlite3.Row]:
+    # like get but without loading the data
+    return database.query_db_for_one(
+        """
+    SELECT headers, LENGTH(data) AS length
+    FROM artifact
+    WHERE key = ? AND version = ?
+    """,
+        (key, str(version)),
+    )
+
+
+def get_stale(key: str, version) -> Optional[sqlite3.Row]:
+    """Returns the most recent stored version of a derived representation
+    other than the given one, with the number of seconds since it was
+    found to be stale."""
+    with database.open_cursor(write=True) as cursor:
+        cursor.execute(
+            """
+        UPDATE artifact
+        SET stale_since = strftime('%s', 'now')
+        WHERE key = ? AND version != ? AND stale_since IS NULL
+        """,
+            (key, str(version)),
+        )
+        cursor.execute(
+            """
+        SELECT headers, data, strftime('%s', 'now') - stale_since AS staleness
+        FROM artifact
+        WHERE key = ? AND version != ?
+        ORDER BY created_at DESC, rowid DESC
+        LIMIT 1
+        """,
+            (key, str(version)),
+        )
+        return cursor.fetchone()
+
+
+def put(key: str, version, response: Response) -> None:
+    headers = {k: v for k, v in response.headers.items() if k not in UNSTORED_HEADERS}
+    with database.open_cursor(write=True) as cursor:
+        cursor.execute(
+            """
+        INSERT OR REPLACE INTO artifact (key, version, headers, data)
+        VALUES (?, ?, ?, ?)
+        """,
+            (key, str(version), json.dumps(headers), response.get_data()),
+        )
+        # older versions are only kept to be served while this is generated
+        cursor.execute(
+            "DELETE FROM artifact WHERE key = ? AND version != ?", (key, str(version))
+        )
+        evict(cursor)
+
+
+def evict(cursor) -> None:
+    # delete the oldest artifacts that don't fit within the size budget
+    cursor.execute(
+        """
+    DELETE FROM artifact
+    WHERE rowid IN (
+      SELECT rowid FROM (
+        SELECT
+        rowid,
+        SUM(LENGTH(data)) OVER (ORDER BY created_at DESC, rowid DESC) AS total
+        FROM artifact
+      )
+      WHERE total > ?
+    )
+    """,
+        (app.config["ARTIFACT_STORE_SIZE"],),
+    )
+
+
+def head(key: str, version) -> Optional[Response]:
+    """Returns a response without a body but with the headers and length
+    of a stored derived representation, if one exists."""
+    if version is None:
+        return None
+
+    artifact = get_headers(key, version)
+    if artifact is None:
+        return None
+
+    response = Response(iter(()), 200, json.loads(artifact["headers"]))
+    response.headers["Content-Length"] = str(artifact["length"])
+    return response
+
+
+def precomputing() -> bool:
+    return request.environ.get(PRECOMPUTE_ENVIRON_KEY, False)
+
+
+def stale_response(artifact: sqlite3.Row) -> Response:
+    response = make_response(artifact["data"], 200, json.loads(artifact["headers"]))
+    # so that caches get the fresh representation as soon as it is ready
+    return cache.no_store(response)
+
+
+def cached(
+    key: str,
+    version,
+    render: Callable[[], Response],
+    store: bool = False,
+    serve_stale: bool = False,
+) -> Response:
+    """Returns a stored derived representation of the requested resource
+    if one exists for the given version, otherwise calls `render` to
+    generate it.
+
+    Only one request at a time generates a representation (see
+    `singleflight.run`). Generated representations are stored if `store`
+    is `True`, while precomputing (see `precompute`), or if other
+    requests are waiting for them. The oldest stored representations
+    are evicted when their total size exceeds `ARTIFACT_STORE_SIZE`.
+    Responses marked `Cache-Control: no-store` are never stored.
+
+    If `serve_stale` is `True`, generated representations are always
+    stored, and until a representation of the given version has been
+    stored, the previous version is returned instead (and the current one
+    generated in the background) for up to `ARTIFACT_MAX_STALENESS`
+    seconds. The previous version is also returned if generating the
+    current one fails, for up to `cache.STALE_IF_ERROR` seconds. Caches
+    are told they may do the same.
+
+    """
+    if version is None:
+        return render()
+
+    def get_response() -> Optional[Response]:
+        artifact = get(key, version)
+        if artifact is None:
+            return None
+        return make_response(artifact["data"], 200, json.loads(artifact["headers"]))
+
+    def render_and_store(has_waiters: Callable[[], bool]) -> Response:
+        response = render()
+        # generate streamed bodies while holding the lease, so that others
+        # wait for them, and only then ask whether anyone is waiting
+        response.get_data()
+        if (
+            response.status_code == 200
+            and "no-store" not in response.headers.get("Cache-Control", "")
+            and (store or serve_stale or precomputing() or has_waiters())
+        ):
+            put(key, version, response)
+        return response
+
+    if serve_stale:
+        cache.allow_stale()
+
+    response = get_response()
+    if response is not None:
+        return response
+
+    stale = None if not serve_stale or precomputing() else get_stale(key, version)
+    if stale is not None and stale["staleness"] <= app.config["ARTIFACT_MAX_STALENESS"]:
+        refresh_in_background(request.full_path)
+        metrics.increment("artifact_stale_served_total")
+        return stale_response(stale)
+
+    response = singleflight.run(f"{key} {version}", get_response, render_and_store)
+
+    if (
+        response.status_code >= 500
+        and stale is not None
+        and stale["staleness"] <= cache.STALE_IF_ERROR
+    ):
+        metrics.increment("artifact_stale_if_error_total")
+        return stale_response(stale)
+
+    return response
+
+
+def paths_to_precompute(patch_request_id: int) -> list[str]:
+    row = database.query_db_for_one(
+        """
+    SELECT created_entities, updated_entities, resulted_in
+    FROM patch_request
+    WHERE id = ? AND merged = 1
+    """,
+        (patch_request_id,),
+    )
+    if row is None:
+        return []
+
+    paths = [
+        url_for(endpoint, _external=False, **values)
+        for endpoint, values in (
+            ("dataset-short-ttl", {}),
+            ("dataset-ttl", {}),
+            ("dataset-short-csv", {}),
+            ("dataset-csv", {}),
+            ("history-short-nt", {}),
+            ("history-nt", {}),
+            ("history-short-nt", {"full": ""}),
+            ("history-nt", {"full": ""}),
+            ("void_as_html", {}),
+        )
+    ] + [
+        url_for(endpoint, _external=False, fields=fields)
+        for fields in app.config["PRECOMPUTED_PROJECTIONS"]
+        for endpoint in ("dataset-short-json", "dataset-json")
+    ]
+
+    for entity_id in sorted(
+        set(json.loads(row["created_entities"]))
+        | set(json.loads(row["updated_entities"]))
+    ):
+        unprefixed_id = identifier.unprefix(entity_id)
+        if provenance.is_period_id(unprefixed_id):
+            endpoint, values = "period", {"period_id": unprefixed_id}
+        elif provenance.is_authority_id(unprefixed_id):
+            endpoint, values = "authority", {"authority_id": unprefixed_id}
+        else:
+            continue
+        for suffix in ("json-html", "jsonld-html", "ttl-html"):
+            for version in (None, row["resulted_in"]):
+                paths.append(
+                    url_for(
+                        f"{endpoint}-{suffix}",
+                        _external=False,
+                        version=version,
+                        **values,
+                    )
+                )
+
+    return paths
+
+
+def generate(path: str) -> None:
+    "Generates and stores the derived representation at `path`."
+    base_url = "{}://{}".format(
+        app.config["PREFERRED_URL_SCHEME"], app.config["SERVER_NAME"]
+    )
+    with app.test_request_context(
+        path, base_url=base_url, environ_overrides={PRECOMPUTE_ENVIRON_KEY: True}
+    ):
+        try:
+            response = app.full_dispatch_request()
+            if not response.status_code == 200:
+                app.logger.warning(
+                    f"Precomputing {path} failed with {response.status_code}"
+                )
+        except Exception as e:
+            app.logger.error(f"Precomputing {path} failed: {e}")
+
+
+def precompute(patch_request_id: int) -> None:
+    """Generates and stores derived representations (Turtle, CSV,
+    projections, history, and highlighted HTML) of the dataset version
+    resulting from merging a patch request, and of the entities it
+    changed."""
+    with app.app_context():
+        paths = paths_to_precompute(patch_request_id)
+
+    for path in paths:
+        generate(path)
+
+
+# paths being regenerated in the background by this worker
+refreshing: set[str] = set()
+refreshing_lock = threading.Lock()
+
+
+def refresh_in_background(path: str) -> None:
+    with refreshing_lock:
+        if path in refreshing:
+            return
+        refreshing.add(path)
+
+    def refresh():
+        try:
+            generate(path)
+        finally:
+            with refreshing_lock:
+                refreshing.discard(path)
+
+    executor.submit(refresh)
+
+
+def enqueue_precompute(patch_request_id: int) -> None:
+    if not app.config["PRECOMPUTE_ARTIFACTS"]:
+        return
+
+    def log_failure(future):
+        e = future.exception()
+        if e is not None:
+            app.logger.error(f"Precomputing patch {patch_request_id} failed: {e}")
+
+    executor.submit(precompute, patch_request_id).add_done_callback(log_failure)
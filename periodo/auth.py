@@ -1,9 +1,11 @@
 import re
 import json
+import hashlib
+import time
 from base64 import b64encode
 from collections import namedtuple
 from functools import partial
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 from flask import request, make_response
 from flask_principal import (
     Permission,
@@ -13,7 +15,7 @@ from flask_principal import (
     Identity,
     AnonymousIdentity,
 )
-from periodo import database, app
+from periodo import database, app, lru
 from werkzeug.exceptions import Unauthorized
 
 submit_patch_permission = Permission(ActionNeed("submit-patch"))
@@ -69,6 +71,22 @@ UpdatePatchNeed = partial(ItemNeed, type="patch_request", method="update")
 class UpdatePatchPermission(Permission):
     def __init__(self, patch_request_id):
         super().__init__(UpdatePatchNeed(value=patch_request_id))
+        self.patch_request_id = patch_request_id
+
+    def allows(self, identity):
+        if super().allows(identity):
+            return True
+        # those who can accept patch requests can update any open one
+        return accept_patch_permission.allows(identity) and is_open_patch_request(
+            self.patch_request_id
+        )
+
+
+def is_open_patch_request(patch_request_id) -> bool:
+    row = database.query_db_for_one(
+        "SELECT open FROM patch_request WHERE id = ?", (patch_request_id,)
+    )
+    return row is not None and bool(row["open"])
 
 
 Credentials = namedtuple(
@@ -121,6 +139,9 @@ def describe(needs):
         elif classname == "ItemNeed":
             if need.method == "update" and need.type == "patch_request":
                 description.add("can update submissions of proposed changes")
+    if ActionNeed("accept-patch") in needs:
+        # see UpdatePatchPermission
+        description.add("can update submissions of proposed changes")
     return list(description)
 
 
@@ -215,14 +236,35 @@ def add_user_or_update_credentials(credential_data):
     return User(orcid, credentials.name, b64token)
 
 
-def _get_identity(b64token):
+class CachedIdentity(NamedTuple):
+    user: User
+    provides: frozenset
+    token_expires_at: int
+    cached_at: float
+
+
+# Each worker keeps the identities of recently authenticated users for up
+# to IDENTITY_CACHE_TTL seconds, keyed by a hash of their tokens. They are
+# forgotten when any user (e.g. their token or permissions) or the set of
+# open patch requests changes.
+identity_cache = lru.LRUCache("identity_cache", app.config["IDENTITY_CACHE_SIZE"])
+
+
+@database.on_change("user")
+@database.on_change("patch_request")
+def forget_identities() -> None:
+    identity_cache.clear()
+
+
+def _load_identity(b64token) -> Optional[CachedIdentity]:
     rows = database.query_db_for_all(
         """
     SELECT
     user.id AS user_id,
+    user.name AS user_name,
     user.permissions AS user_permissions,
-    patch_request.id AS patch_request_id,
-    strftime("%s","now") > token_expires_at AS token_expired
+    user.token_expires_at AS token_expires_at,
+    patch_request.id AS patch_request_id
     FROM user LEFT JOIN patch_request
     ON user.id = patch_request.created_by AND patch_request.open = 1
     WHERE user.b64token = ?
@@ -230,18 +272,37 @@ def _get_identity(b64token):
         (b64token,),
     )
     if not rows:
-        return UnauthenticatedIdentity("invalid_token", "The access token is invalid")
-    if rows[0]["token_expired"]:
-        return UnauthenticatedIdentity("invalid_token", "The access token expired")
-    identity = Identity(rows[0]["user_id"], auth_type="bearer")
-    for p in json.loads(rows[0]["user_permissions"]):
-        identity.provides.add(tuple(p))
+        return None
+    provides = {tuple(p) for p in json.loads(rows[0]["user_permissions"])}
     for r in rows:
         if r["patch_request_id"] is not None:
-            identity.provides.add(UpdatePatchNeed(value=r["patch_request_id"]))
-    if accept_patch_permission.allows(identity):
-        for r in database.query_db_for_all(
-            "SELECT id FROM patch_request WHERE open = 1"
-        ):
-            identity.provides.add(UpdatePatchNeed(value=r["id"]))
+            provides.add(UpdatePatchNeed(value=r["patch_request_id"]))
+    return CachedIdentity(
+        User(rows[0]["user_id"], rows[0]["user_name"], b64token),
+        frozenset(provides),
+        rows[0]["token_expires_at"],
+        time.time(),
+    )
+
+
+def _get_identity(b64token):
+    # the cache must not hold identities that have since changed
+    database.check_data_versions()
+    key = hashlib.sha256(b64token).hexdigest()
+    cached = identity_cache.get(key)
+    if (
+        cached is None
+        or time.time() - cached.cached_at > app.config["IDENTITY_CACHE_TTL"]
+    ):
+        cached = _load_identity(b64token)
+        if cached is None:
+            return UnauthenticatedIdentity(
+                "invalid_token", "The access token is invalid"
+            )
+        identity_cache.put(key, cached, 1)
+    if time.time() > cached.token_expires_at:
+        return UnauthenticatedIdentity("invalid_token", "The access token expired")
+    identity = Identity(cached.user.id, auth_type="bearer")
+    identity.provides.update(cached.provides)
+    identity.user = cached.user
     return identity
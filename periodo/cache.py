@@ -1,14 +1,28 @@
 import httpx
-from periodo import app
-from typing import Tuple
+import json
+import re
+import threading
+import time
+from flask import g, has_request_context, Response
+from periodo import app, database, identifier, provenance
+from typing import Iterable, Optional, Protocol, Tuple
 from werkzeug.routing import Rule
 
 LONG_TIME = 31557600  # 1 year - versioned reprs that should not change
 MEDIUM_TIME = 604800  # 1 week - slow-to-generate reprs that change infreq.
 SHORT_TIME = 86400  # 1 day  - derived reprs like TTL and HTML
+STALE_IF_ERROR = 604800  # 1 week - how long stale reprs may replace errors
+
+PURGE_BATCH_SIZE = 1000  # max keys sent to the cache purger at once
+PURGE_TIMEOUT = 60  # seconds before an unfinished purge may be retried
+PURGE_RETRY_DELAY = 10  # seconds before retrying a failed purge (doubles)
+PURGE_MAX_RETRY_DELAY = 3600
 
 
 def set_max_age(response, max_age, server_only):
+    if response.headers.get("Cache-Control") == "no-store":
+        # X-Accel-Expires would override it
+        return response
     # X-Accel-Expires is only for nginx; Cache-Control is for all HTTP caches
     if server_only:
         if "X-Accel-Expires" not in response.headers:
@@ -38,14 +52,313 @@ def no_time(response, server_only=False):
     return set_max_age(response, 0, server_only)
 
 
+def no_store(response):
+    # for degraded responses that should not be cached at all
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+def until_tag_purged(response):
+    """For responses to the latest version of a resource that are only
+    purged by their surrogate keys, such as those that vary with the query
+    string (as purging by URL path covers only known paths): the server
+    cache keeps them until they are purged if the purger purges surrogate
+    keys, and otherwise must revalidate them."""
+    purger = get_purger()
+    if purger is not None and purger.purges_tags:
+        return long_time(response, server_only=True)
+    return no_time(response, server_only=True)
+
+
+def allow_stale() -> None:
+    """Lets caches serve the response to the current request for a while
+    after it has become stale, while they revalidate it in the background
+    or if revalidating fails."""
+    g._allow_stale = True
+
+
+@app.after_request
+def add_stale_directives(response: Response) -> Response:
+    cache_control = response.headers.get("Cache-Control")
+    if (
+        g.pop("_allow_stale", False)
+        and response.status_code == 200
+        and cache_control is not None
+        and "no-store" not in cache_control
+    ):
+        response.headers["Cache-Control"] = (
+            f"{cache_control}, "
+            f"stale-while-revalidate={app.config['ARTIFACT_MAX_STALENESS']}, "
+            f"stale-if-error={STALE_IF_ERROR}"
+        )
+    return response
+
+
+# Responses are tagged with surrogate keys naming what they were made
+# from, so that a cache can purge all of them at once:
+#
+#   dataset          anything made from the latest version of the dataset
+#   dataset-v<N>     anything made from version N of the dataset
+#   <entity key>     an authority or period, e.g. p0trgkv
+#   history          the history of changes
+#   patches          lists of patch requests
+#   patch-<id>       a patch request
+#   identifier-map   the identifier map
+#   bags             the list of bags
+#   bag-<uuid>       a bag
+#   graphs           lists of graphs
+#   graph-<id>       a graph
+#
+# Surrogate keys never start with "/" so they can be purged alongside
+# URL paths.
+
+
+def tag(*keys: str) -> None:
+    "Adds surrogate keys to the response to the current request."
+    g.setdefault("_surrogate_keys", {}).update(dict.fromkeys(keys))
+
+
+def get_tags() -> tuple[str, ...]:
+    "Returns the surrogate keys added to the response so far."
+    return tuple(g.get("_surrogate_keys", ()))
+
+
+def tag_dataset(version: int, latest: bool) -> None:
+    tag(f"dataset-v{version}")
+    if latest:
+        tag("dataset")
+
+
+@app.after_request
+def add_surrogate_keys(response: Response) -> Response:
+    keys = g.pop("_surrogate_keys", None)
+    if keys:
+        # Fastly and Varnish (xkey) use Surrogate-Key, Cloudflare Cache-Tag
+        response.headers["Surrogate-Key"] = " ".join(keys)
+        response.headers["Cache-Tag"] = ",".join(keys)
+    return response
+
+
+class PurgeFailed(Exception):
+    pass
+
+
+class Purger(Protocol):
+    # whether responses are purged by their surrogate keys
+    purges_tags: bool
+
+    def purge(self, urls: list[str], tags: list[str]) -> None:
+        """Purges cached responses for the given URL paths, and those
+        tagged with any of the given surrogate keys. Raises
+        `PurgeFailed` if they could not be purged."""
+        ...
+
+
+class URLPurger:
+    "Posts JSON lists of URL paths to purge. Surrogate keys are ignored."
+
+    purges_tags = False
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def purge(self, urls: list[str], tags: list[str]) -> None:
+        if urls:
+            post(self.url, urls)
+
+
+class TagPurger:
+    """Posts JSON objects listing the surrogate keys to purge, as
+    `{"tags": [...]}`. URL paths are ignored."""
+
+    purges_tags = True
+
+    def __init__(self, url: str):
+        self.url = url
+
+    def purge(self, urls: list[str], tags: list[str]) -> None:
+        if tags:
+            post(self.url, {"tags": tags})
+
+
+def post(url: str, data) -> None:
+    try:
+        httpx.post(url, json=data).raise_for_status()
+    except httpx.HTTPError as e:
+        raise PurgeFailed(str(e)) from e
+
+
+PURGERS = {"url": URLPurger, "tag": TagPurger}
+
+
+def get_purger() -> Optional[Purger]:
+    """Returns the configured purger, or `None` if there is none.
+    `CACHE_PURGER` is either the name of one of the `PURGERS`, which
+    will post to `CACHE_PURGER_URL`, or an object implementing
+    `Purger`."""
+    purger = app.config["CACHE_PURGER"]
+    if not isinstance(purger, str):
+        return purger
+    url = app.config["CACHE_PURGER_URL"]
+    return None if url is None else PURGERS[purger](url)
+
+
 def purge(keys: list[str]) -> None:
-    cache_purger = app.config["CACHE_PURGER_URL"]
-    if cache_purger is not None:
+    """Schedules URL paths or surrogate keys to be purged. Keys purged
+    while handling a request are collected, and enqueued together when
+    it is finished."""
+    if get_purger() is None:
+        return
+    if has_request_context():
+        g.setdefault("_purge_keys", {}).update(dict.fromkeys(keys))
+    else:
+        enqueue_purge(keys)
+
+
+def insert_purge_keys(cursor, keys: list[str]) -> None:
+    # keys already queued are due again, and not deleted by a worker that
+    # claimed them before (and may have purged them before the change)
+    cursor.executemany(
+        """
+    INSERT INTO purge_queue (key) VALUES (?)
+    ON CONFLICT (key) DO UPDATE
+    SET attempts = 0, next_attempt_at = 0, generation = generation + 1
+    """,
+        [(key,) for key in keys],
+    )
+
+
+def enqueue_purge(keys: list[str]) -> None:
+    with database.open_cursor(write=True) as cursor:
+        insert_purge_keys(cursor, keys)
+    if app.config["PURGE_IN_BACKGROUND"]:
+        start_purge_worker()
+
+
+def enqueue_request_purges_in(cursor) -> None:
+    """Enqueues the keys purged so far while handling a request using the
+    cursor of a transaction, so that they are enqueued if and only if the
+    changes requiring them are committed."""
+    keys = g.pop("_purge_keys", None)
+    if keys and get_purger() is not None:
+        insert_purge_keys(cursor, list(keys))
+        g._purges_enqueued = True
+
+
+@app.teardown_request
+def enqueue_request_purges(_):
+    keys = g.pop("_purge_keys", None)
+    if keys:
+        enqueue_purge(list(keys))
+    elif app.config["PURGE_IN_BACKGROUND"] and (
+        purge_worker is None or g.pop("_purges_enqueued", False)
+    ):
+        # process any purges left over from before a restart, or enqueued
+        # along with the changes requiring them
+        start_purge_worker()
+
+
+def claim_purges() -> list:
+    now = time.time()
+    with database.open_cursor(write=True) as cursor:
+        # in one statement, so that no other worker can claim (and send)
+        # the same keys
+        cursor.execute(
+            """
+        UPDATE purge_queue
+        SET next_attempt_at = ?
+        WHERE id IN (
+          SELECT id FROM purge_queue
+          WHERE next_attempt_at <= ?
+          ORDER BY id
+          LIMIT ?
+        )
+        RETURNING id, key, attempts, generation
+        """,
+            (now + PURGE_TIMEOUT, now, PURGE_BATCH_SIZE),
+        )
+        rows = cursor.fetchall()
+    return sorted(rows, key=lambda row: row["id"])
+
+
+def process_purge_queue() -> Optional[float]:
+    """Sends due purge keys to the cache purger in batches. Failed
+    purges are retried with exponential backoff. Returns the number of
+    seconds until the next retry is due, or `None` if the queue is
+    empty."""
+    purger = get_purger()
+    if purger is None:
+        return None
+
+    with app.app_context():
+        while rows := claim_purges():
+            ids = [(row["id"], row["generation"]) for row in rows]
+            keys = [row["key"] for row in rows]
+            try:
+                purger.purge(
+                    [key for key in keys if key.startswith("/")],
+                    [key for key in keys if not key.startswith("/")],
+                )
+            except PurgeFailed as e:
+                app.logger.error(f"Cache purge failed: {e}")
+                with database.open_cursor(write=True) as cursor:
+                    cursor.executemany(
+                        """
+                    UPDATE purge_queue
+                    SET attempts = attempts + 1, next_attempt_at = ?
+                    WHERE id = ? AND generation = ?
+                    """,
+                        [
+                            (
+                                time.time()
+                                + min(
+                                    PURGE_RETRY_DELAY * 2 ** row["attempts"],
+                                    PURGE_MAX_RETRY_DELAY,
+                                ),
+                                row["id"],
+                                row["generation"],
+                            )
+                            for row in rows
+                        ],
+                    )
+                break
+            with database.open_cursor(write=True) as cursor:
+                cursor.executemany(
+                    "DELETE FROM purge_queue WHERE id = ? AND generation = ?", ids
+                )
+
+        next_attempt_at = database.query_db_for_one(
+            "SELECT MIN(next_attempt_at) AS t FROM purge_queue"
+        )["t"]
+
+    return None if next_attempt_at is None else max(0, next_attempt_at - time.time())
+
+
+purge_worker: Optional[threading.Thread] = None
+purge_worker_lock = threading.Lock()
+purge_wakeup = threading.Event()
+
+
+def run_purge_worker() -> None:
+    while True:
+        purge_wakeup.clear()
         try:
-            response = httpx.post(cache_purger, json=keys)
-            response.raise_for_status()
-        except httpx.HTTPError as e:
-            app.logger.error(f"Cache purge failed: {e}")
+            delay = process_purge_queue()
+        except Exception as e:
+            app.logger.error(f"Processing cache purges failed: {e}")
+            delay = PURGE_RETRY_DELAY
+        purge_wakeup.wait(delay)
+
+
+def start_purge_worker() -> None:
+    global purge_worker
+    with purge_worker_lock:
+        if purge_worker is None or not purge_worker.is_alive():
+            purge_worker = threading.Thread(
+                target=run_purge_worker, name="purge", daemon=True
+            )
+            purge_worker.start()
+    purge_wakeup.set()
 
 
 def DEFAULT_KEY(r: Rule) -> str:
@@ -61,14 +374,87 @@ def purge_endpoint(endpoint: str, key=DEFAULT_KEY, params: Tuple[str, ...] = ())
 
 def purge_history() -> None:
     purge_endpoint("history", params=("full",))
+    purge(["history"])
 
 
 def purge_dataset() -> None:
     purge_endpoint("dataset", params=("inline-context",))
+    purge(["dataset", "identifier-map"])
 
 
 def purge_graphs() -> None:
     purge_endpoint("graphs")
+    purge(["graphs"])
+
+
+def purge_patch_request(patch_request_id: int) -> None:
+    purge(["patches", f"patch-{patch_request_id}"])
+
+
+def purge_bag(uuid) -> None:
+    purge(["bags", f"bag-{uuid}"])
+
+
+def purge_entities(entity_ids: Iterable[str]) -> None:
+    for entity_id in sorted(entity_ids):
+        unprefixed_id = identifier.unprefix(entity_id)
+        if provenance.is_period_id(unprefixed_id):
+            endpoint = "period"
+        elif provenance.is_authority_id(unprefixed_id):
+            endpoint = "authority"
+        else:
+            continue
+
+        purge([identifier.prefix(unprefixed_id)])
+        # the suffixed endpoints are named e.g. "period-ttl" and
+        # "period-html", but other endpoints may share the prefix
+        purge(
+            [
+                re.sub(r"<[^>]+>", unprefixed_id, r.rule)
+                for r in app.url_map.iter_rules()
+                if r.endpoint == endpoint or r.endpoint.startswith(endpoint + "-")
+            ]
+        )
+
+
+def purge_all_entities() -> None:
+    # responses to the latest versions of all entities are tagged with it
+    purge(["entities"])
+    purger = get_purger()
+    if purger is not None and not purger.purges_tags:
+        data = database.get_data()
+        authorities = data.get("authorities", {})
+        purge_entities(
+            set(authorities)
+            | {key for a in authorities.values() for key in a.get("periods", {})}
+        )
+
+
+def changes_context(patch: list[dict]) -> bool:
+    return any(
+        op["path"] == "/@context" or op["path"].startswith("/@context/") for op in patch
+    )
+
+
+def purge_patch_entities(patch_request_id: int) -> None:
+    row = database.query_db_for_one(
+        """
+    SELECT created_entities, updated_entities, removed_entities, applied_patch
+    FROM patch_request
+    WHERE id = ?
+    """,
+        (patch_request_id,),
+    )
+    if row is None:
+        return
+    purge_entities(
+        set(json.loads(row["created_entities"]))
+        | set(json.loads(row["updated_entities"]))
+        | set(json.loads(row["removed_entities"]))
+    )
+    if row["applied_patch"] and changes_context(json.loads(row["applied_patch"])):
+        # every representation of every entity includes the context
+        purge_all_entities()
 
 
 def subpaths(path: str) -> list[str]:
@@ -79,6 +465,7 @@ def subpaths(path: str) -> list[str]:
 
 
 def purge_graph(graph_id: str) -> None:
+    purge(["graphs", f"graph-{graph_id}"])
     for path in subpaths(graph_id):
 
         def key(r: Rule, path: str = path):
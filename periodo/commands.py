@@ -1,6 +1,6 @@
 import json
 from jsonpatch import JsonPatch
-from periodo import app, auth, database, patching
+from periodo import app, auth, database, indexes, patching
 
 
 def init_db():
@@ -20,6 +20,41 @@ def load_data(datafile):
         patching.merge(patch_request_id, user_id)
 
 
+def rebuild_indexes():
+    with app.app_context():
+        indexes.rebuild()
+
+
+def add_first_comment_column():
+    "Adds the first comments of patch requests to databases created without them."
+    with app.app_context():
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("SELECT name FROM pragma_table_info('patch_request')")
+            if "first_comment" not in {row["name"] for row in cursor.fetchall()}:
+                cursor.execute(
+                    "ALTER TABLE patch_request ADD COLUMN first_comment TEXT"
+                )
+            cursor.execute(
+                """
+            UPDATE patch_request
+            SET first_comment = (
+              SELECT message
+              FROM patch_request_comment
+              WHERE patch_request_id = patch_request.id
+              ORDER BY id
+              LIMIT 1
+            )
+            WHERE first_comment IS NULL
+            """
+            )
+
+
+def migrate():
+    "Brings databases created by earlier versions up to date with the schema."
+    init_db()
+    add_first_comment_column()
+
+
 def set_permissions(orcid, permissions=None):
     if permissions is None:
         permissions = []
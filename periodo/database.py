@@ -1,10 +1,12 @@
+import hashlib
 import itertools
 import json
 import sqlite3
+import threading
 from contextlib import contextmanager
 from periodo import app, identifier, auth
 from flask import g, url_for
-from typing import List
+from typing import Callable, List, Optional, Tuple
 from uuid import UUID
 
 
@@ -71,6 +73,170 @@ def get_dataset(version=None) -> sqlite3.Row:
         )
 
 
+def get_latest_version() -> int:
+    return query_db_for_one("SELECT MAX(id) AS id FROM dataset")["id"]
+
+
+def get_dataset_version(version=None) -> Optional[sqlite3.Row]:
+    # like get_dataset but without loading the data
+    if version is None:
+        return query_db_for_one(
+            "SELECT id, created_at FROM dataset ORDER BY id DESC LIMIT 1"
+        )
+    else:
+        return query_db_for_one(
+            "SELECT id, created_at FROM dataset WHERE dataset.id = ?", (version,)
+        )
+
+
+def get_history_version() -> str:
+    # history changes when patches are merged or commented on
+    row = query_db_for_one(
+        """
+    SELECT
+    (SELECT MAX(id) FROM dataset) AS dataset_id,
+    (SELECT MAX(id) FROM patch_request_comment) AS comment_id
+    """
+    )
+    return f"{row['dataset_id']}-{row['comment_id'] or 0}"
+
+
+def get_history_last_modified() -> int:
+    return query_db_for_one(
+        """
+    SELECT MAX(
+      (SELECT MAX(created_at) FROM dataset),
+      IFNULL((SELECT MAX(posted_at) FROM patch_request_comment), 0)
+    ) AS last_modified
+    """
+    )["last_modified"]
+
+
+def get_patch_requests_version() -> Tuple[str, int]:
+    # patch requests change when they are created, updated, merged,
+    # rejected, or commented on
+    row = query_db_for_one(
+        """
+    SELECT
+    (SELECT TOTAL(count) FROM patch_request_count) AS count,
+    (SELECT TOTAL(count) FROM patch_request_count WHERE open = 1) AS open,
+    (SELECT TOTAL(count) FROM patch_request_count WHERE merged = 1) AS merged,
+    MAX(
+      IFNULL((SELECT MAX(updated_at) FROM patch_request), 0),
+      IFNULL((SELECT MAX(merged_at) FROM patch_request), 0),
+      IFNULL((SELECT MAX(posted_at) FROM patch_request_comment), 0)
+    ) AS last_modified,
+    (SELECT MAX(id) FROM patch_request_comment) AS comment_id
+    """
+    )
+    return (
+        "{}-{}-{}-{}-{}".format(
+            int(row["count"]),
+            int(row["open"]),
+            int(row["merged"]),
+            row["comment_id"] or 0,
+            row["last_modified"],
+        ),
+        row["last_modified"],
+    )
+
+
+def count_patch_requests(open=None, merged=None) -> int:
+    "Returns the number of patch requests, optionally only open or merged ones."
+    where, params = [], []
+    if open is not None:
+        where.append("open = ?")
+        params.append(open)
+    if merged is not None:
+        where.append("merged = ?")
+        params.append(merged)
+    return int(
+        query_db_for_one(
+            "SELECT TOTAL(count) AS count FROM patch_request_count"
+            + (f" WHERE {' AND '.join(where)}" if where else ""),
+            params,
+        )["count"]
+    )
+
+
+def get_activity_version() -> Tuple[int, int]:
+    # the activity log only changes when events are added to it
+    row = query_db_for_one(
+        """
+    SELECT id, occurred_at
+    FROM activity_event
+    ORDER BY occurred_at DESC, id DESC
+    LIMIT 1
+    """
+    )
+    return (0, 0) if row is None else (row["id"], row["occurred_at"])
+
+
+def get_patch_request_version(id) -> Optional[Tuple[str, int]]:
+    # whether a patch request is mergeable depends on the latest dataset
+    row = query_db_for_one(
+        """
+    SELECT
+    updated_at,
+    updated_by,
+    open,
+    merged,
+    merged_at,
+    original_patch,
+    (
+      SELECT MAX(id) FROM patch_request_comment
+      WHERE patch_request_id = patch_request.id
+    ) AS comment_id,
+    MAX(
+      updated_at,
+      IFNULL(merged_at, 0),
+      IFNULL((
+        SELECT MAX(posted_at) FROM patch_request_comment
+        WHERE patch_request_id = patch_request.id
+      ), 0),
+      (SELECT MAX(created_at) FROM dataset)
+    ) AS last_modified,
+    (SELECT MAX(id) FROM dataset) AS dataset_id
+    FROM patch_request
+    WHERE id = ?
+    """,
+        (id,),
+    )
+    if row is None:
+        return None
+    digest = hashlib.sha1(
+        json.dumps(
+            [row["updated_by"], row["open"], row["merged"], row["original_patch"]]
+        ).encode()
+    ).hexdigest()
+    return (
+        "{}-{}-{}-{}".format(
+            row["dataset_id"], row["comment_id"] or 0, row["last_modified"], digest
+        ),
+        row["last_modified"],
+    )
+
+
+def get_identifier_map_version() -> Tuple[str, Optional[int]]:
+    # merged patch requests never change, so the count identifies the map
+    row = query_db_for_one(
+        """
+    SELECT COUNT(*) AS count, MAX(merged_at) AS merged_at
+    FROM patch_request
+    WHERE merged = TRUE AND LENGTH(identifier_map) > 2
+    """
+    )
+    return f"{row['count']}-{row['merged_at'] or 0}", row["merged_at"]
+
+
+def get_graphs_version() -> str:
+    # graphs are added as new versions and deleted by marking all versions
+    row = query_db_for_one(
+        "SELECT COUNT(*) AS count, TOTAL(deleted) AS deleted FROM graph"
+    )
+    return f"{row['count']}-{int(row['deleted'])}"
+
+
 def get_context(version=None):
     return json.loads(get_dataset(version)["data"]).get("@context")
 
@@ -103,15 +269,57 @@ def extract_period(period_key, o, raiseErrors=False):
         maybeRaiseMissingKeyError()
         return None
 
-    period = authority["periods"][period_key]
-    period["authority"] = authority_key
+    return {**authority["periods"][period_key], "authority": authority_key}
+
+
+# Per-worker caches of data that any worker may change register functions
+# to clear them. These are called when a request finds that the data has
+# changed (see data_version in schema.sql).
+_data_versions: dict[str, int] = {}
+_data_versions_lock = threading.Lock()
+_on_change: dict[str, list[Callable[[], None]]] = {}
+
+
+def on_change(name: str):
+    "Registers a function to be called when the named data changes."
 
-    return period
+    def decorator(f: Callable[[], None]) -> Callable[[], None]:
+        _on_change.setdefault(name, []).append(f)
+        return f
+
+    return decorator
+
+
+@app.before_request
+def check_data_versions() -> None:
+    """Clears caches of data that has changed. Called before handling each
+    request, or earlier by caches that are needed before that."""
+    if g.get("_data_versions_checked", False):
+        return
+    g._data_versions_checked = True
+    rows = query_db_for_all("SELECT name, version FROM data_version")
+    with _data_versions_lock:
+        changed = [
+            row["name"]
+            for row in rows
+            if _data_versions.get(row["name"]) != row["version"]
+        ]
+        _data_versions.update((row["name"], row["version"]) for row in rows)
+    if "database" in changed:
+        # a different database, so everything has changed
+        changed = list(_on_change)
+    for name in changed:
+        for f in _on_change.get(name, ()):
+            f()
+
+
+def get_data(version=None) -> dict:
+    "Returns the parsed data of a version of the dataset, by default the latest."
+    return json.loads(get_dataset(version)["data"])
 
 
 def get_item(extract_item, id, version=None):
-    dataset = get_dataset(version=version)
-    o = json.loads(dataset["data"])
+    o = get_data(version)
     item = extract_item(identifier.prefix(id), o, raiseErrors=True)
     item["@context"] = o["@context"]
     if version is not None:
@@ -120,6 +328,33 @@ def get_item(extract_item, id, version=None):
     return item
 
 
+def find_missing_key(id, version=None) -> Optional[str]:
+    """Returns the key of the authority or period with the given
+    (unprefixed) ID if it is not in the dataset, or the key of the
+    authority of the period if that is missing. Returns None if the
+    entity exists.
+
+    Unlike get_item this does not parse the dataset in Python.
+
+    """
+    key = identifier.prefix(id)
+    authority_key = key[:7]
+    paths = [(authority_key, f'$.authorities."{authority_key}"')]
+    if key != authority_key:
+        paths.append((key, f'{paths[0][1]}.periods."{key}"'))
+    dataset = get_dataset_version(version)
+    if dataset is None:
+        return key
+    for key, path in paths:
+        row = query_db_for_one(
+            "SELECT json_type(data, ?) IS NOT NULL AS found FROM dataset WHERE id = ?",
+            (path, dataset["id"]),
+        )
+        if not row["found"]:
+            return key
+    return None
+
+
 def get_authority(id, version=None):
     return get_item(extract_authority, id, version)
 
@@ -129,8 +364,7 @@ def get_period(id, version=None):
 
 
 def get_periods_and_context(ids, version=None, raiseErrors=False):
-    dataset = get_dataset(version=version)
-    o = json.loads(dataset["data"])
+    o = get_data(version)
     periods = {id: extract_period(id, o, raiseErrors) for id in ids}
 
     return periods, o["@context"]
@@ -264,6 +498,37 @@ def get_graph(id, version=None):
         )
 
 
+def get_graph_version(id, version=None) -> Optional[sqlite3.Row]:
+    # like get_graph but without loading the data
+    if version is None:
+        return query_db_for_one(
+            """
+        SELECT version, created_at FROM graph
+        WHERE id = ? AND deleted = 0
+        ORDER BY version DESC LIMIT 1
+        """,
+            (id,),
+        )
+    else:
+        return query_db_for_one(
+            """
+        SELECT version, created_at FROM graph
+        WHERE id = ? AND version = ?
+        """,
+            (id, version),
+        )
+
+
+def has_graphs(prefix) -> bool:
+    return (
+        query_db_for_one(
+            "SELECT 1 FROM graph WHERE deleted = 0 AND id LIKE ? LIMIT 1",
+            (prefix + "/%",),
+        )
+        is not None
+    )
+
+
 def create_or_update_bag(uuid, creator_id, data):
     with open_cursor(write=True) as c:
         c.execute(
@@ -375,6 +640,7 @@ def dump():
 
 @app.teardown_appcontext
 def close(_):
-    db = getattr(g, "_database", None)
+    # popped so that streamed responses can reopen it
+    db = g.pop("_database", None)
     if db is not None:
         db.close()
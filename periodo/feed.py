@@ -1,99 +1,97 @@
 from bleach import linkify
 from collections import defaultdict
 from feedgen.feed import FeedGenerator
-from flask import url_for
+from flask import request, url_for
 from periodo import database
-from periodo.utils import isoformat, build_client_url
+from periodo.utils import isoformat, build_client_url, canonical_url_root
 from string import Template
 
 
+# number of events in the feed
+FEED_SIZE = 32
+
+
 def get_recent_activity():
     return database.query_db_for_all(
         """
 SELECT
-  patch_request.id AS id,
-  patch_request.open AS open,
-  patch_request.merged AS merged,
-  patch_request.created_at AS created_at,
-  creator.id AS creator_id,
-  creator.name AS creator_name,
-  patch_request.updated_at AS updated_at,
-  updater.id AS updater_id,
-  updater.name AS updater_name,
-  patch_request.merged_at AS merged_at,
-  merger.id AS merger_id,
-  merger.name AS merger_name,
-  comment.posted_at AS posted_at,
+  event.id AS id,
+  event.patch_request_id AS patch_request_id,
+  event.action AS action,
+  event.occurred_at AS occurred_at,
+  actor.id AS actor_id,
+  actor.name AS actor_name,
+  submitter.id AS submitter_id,
+  submitter.name AS submitter_name
+FROM activity_event AS event
+JOIN patch_request
+ON event.patch_request_id = patch_request.id
+JOIN user AS actor
+ON event.user_id = actor.id
+JOIN user AS submitter
+ON patch_request.created_by = submitter.id
+ORDER BY event.occurred_at DESC, event.id DESC
+LIMIT ?""",
+        (FEED_SIZE,),
+    )
+
+
+def get_comments(events):
+    """Returns the comments on the patch requests of the given events, up
+    to the newest event, by patch request ID."""
+    patch_request_ids = sorted({event["patch_request_id"] for event in events})
+    rows = database.query_db_for_all(
+        f"""
+SELECT
+  event.id AS event_id,
+  event.patch_request_id AS patch_request_id,
   commenter.id AS commenter_id,
   commenter.name AS commenter_name,
-  comment.message AS message,
-  MAX(
-    patch_request.created_at,
-    patch_request.updated_at,
-    IFNULL(patch_request.merged_at, 0),
-    IFNULL(comment.posted_at, 0)
-  ) AS last_update_time
-FROM patch_request
-JOIN user AS creator
-ON patch_request.created_by = creator.id
-JOIN user AS updater
-ON patch_request.updated_by = updater.id
-LEFT JOIN user AS merger
-ON patch_request.merged_by = merger.id
-LEFT JOIN patch_request_comment AS comment
-ON patch_request.id = comment.patch_request_id
-LEFT JOIN user AS commenter
+  comment.posted_at AS posted_at,
+  comment.message AS message
+FROM activity_event AS event
+JOIN patch_request_comment AS comment
+ON event.comment_id = comment.id
+JOIN user AS commenter
 ON comment.author = commenter.id
-ORDER BY last_update_time
-DESC LIMIT 32"""
+WHERE event.patch_request_id IN ({", ".join("?" * len(patch_request_ids))})
+AND event.id <= ?
+ORDER BY event.id""",
+        (*patch_request_ids, max(event["id"] for event in events)),
     )
+    comments = defaultdict(list)
+    for row in rows:
+        comments[row["patch_request_id"]].append(row)
+    return comments
+
+
+def get_stored_contents(events):
+    "Returns the stored HTML content of the entries for the events, by event ID."
+    rows = database.query_db_for_all(
+        f"""
+SELECT event_id, content
+FROM feed_entry
+WHERE event_id IN ({", ".join("?" * len(events))})""",
+        tuple(event["id"] for event in events),
+    )
+    return {row["event_id"]: row["content"] for row in rows}
 
 
-def get_roles(row):
-    return {
-        "submitter": {
-            "id": row["creator_id"],
-            "name": row["creator_name"],
-        },
-        "updater": {
-            "id": row["updater_id"],
-            "name": row["updater_name"],
-        },
-        "merger": {
-            "id": row["merger_id"],
-            "name": row["merger_name"],
-        },
-        "commenter": {
-            "id": row["commenter_id"],
-            "name": row["commenter_name"],
-        },
-    }
-
-
-def get_what_happened(row):
-    if row["open"]:
-        if row["updated_at"] > row["created_at"]:
-            what_happened = "updated"
-        else:
-            what_happened = "submitted"
-    elif row["merged"]:
-        what_happened = "merged"
-    else:
-        what_happened = "rejected"
-    if row["last_update_time"] == row["posted_at"]:
-        what_happened = "commented on"
-
-    return what_happened
-
-
-def get_who_did_it(what_happened, roles):
-    return {
-        "submitted": roles["submitter"],
-        "updated": roles["updater"],
-        "merged": roles["merger"],
-        "rejected": roles["merger"],
-        "commented on": roles["commenter"],
-    }.get(what_happened)
+def store_contents(contents, events):
+    """Stores the HTML content of new entries, and deletes that of entries
+    for events no longer in the feed."""
+    with database.open_cursor(write=True) as cursor:
+        cursor.executemany(
+            "INSERT OR IGNORE INTO feed_entry (event_id, content) VALUES (?, ?)",
+            contents.items(),
+        )
+        cursor.execute(
+            f"""
+        DELETE FROM feed_entry
+        WHERE event_id NOT IN ({", ".join("?" * len(events))})
+        """,
+            tuple(event["id"] for event in events),
+        )
 
 
 def to_link(role):
@@ -138,49 +136,62 @@ def generate_activity_feed():
     fg = FeedGenerator()
     fg.id(feed_url)
     fg.title("PeriodO changes")
-    fg.updated(isoformat(recent_activity[0]["last_update_time"]))
+    fg.updated(isoformat(recent_activity[0]["occurred_at"]))
     fg.link(href=feed_url, rel="self")
     fg.author({"name": "PeriodO", "uri": "https://perio.do/"})
 
-    comments = defaultdict(list)
+    # the content of entries is rendered once for each event, if it links
+    # to the canonical server URL
+    canonical = request.url_root == canonical_url_root()
+    contents = get_stored_contents(recent_activity) if canonical else {}
+    new_contents = {}
+    comments = None
 
-    for row in reversed(recent_activity):
-        patch_url = url_for("patchrequest", id=row["id"], _external=True)
+    for event in reversed(recent_activity):
+        patch_request_id = event["patch_request_id"]
+        patch_url = url_for("patchrequest", id=patch_request_id, _external=True)
         review_patch_url = build_client_url(
-            page="review-patch", patchURL=url_for("patchrequest", id=row["id"])[1:]
+            page="review-patch",
+            patchURL=url_for("patchrequest", id=patch_request_id)[1:],
         )
-        roles = get_roles(row)
-        what_happened = get_what_happened(row)
-        who_did_it = get_who_did_it(what_happened, roles)
+        who_did_it = {"id": event["actor_id"], "name": event["actor_name"]}
 
         title = "%s %s change #%s" % (
             who_did_it["name"],
-            what_happened,
-            row["id"],
+            event["action"],
+            patch_request_id,
         )
 
-        if row["message"] is not None:
-            comments[row["id"]].append(
-                {
-                    "commenter": to_link(roles["commenter"]),
-                    "message": row["message"],
-                    "posted_at": isoformat(row["posted_at"]),
-                }
+        content = contents.get(event["id"])
+        if content is None:
+            if comments is None:
+                comments = get_comments(recent_activity)
+            content = new_contents[event["id"]] = get_content(
+                event["action"],
+                who_did_it,
+                {"id": event["submitter_id"], "name": event["submitter_name"]},
+                review_patch_url,
+                [
+                    {
+                        "commenter": to_link(
+                            {"id": row["commenter_id"], "name": row["commenter_name"]}
+                        ),
+                        "message": row["message"],
+                        "posted_at": isoformat(row["posted_at"]),
+                    }
+                    for row in comments[patch_request_id]
+                    if row["event_id"] <= event["id"]
+                ],
             )
 
-        content = get_content(
-            what_happened,
-            who_did_it,
-            roles["submitter"],
-            review_patch_url,
-            comments[row["id"]],
-        )
-
         fe = fg.add_entry()
         fe.id(patch_url)
         fe.title(title)
-        fe.updated(isoformat(row["last_update_time"]))
+        fe.updated(isoformat(event["occurred_at"]))
         fe.link(href=review_patch_url)
         fe.content(content, type="html")
 
+    if canonical and new_contents:
+        store_contents(new_contents, recent_activity)
+
     return fg.atom_str(pretty=True)
@@ -1,15 +1,147 @@
 import json
+import multiprocessing
+import multiprocessing.pool
 import re
+import threading
+from concurrent.futures import Future, InvalidStateError, TimeoutError
+from html import escape
+from periodo import app, metrics
 from pygments import highlight
 from pygments.lexers.rdf import TurtleLexer
 from pygments.lexers.data import JsonLexer
 from pygments.formatters.html import HtmlFormatter
+from typing import Optional
 
+LEXERS = {"json": JsonLexer, "turtle": TurtleLexer}
 
-def as_bytes(s, lexer) -> bytes:
-    table = highlight(
-        s, lexer, LinkifiedHtmlFormatter(linenos="table", linespans="line")
+# renders by each highlighting process before it is replaced
+RENDERS_PER_PROCESS = 100
+
+
+class HighlightingUnavailable(Exception):
+    pass
+
+
+_pool: Optional[multiprocessing.pool.Pool] = None
+# results of the renders queued or running in each pool
+_results: dict[multiprocessing.pool.Pool, set[Future]] = {}
+_pending = 0
+_lock = threading.Lock()
+
+
+def _highlight(s: str, lexer_name: str) -> str:
+    return highlight(
+        s,
+        LEXERS[lexer_name](),
+        LinkifiedHtmlFormatter(linenos="table", linespans="line"),
     )
+
+
+def get_pool() -> multiprocessing.pool.Pool:
+    global _pool
+    with _lock:
+        if _pool is None:
+            # created lazily so that each server worker gets its own, by a
+            # fork server, as forking a process running threads (e.g. the
+            # purge worker) may copy locks held by them
+            _pool = multiprocessing.get_context("forkserver").Pool(
+                processes=app.config["HIGHLIGHT_WORKERS"],
+                maxtasksperchild=RENDERS_PER_PROCESS,
+            )
+        return _pool
+
+
+def settle(future: Future, result=None, exception=None) -> None:
+    try:
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+    except InvalidStateError:
+        # already failed by shutdown_pool
+        pass
+
+
+def shutdown_pool(pool: Optional[multiprocessing.pool.Pool] = None) -> None:
+    """Terminates the highlighting processes, including any renders still
+    running in them, if `pool` is the current pool (by default, whatever
+    the current pool is). Renders queued or running in them fail at once,
+    rather than waiting until they time out."""
+    global _pool
+    with _lock:
+        if _pool is None or (pool is not None and pool is not _pool):
+            return
+        pool, _pool = _pool, None
+        results = _results.pop(pool, set())
+    pool.terminate()
+    for result in results:
+        settle(result, exception=HighlightingUnavailable("highlighting restarted"))
+
+
+def render(s: str, lexer_name: str) -> str:
+    """Returns syntax-highlighted HTML for `s`, rendered in a separate
+    process if `HIGHLIGHT_WORKERS` is greater than zero.
+
+    Raises `HighlightingUnavailable` if `HIGHLIGHT_QUEUE_SIZE` renders are
+    already queued or running, or if rendering takes longer than
+    `HIGHLIGHT_TIMEOUT` seconds. Renders that time out are stopped by
+    replacing the processes, so that they cannot pile up.
+
+    """
+    global _pending
+    if app.config["HIGHLIGHT_WORKERS"] == 0:
+        return _highlight(s, lexer_name)
+
+    with _lock:
+        if _pending >= app.config["HIGHLIGHT_QUEUE_SIZE"]:
+            metrics.increment("highlight_rejected_total")
+            raise HighlightingUnavailable("highlighting queue is full")
+        _pending += 1
+        metrics.set_gauge("highlight_queue_depth", _pending)
+
+    result: Future = Future()
+    pool = None
+    try:
+        pool = get_pool()
+        with _lock:
+            if pool is not _pool:
+                raise HighlightingUnavailable("highlighting restarted")
+            _results.setdefault(pool, set()).add(result)
+        try:
+            pool.apply_async(
+                _highlight,
+                (s, lexer_name),
+                callback=lambda html: settle(result, html),
+                error_callback=lambda e: settle(result, exception=e),
+            )
+        except ValueError as e:
+            # the pool was terminated by another thread
+            raise HighlightingUnavailable(str(e))
+        try:
+            html = result.result(timeout=app.config["HIGHLIGHT_TIMEOUT"])
+        except TimeoutError:
+            # the other renders queued or running in the same processes
+            # are lost, and fail
+            shutdown_pool(pool)
+            metrics.increment("highlight_timeouts_total")
+            raise HighlightingUnavailable("highlighting timed out")
+    finally:
+        with _lock:
+            _results.get(pool, set()).discard(result)
+            _pending -= 1
+            metrics.set_gauge("highlight_queue_depth", _pending)
+
+    metrics.increment("highlight_renders_total")
+    return html
+
+
+def as_bytes(s, lexer_name, plain=False) -> bytes:
+    if plain or len(s) > app.config["HIGHLIGHT_MAX_SIZE"]:
+        # unhighlighted, e.g. if too big to highlight without tying up a
+        # worker for a long time
+        table = f'<div class="highlight"><pre>{escape(s, quote=False)}</pre></div>'
+    else:
+        table = render(s, lexer_name)
     return f"""
 <!doctype html>
 <html lang="en">
@@ -23,13 +155,13 @@ def as_bytes(s, lexer) -> bytes:
     )
 
 
-def as_turtle(s):
-    return as_bytes(s, TurtleLexer())
+def as_turtle(s, plain=False):
+    return as_bytes(s, "turtle", plain)
 
 
-def as_json(s):
+def as_json(s, plain=False):
     return as_bytes(
-        json.dumps(s, indent=2, sort_keys=True, ensure_ascii=False), JsonLexer()
+        json.dumps(s, indent=2, sort_keys=True, ensure_ascii=False), "json", plain
     )
 
 
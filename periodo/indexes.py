@@ -0,0 +1,100 @@
+from periodo import database
+from typing import Callable, Iterable, NamedTuple
+
+# Indexes of periods, maintained as the dataset changes. Each index is a
+# table with rows of values derived from periods (e.g. their text, or
+# their temporal bounds). A row is valid from the version of the dataset
+# in which it was added until the version in which the values derived
+# from its period changed or the period was removed (or NULL while it is
+# current), so that each index can be queried for any version:
+#
+#   from_version <= ? AND (until_version IS NULL OR until_version > ?)
+#
+# Rows are never updated, except to set until_version.
+
+GetRows = Callable[[dict, dict], Iterable[tuple]]
+
+
+class Index(NamedTuple):
+    table: str
+    columns: tuple[str, ...]
+    # returns rows of values for a period, given its authority
+    get_rows: GetRows
+
+
+_indexes: list[Index] = []
+
+
+def index(table: str, columns: tuple[str, ...]):
+    "Registers a function returning the rows of an index for a period."
+
+    def decorator(f: GetRows) -> GetRows:
+        _indexes.append(Index(table, columns, f))
+        return f
+
+    return decorator
+
+
+def changed_authorities(old_data: dict, new_data: dict) -> set[str]:
+    old = old_data.get("authorities", {})
+    new = new_data.get("authorities", {})
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+
+def update_index(
+    cursor, index: Index, version: int, data: dict, authority_keys: Iterable[str]
+) -> None:
+    columns = ", ".join(index.columns)
+    for authority_key in sorted(set(authority_keys)):
+        authority = data.get("authorities", {}).get(authority_key)
+        rows = (
+            set()
+            if authority is None
+            else {
+                (period_key, *values)
+                for period_key, period in authority.get("periods", {}).items()
+                for values in index.get_rows(authority, period)
+            }
+        )
+        cursor.execute(
+            f"""
+        SELECT rowid, period_key, {columns}
+        FROM {index.table}
+        WHERE authority_key = ? AND until_version IS NULL
+        """,
+            (authority_key,),
+        )
+        indexed = {tuple(row)[1:]: row["rowid"] for row in cursor.fetchall()}
+        cursor.executemany(
+            f"UPDATE {index.table} SET until_version = ? WHERE rowid = ?",
+            [(version, rowid) for row, rowid in indexed.items() if row not in rows],
+        )
+        cursor.executemany(
+            f"""
+        INSERT INTO {index.table} (
+          authority_key, from_version, period_key, {columns})
+        VALUES (?, ?, ?, {", ".join("?" * len(index.columns))})
+        """,
+            [(authority_key, version, *row) for row in sorted(rows - set(indexed))],
+        )
+
+
+def update(cursor, version: int, data: dict, authority_keys: Iterable[str]) -> None:
+    """Updates the indexes for the periods of the given authorities, as
+    they are in `data`, which is the given version of the dataset."""
+    authority_keys = set(authority_keys)
+    for index in _indexes:
+        update_index(cursor, index, version, data, authority_keys)
+
+
+def rebuild() -> None:
+    "Indexes every version of the dataset, replacing the existing indexes."
+    with database.open_cursor(write=True) as cursor:
+        for index in _indexes:
+            cursor.execute(f"DELETE FROM {index.table}")
+        cursor.execute("SELECT id FROM dataset ORDER BY id")
+        data: dict = {}
+        for (version,) in cursor.fetchall():
+            new_data = database.get_data(version)
+            update(cursor, version, new_data, changed_authorities(data, new_data))
+            data = new_data
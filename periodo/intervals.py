@@ -0,0 +1,94 @@
+from periodo import database, indexes
+from typing import Optional
+
+# Periods are indexed by their temporal bounds: the earliest year in which
+# they may have started and the latest year in which they may have
+# stopped, as ISO 8601 years (so 1 B.C. is 0). The period_span index (see
+# indexes.py) holds the bounds for each version of the dataset, and the
+# period_span_tree R*Tree indexes them (see schema.sql), so that periods
+# overlapping a range of years are found without scanning them all.
+#
+# The R*Tree grows with the history of the dataset, as it must answer for
+# any version: responses for a given version never change and are cached
+# as such, so bounds are kept even after they have changed. The latest
+# version is instead queried using an index of the current bounds only,
+# ordered as the results are, so its cost does not grow with the history.
+
+CURRENT_QUERY = """
+SELECT
+period_key AS id,
+authority_key AS authority,
+earliest_year,
+latest_year
+FROM period_span
+WHERE until_version IS NULL
+AND latest_year >= ?
+AND earliest_year <= ?
+"""
+
+VERSIONED_QUERY = """
+SELECT
+period_span.period_key AS id,
+period_span.authority_key AS authority,
+period_span.earliest_year AS earliest_year,
+period_span.latest_year AS latest_year
+FROM period_span_tree
+JOIN period_span ON period_span.rowid = period_span_tree.id
+WHERE period_span_tree.latest_year >= ?
+AND period_span_tree.earliest_year <= ?
+AND period_span.from_version <= ?
+AND (period_span.until_version IS NULL OR period_span.until_version > ?)
+"""
+
+
+def parse_year(year) -> Optional[int]:
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_years(terminus: dict) -> list[int]:
+    timespan = terminus.get("in", {})
+    years = [
+        parse_year(timespan.get(key)) for key in ("year", "earliestYear", "latestYear")
+    ]
+    return [year for year in years if year is not None]
+
+
+@indexes.index("period_span", ("earliest_year", "latest_year"))
+def get_bounds(authority: dict, period: dict) -> list[tuple[int, int]]:
+    start_years = get_years(period.get("start", {}))
+    stop_years = get_years(period.get("stop", {}))
+    if not (start_years and stop_years):
+        # periods without bounds overlap nothing
+        return []
+    return [(min(start_years), max(stop_years))]
+
+
+def overlapping(
+    earliest: int,
+    latest: int,
+    version: Optional[int],
+    limit: int,
+    after: Optional[tuple[int, str]] = None,
+) -> list[dict]:
+    """Returns periods in the given version of the dataset (by default the
+    latest) whose bounds overlap the range of years from `earliest` to
+    `latest` (inclusive), ordered by their earliest year and then by key,
+    starting after the given (earliest year, key)."""
+    if version is None:
+        query = CURRENT_QUERY
+        params: tuple = (earliest, latest)
+    else:
+        query = VERSIONED_QUERY
+        params = (earliest, latest, version, version)
+    if after is not None:
+        query += "AND (period_span.earliest_year, period_span.period_key) > (?, ?)"
+        params += after
+    query += """
+    ORDER BY period_span.earliest_year, period_span.period_key
+    LIMIT ?
+    """
+    params += (limit,)
+    return [dict(row) for row in database.query_db_for_all(query, params)]
@@ -0,0 +1,216 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from periodo import app, database, identifier
+from typing import NamedTuple, Optional
+
+# The latest version of the dataset is published to a file, serialized
+# along with an index of the byte offsets of the context, authorities and
+# periods in it. Workers map the file into memory (sharing the pages) and
+# parse only the slices they need, instead of each keeping a parsed copy
+# of the whole dataset. A new file is published whenever the dataset
+# changes, and atomically replaces the old one.
+#
+# The file starts with the length of the index, then the index, then the
+# serialized data. Each authority is serialized with its periods, and
+# each period is a slice of its authority.
+
+HEADER = struct.Struct(">Q")
+
+json_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def encode(o) -> bytes:
+    return json_encoder.encode(o).encode("utf-8")
+
+
+def serialize(data: dict) -> tuple[bytes, dict]:
+    "Returns the serialized data and the index of offsets into it."
+    parts: list[bytes] = []
+    size = 0
+    index: dict = {"context": None, "authorities": {}, "periods": {}}
+
+    def write(b: bytes) -> int:
+        nonlocal size
+        parts.append(b)
+        size += len(b)
+        return size - len(b)
+
+    if "@context" in data:
+        index["context"] = [write(encode(data["@context"])), size]
+
+    for authority_key, authority in data.get("authorities", {}).items():
+        start = write(b"{")
+        for i, (key, value) in enumerate(authority.items()):
+            write((b", " if i > 0 else b"") + encode(key) + b": ")
+            if key == "periods":
+                write(b"{")
+                for j, (period_key, period) in enumerate(value.items()):
+                    write((b", " if j > 0 else b"") + encode(period_key) + b": ")
+                    index["periods"][period_key] = [write(encode(period)), size]
+                write(b"}")
+            else:
+                write(encode(value))
+        write(b"}")
+        index["authorities"][authority_key] = [start, size]
+
+    return b"".join(parts), index
+
+
+def get_version() -> list:
+    # the data_version counters of the database and the dataset
+    return [
+        row["version"]
+        for row in database.query_db_for_all(
+            """
+        SELECT version FROM data_version
+        WHERE name IN ('database', 'dataset')
+        ORDER BY name
+        """
+        )
+    ]
+
+
+def get_path() -> str:
+    return app.config["LATEST_DATASET_PATH"] or f"{app.config['DATABASE']}.latest"
+
+
+def publish() -> None:
+    "Publishes the latest version of the dataset for all workers to map."
+    # read the version first: if the data is newer, it is only republished
+    version = get_version()
+    dataset = database.get_dataset()
+    body, index = serialize(json.loads(dataset["data"]))
+    index["version"] = version
+    index_bytes = encode(index)
+
+    path = get_path()
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), prefix=".latest-"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(len(index_bytes)))
+            f.write(index_bytes)
+            f.write(body)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    forget_snapshot()
+
+
+class Snapshot(NamedTuple):
+    version: list
+    index: dict
+    buffer: mmap.mmap
+    offset: int
+
+    def load(self, offsets: Optional[list]):
+        if offsets is None:
+            return None
+        start, end = offsets[0], offsets[1]
+        return json.loads(self.buffer[self.offset + start : self.offset + end])
+
+
+def open_snapshot() -> Optional[Snapshot]:
+    try:
+        with open(get_path(), "rb") as f:
+            # the mapping stays valid if the file is replaced
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    (length,) = HEADER.unpack_from(buffer)
+    index = json.loads(buffer[HEADER.size : HEADER.size + length])
+    return Snapshot(index["version"], index, buffer, HEADER.size + length)
+
+
+_snapshot: Optional[Snapshot] = None
+_snapshot_generation = 0
+_snapshot_lock = threading.Lock()
+
+
+@database.on_change("dataset")
+def forget_snapshot() -> None:
+    global _snapshot, _snapshot_generation
+    with _snapshot_lock:
+        # not closed, as other threads may be reading it
+        _snapshot = None
+        _snapshot_generation += 1
+
+
+def get_snapshot() -> Snapshot:
+    global _snapshot
+    with _snapshot_lock:
+        if _snapshot is not None:
+            return _snapshot
+        generation = _snapshot_generation
+
+    snapshot = open_snapshot()
+    if snapshot is None or snapshot.version != get_version():
+        publish()
+        snapshot = open_snapshot()
+        assert snapshot is not None
+
+    with _snapshot_lock:
+        # unless the dataset changed in the meantime
+        if generation == _snapshot_generation:
+            _snapshot = snapshot
+    return snapshot
+
+
+def find_missing_key(id, version=None) -> Optional[str]:
+    "Like `database.find_missing_key`, using the index for the latest version."
+    if version is not None:
+        return database.find_missing_key(id, version)
+    index = get_snapshot().index
+    key = identifier.prefix(id)
+    authority_key = key[:7]
+    if authority_key not in index["authorities"]:
+        return authority_key
+    if key != authority_key and key not in index["periods"]:
+        return key
+    return None
+
+
+def get_period_from(snapshot: Snapshot, key: str, raiseErrors=False):
+    authority_key = key[:7]
+    if key not in snapshot.index["periods"]:
+        if raiseErrors:
+            raise database.MissingKeyError(
+                key if authority_key in snapshot.index["authorities"] else authority_key
+            )
+        return None
+    return {**snapshot.load(snapshot.index["periods"][key]), "authority": authority_key}
+
+
+def get_authority(id, version=None):
+    if version is not None:
+        return database.get_authority(id, version)
+    snapshot = get_snapshot()
+    key = identifier.prefix(id)
+    if key not in snapshot.index["authorities"]:
+        raise database.MissingKeyError(key)
+    authority = snapshot.load(snapshot.index["authorities"][key])
+    authority["@context"] = snapshot.load(snapshot.index["context"])
+    return authority
+
+
+def get_period(id, version=None):
+    if version is not None:
+        return database.get_period(id, version)
+    snapshot = get_snapshot()
+    period = get_period_from(snapshot, identifier.prefix(id), raiseErrors=True)
+    period["@context"] = snapshot.load(snapshot.index["context"])
+    return period
+
+
+def get_periods_and_context(ids, version=None, raiseErrors=False):
+    if version is not None:
+        return database.get_periods_and_context(ids, version, raiseErrors)
+    snapshot = get_snapshot()
+    periods = {id: get_period_from(snapshot, id, raiseErrors) for id in ids}
+    return periods, snapshot.load(snapshot.index["context"])
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+from periodo import metrics
+
+
+class LRUCache:
+    """A thread-safe cache holding values up to a total size in bytes.
+    When full, the least recently used values are evicted.
+
+    Hits, misses and evictions are counted in the metrics as
+    `<name>_hits_total`, `<name>_misses_total` and
+    `<name>_evictions_total`, and the total size of the cached values
+    as the `<name>_bytes` gauge.
+
+    """
+
+    def __init__(self, name: str, max_size: int):
+        self.name = name
+        self.max_size = max_size
+        self.size = 0
+        self._lock = threading.Lock()
+        self._values: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._values)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is not None:
+                self._values.move_to_end(key)
+        metrics.increment(f"{self.name}_{'misses' if entry is None else 'hits'}_total")
+        return None if entry is None else entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int) -> bool:
+        "Caches `value` if it fits. Returns whether it was cached."
+        if size > self.max_size:
+            return False
+        evictions = 0
+        with self._lock:
+            if key in self._values:
+                self.size -= self._values.pop(key)[1]
+            self._values[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self._values.popitem(last=False)
+                self.size -= evicted_size
+                evictions += 1
+            total = self.size
+        if evictions:
+            metrics.increment(f"{self.name}_evictions_total", evictions)
+        metrics.set_gauge(f"{self.name}_bytes", total)
+        return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self.size = 0
+        metrics.set_gauge(f"{self.name}_bytes", 0)
@@ -0,0 +1,42 @@
+import threading
+from typing import Union
+
+# Counters and gauges are kept per worker process, so each worker reports
+# only its own values.
+
+Number = Union[int, float]
+
+_lock = threading.Lock()
+_counters: dict[str, Number] = {}
+_gauges: dict[str, Number] = {}
+
+
+def increment(name: str, amount: Number = 1) -> None:
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name: str, value: Number) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def counter(name: str) -> Number:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def gauge(name: str) -> Number:
+    with _lock:
+        return _gauges.get(name, 0)
+
+
+def as_text() -> str:
+    "Returns all metrics in the Prometheus text exposition format."
+    lines = []
+    with _lock:
+        for kind, metrics in (("counter", _counters), ("gauge", _gauges)):
+            for name, value in sorted(metrics.items()):
+                lines.append(f"# TYPE periodo_{name} {kind}")
+                lines.append(f"periodo_{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -3,7 +3,7 @@ import re
 from functools import reduce
 from jsonpatch import JsonPatch, JsonPatchException
 from jsonpointer import JsonPointerException
-from periodo import database, void
+from periodo import database, indexes, void
 from periodo.identifier import replace_skolem_ids, IDENTIFIER_RE, IdentifierException
 
 CHANGE_PATH_PATTERN = re.compile(
@@ -106,6 +106,17 @@ def validate(patch, dataset):
     return _find_affected_entities(patch, data)
 
 
+def record_event(cursor, patch_id, action, user_id, comment_id=None):
+    "Adds an event to the activity log that the feed is made from."
+    cursor.execute(
+        """
+    INSERT INTO activity_event (patch_request_id, action, user_id, comment_id)
+    VALUES (?, ?, ?, ?)
+    """,
+        (patch_id, action, user_id, comment_id),
+    )
+
+
 def create_request(patch, user_id):
     dataset = database.get_dataset()
     affected_entities = validate(patch, dataset)
@@ -130,7 +141,9 @@ def create_request(patch, user_id):
                 patch.to_string(),
             ),
         )
-        return cursor.lastrowid
+        patch_id = cursor.lastrowid
+        record_event(cursor, patch_id, "submitted", user_id)
+        return patch_id
 
 
 def update_request(request_id, patch, user_id):
@@ -153,6 +166,7 @@ def update_request(request_id, patch, user_id):
                 request_id,
             ),
         )
+        record_event(cursor, request_id, "updated", user_id)
 
 
 def add_comment(patch_id, user_id, message):
@@ -172,6 +186,7 @@ def add_comment(patch_id, user_id, message):
         """,
             (patch_id, user_id, message),
         )
+        record_event(cursor, patch_id, "commented on", user_id, cursor.lastrowid)
 
 
 def reject(patch_id, user_id):
@@ -201,9 +216,13 @@ def reject(patch_id, user_id):
                 row["id"],
             ),
         )
+        record_event(cursor, row["id"], "rejected", user_id)
 
 
-def merge(patch_id, user_id):
+def merge(patch_id, user_id, before_commit=None):
+    """Merges a patch request into a new version of the dataset. If given,
+    `before_commit` is called with the cursor of the transaction, after
+    the dataset has been changed."""
     row = database.query_db_for_one(
         "SELECT * FROM patch_request WHERE id = ?", (patch_id,)
     )
@@ -260,6 +279,9 @@ def merge(patch_id, user_id):
             ),
         )
         version_id = _add_new_version_of_dataset(cursor, new_data)
+        indexes.update(
+            cursor, version_id, new_data, indexes.changed_authorities(data, new_data)
+        )
         cursor.execute(
             """
         UPDATE patch_request
@@ -268,6 +290,9 @@ def merge(patch_id, user_id):
         """,
             (version_id, row["id"]),
         )
+        record_event(cursor, row["id"], "merged", user_id)
+        if before_commit is not None:
+            before_commit(cursor)
 
 
 def is_mergeable(patch_text, dataset=None):
@@ -279,3 +304,68 @@ def is_mergeable(patch_text, dataset=None):
     except (JsonPatchException, JsonPointerException):
         mergeable = False
     return mergeable
+
+
+def _is_array_index(segment):
+    return segment == "-" or segment.isdigit()
+
+
+def _ancestors(path):
+    # the path and the paths of its ancestors, nearest first
+    while path:
+        yield path
+        path = path[: path.rfind("/")]
+
+
+def minimize(operations):
+    """Returns the operations of a composed patch without those that are
+    undone by later ones: operations on values that are later replaced or
+    removed (or added again) as a whole. Only values addressed through
+    object members are considered, as operations on arrays shift the
+    locations of later items. Tests were passed when the patches were
+    merged, and are left out."""
+    operations = [dict(op) for op in operations if op["op"] != "test"]
+    if any(op["op"] in ("move", "copy") for op in operations):
+        return operations
+
+    # operations replacing or removing values later in the patch, by path
+    overwritten_by = {}
+    kept = []
+    for op in reversed(operations):
+        path = op["path"]
+        if any(p in overwritten_by for p in _ancestors(path) if p != path):
+            continue
+        later = overwritten_by.get(path)
+        if later is not None:
+            if later["op"] == "add":
+                continue
+            if later["op"] == "replace":
+                if op["op"] == "add":
+                    # the value may not have existed before this operation,
+                    # and adding an object member replaces any existing one
+                    later["op"] = "add"
+                continue
+            if later["op"] == "remove" and op["op"] == "replace":
+                continue
+        kept.append(op)
+        if op["op"] in ("add", "replace", "remove") and not any(
+            _is_array_index(segment) for segment in path.split("/")[1:]
+        ):
+            overwritten_by.setdefault(path, op)
+    kept.reverse()
+    return kept
+
+
+def compose(from_version, to_version):
+    """Returns a patch changing a version of the dataset into a later one,
+    composed of the patches merged in between."""
+    rows = database.query_db_for_all(
+        """
+    SELECT applied_patch
+    FROM patch_request
+    WHERE merged = 1 AND resulted_in > ? AND resulted_in <= ?
+    ORDER BY resulted_in
+    """,
+        (from_version, to_version),
+    )
+    return minimize(op for row in rows for op in _from_text(row["applied_patch"]).patch)
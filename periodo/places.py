@@ -0,0 +1,45 @@
+import re
+from periodo import database, indexes
+
+# Periods are indexed by the IRIs of the places in their spatial coverage
+# (usually Wikidata entities). The period_place index (see indexes.py)
+# holds a row for each place covered by each period, for each version of
+# the dataset.
+
+WIKIDATA = "http://www.wikidata.org/entity/"
+
+WIKIDATA_ID = re.compile(r"^Q[1-9][0-9]*$")
+
+
+def place_iri(place) -> str:
+    # Wikidata IDs may be given without their namespace
+    return f"{WIKIDATA}{place}" if WIKIDATA_ID.match(place) else place
+
+
+@indexes.index("period_place", ("place",))
+def get_places(authority: dict, period: dict) -> list[tuple[str]]:
+    return [
+        (place.get("id", place.get("@id")),)
+        for place in period.get("spatialCoverage", [])
+        if place.get("id", place.get("@id"))
+    ]
+
+
+def covering(places: list[str], version: int) -> dict[str, list[str]]:
+    """Returns the keys of the periods covering each of the given places
+    in the given version of the dataset."""
+    periods: dict[str, list[str]] = {place: [] for place in places}
+    rows = database.query_db_for_all(
+        f"""
+    SELECT place, period_key
+    FROM period_place
+    WHERE place IN ({", ".join("?" * len(periods))})
+    AND from_version <= ?
+    AND (until_version IS NULL OR until_version > ?)
+    ORDER BY place, period_key
+    """,
+        (*periods, version, version),
+    )
+    for row in rows:
+        periods[row["place"]].append(row["period_key"])
+    return periods
@@ -0,0 +1,67 @@
+from flask import request
+from typing import NamedTuple, Optional
+
+# Representations of the dataset, authorities, periods and bags may be
+# limited to some of the properties of the authorities and periods in them
+# (?fields=id,label,start,stop), or may leave some out (?exclude=note).
+# Only the top-level properties of authorities and periods are selected.
+
+# kept in every projection
+KEPT = frozenset(("@context", "id", "type"))
+
+# kept unless excluded, as they hold or link the selected entities
+STRUCTURAL = frozenset(("authority", "periods", "primaryTopicOf"))
+
+
+def requested() -> bool:
+    return "fields" in request.args or "exclude" in request.args
+
+
+class Projection(NamedTuple):
+    fields: Optional[frozenset[str]]
+    exclude: frozenset[str]
+
+    def includes(self, key: str) -> bool:
+        if key in KEPT:
+            return True
+        if key in self.exclude:
+            return False
+        return self.fields is None or key in self.fields or key in STRUCTURAL
+
+    def period(self, period: dict) -> dict:
+        return {k: v for k, v in period.items() if self.includes(k)}
+
+    def authority(self, authority: dict) -> dict:
+        projected = {k: v for k, v in authority.items() if self.includes(k)}
+        if "periods" in projected:
+            projected["periods"] = {
+                key: self.period(period) for key, period in projected["periods"].items()
+            }
+        return projected
+
+    def dataset(self, data: dict) -> dict:
+        return {
+            **data,
+            "authorities": {
+                key: self.authority(authority)
+                for key, authority in data.get("authorities", {}).items()
+            },
+        }
+
+    def bag(self, data: dict) -> dict:
+        return {
+            **data,
+            "items": {
+                key: self.period(period) for key, period in data["items"].items()
+            },
+        }
+
+
+def get(args: dict) -> Optional[Projection]:
+    "Returns the projection requested by the parsed `PROJECTION_ARGS`, if any."
+    if "fields" not in args and "exclude" not in args:
+        return None
+    return Projection(
+        None if "fields" not in args else frozenset(args["fields"]),
+        frozenset(args.get("exclude", ())),
+    )
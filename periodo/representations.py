@@ -1,8 +1,18 @@
+import itertools
 import json
-from typing import Optional, Tuple
+from typing import Iterable, Iterator, Optional, Tuple
 from urllib.parse import urlencode
-from flask import make_response as flask_make_response, request, redirect
-from periodo import cache, routes, utils, translate, highlight
+from flask import make_response as flask_make_response, request, redirect, Response
+from periodo import (
+    artifacts,
+    cache,
+    routes,
+    utils,
+    translate,
+    tabulate,
+    highlight,
+    projection,
+)
 
 
 def abbreviate_context(data):
@@ -32,6 +42,55 @@ def abbreviate_context(data):
     return data
 
 
+# JSON representations larger than this are streamed in chunks of at least
+# this many characters
+JSON_CHUNK_SIZE = 64 * 1024
+
+json_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def iterencode_json(o, depth=3, min_items=256) -> Iterator[str]:
+    """Yields the JSON encoding of `o` in fragments. Joined, they are the
+    same as `json.dumps(o, ensure_ascii=False)`.
+
+    Objects and arrays nested deeper than `depth` are encoded in one piece
+    (which is much faster than encoding them iteratively) unless they have
+    at least `min_items` items, like the authorities of a dataset.
+
+    """
+
+    def split(o):
+        return len(o) > 0 and (depth > 0 or len(o) >= min_items)
+
+    if isinstance(o, dict) and split(o) and all(isinstance(k, str) for k in o):
+        yield "{"
+        for i, (key, value) in enumerate(o.items()):
+            yield f"{', ' if i > 0 else ''}{json_encoder.encode(key)}: "
+            yield from iterencode_json(value, depth - 1, min_items)
+        yield "}"
+    elif isinstance(o, (list, tuple)) and split(o):
+        yield "["
+        for i, value in enumerate(o):
+            if i > 0:
+                yield ", "
+            yield from iterencode_json(value, depth - 1, min_items)
+        yield "]"
+    else:
+        yield json_encoder.encode(o)
+
+
+def chunk(fragments: Iterable[str], size: int) -> Iterator[str]:
+    buffer, buffered = [], 0
+    for fragment in fragments:
+        buffer.append(fragment)
+        buffered += len(fragment)
+        if buffered >= size:
+            yield "".join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
 def make_response(data, code=200):
     return flask_make_response(data, code)
 
@@ -76,9 +135,16 @@ def redirect_to_html(content_type, headers=None):
 
 
 def output_json(data):
-    return make_response(
-        json.dumps(abbreviate_context(data), ensure_ascii=False) + "\n",
+    chunks = chunk(
+        itertools.chain(iterencode_json(abbreviate_context(data)), ["\n"]),
+        JSON_CHUNK_SIZE,
     )
+    first = next(chunks)
+    second = next(chunks, None)
+    if second is None:
+        # small enough to send in one piece (with a Content-Length)
+        return make_response(first)
+    return make_response(itertools.chain((first, second), chunks))
 
 
 def output_nt(graph):
@@ -98,12 +164,7 @@ def output_turtle(data):
 
 
 def output_csv(data):
-    try:
-        csv = translate.jsonld_to_csv(data)
-    except translate.RDFTranslationError as e:
-        return translation_failure(e)
-
-    return cache.medium_time(make_response(csv))
+    return cache.medium_time(make_response(tabulate.as_csv(data)))
 
 
 def output_turtle_as_html(data):
@@ -112,13 +173,18 @@ def output_turtle_as_html(data):
         html = highlight.as_turtle(ttl)
     except translate.RDFTranslationError as e:
         return translation_failure(e)
+    except highlight.HighlightingUnavailable:
+        return cache.no_store(make_response(highlight.as_turtle(ttl, plain=True)))
 
     return cache.short_time(make_response(html))
 
 
 def output_json_as_html(data):
     json = abbreviate_context(data)
-    html = highlight.as_json(json)
+    try:
+        html = highlight.as_json(json)
+    except highlight.HighlightingUnavailable:
+        return cache.no_store(make_response(highlight.as_json(json, plain=True)))
 
     return cache.short_time(make_response(html))
 
@@ -159,6 +225,26 @@ REPRESENTATIONS = {
     "ttl.html": output_turtle_as_html,
 }
 
+# Representations that are expensive to derive and may be precomputed
+DERIVED_CONTENT_TYPES = ("csv", "json.html", "jsonld.html", "nt", "ttl", "ttl.html")
+
+
+def is_derived(content_type: str) -> bool:
+    # projections (see projection.py) of JSON are derived, too
+    return content_type in DERIVED_CONTENT_TYPES or (
+        content_type in ("json", "jsonld") and projection.requested()
+    )
+
+
+# Cache lifetimes set by the functions above, for HEAD responses
+CACHE_TIMES = {
+    "csv": cache.medium_time,
+    "json.html": cache.short_time,
+    "jsonld.html": cache.short_time,
+    "ttl": cache.short_time,
+    "ttl.html": cache.short_time,
+}
+
 
 def get_content_type_from_request_path():
     for content_type in SHORT_CONTENT_TYPES:
@@ -175,15 +261,43 @@ def get_content_type_from_accept_header(supported_content_types):
         return content_type
 
 
+def select_content_type(supported_content_types: Tuple[str, ...]) -> str:
+    return (
+        get_content_type_from_request_path()
+        or get_content_type_from_accept_header(supported_content_types)
+        or (supported_content_types[0] if len(supported_content_types) > 0 else "json")
+    )
+
+
+def make_head_response(content_type: str, version=None) -> Response:
+    if is_derived(content_type):
+        response = artifacts.head(artifacts.request_key(content_type), version)
+        if response is not None:
+            return response
+
+    # the length is unknown without generating the representation, so
+    # use an empty iterator to stop werkzeug from setting it to zero
+    response = Response(iter(()))
+    if content_type in CACHE_TIMES:
+        CACHE_TIMES[content_type](response)
+    return response
+
+
 def make_ok_response(
     data,
     supported_content_types: Tuple[str, ...],
     as_html: bool = False,
     headers: Optional[dict] = None,
     filename: Optional[str] = None,
+    version=None,
+    serve_stale: bool = False,
 ):
     """Handles content negotation for resources with multiple representations.
 
+    `data` may be a function returning the data to be represented, in
+    which case it will only be called if the representation needs to
+    be generated.
+
     `supported_content_types` should be a tuple of suffixes (not
     including the `.`) representing content types supported by the
     resource.
@@ -202,19 +316,43 @@ def make_ok_response(
     `True`, the response will redirect to an HTMLized view of the
     selected content type.
 
+    If `version` is given, derived representations (e.g. Turtle or
+    highlighted HTML) of that version of the resource that have been
+    precomputed will be returned instead of being generated. If
+    `serve_stale` is `True`, a stored representation of a previous
+    version may be returned while the current one is generated (see
+    `artifacts.cached`).
+
+    `HEAD` requests are answered without generating the representation
+    (or calling `data`). `Content-Length` is only included if a
+    precomputed representation exists.
+
     """
     path_type = get_content_type_from_request_path()
-    accept_type = get_content_type_from_accept_header(supported_content_types)
-    content_type = (
-        path_type
-        or accept_type
-        or (supported_content_types[0] if len(supported_content_types) > 0 else "json")
-    )
+    content_type = select_content_type(supported_content_types)
 
     if as_html and content_type == "html" and not content_type.endswith(".html"):
         return redirect_to_html(path_type or "json", headers)
 
-    response = REPRESENTATIONS[content_type](data)
+    def render():
+        return REPRESENTATIONS[content_type](data() if callable(data) else data)
+
+    if request.method == "HEAD":
+        if serve_stale and is_derived(content_type):
+            cache.allow_stale()
+        response = make_head_response(content_type, version)
+    elif is_derived(content_type):
+        response = artifacts.cached(
+            artifacts.request_key(content_type),
+            version,
+            render,
+            # highlighted HTML is cached whenever it is generated
+            store=content_type.endswith(".html"),
+            serve_stale=serve_stale,
+        )
+    else:
+        response = render()
+
     response.content_type = SHORT_CONTENT_TYPES[content_type]
 
     if headers is not None:
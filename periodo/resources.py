@@ -1,23 +1,43 @@
+import base64
 import json
-from flask import request, g, abort, url_for, redirect, Response
+from flask import (
+    request,
+    g,
+    abort,
+    url_for,
+    redirect,
+    make_response,
+    stream_with_context,
+    Response,
+)
 from flask.views import MethodView
 from marshmallow import Schema, ValidationError, fields, validate
 from jsonpatch import JsonPatch
 from periodo import (
     app,
+    artifacts,
     cache,
     database,
     auth,
     identifier,
+    intervals,
+    latest,
+    lru,
     patching,
+    places,
+    projection,
     utils,
     provenance,
     representations,
+    search,
+    snapshots,
+    validators,
 )
-from typing import Optional, Tuple, Type
+from periodo.validators import Validators
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional, Tuple, Type
 from urllib.parse import urlencode
+from webargs.fields import DelimitedList
 from webargs.flaskparser import parser
-from wsgiref.handlers import format_date_time
 
 
 class W3CDTF(fields.Field):
@@ -34,10 +54,170 @@ class W3CDTF(fields.Field):
 
 
 class Resource(MethodView):
-    # this dummy method is replaced when the resource is registered
-    def make_ok_response(self, data, headers=None, filename=None) -> Response:
+    # whether requested versions of the resource do not change, and may be
+    # cached (see cache_versioned_response)
+    immutable_versions = True
+
+    # these dummy methods are replaced when the resource is registered
+    def make_ok_response(
+        self, data, headers=None, filename=None, version=None, serve_stale=False
+    ) -> Response:
         return Response()
 
+    def content_type(self) -> str:
+        return "json"
+
+    def get_validators(self, **kwargs) -> Optional[Validators]:
+        """Returns validators for the requested version of the resource,
+        or `None` if it has none. This is called before every `GET` and
+        should be cheap: it must not generate the representation."""
+        return None
+
+    def dispatch_request(self, **kwargs):
+        if request.method in ("GET", "HEAD"):
+            resource_validators = self.get_validators(**kwargs)
+            content_type = self.content_type()
+
+            def dispatch():
+                if not self.immutable_versions:
+                    return super(Resource, self).dispatch_request(**kwargs)
+                return cache_versioned_response(
+                    content_type,
+                    kwargs,
+                    lambda: super(Resource, self).dispatch_request(**kwargs),
+                )
+
+            # "html" means redirecting to an HTMLized view
+            if resource_validators is not None and not content_type == "html":
+                if not content_type == "json":
+                    resource_validators = resource_validators._replace(
+                        etag=f"{resource_validators.etag}.{content_type}"
+                    )
+                return validators.conditional(resource_validators, dispatch)
+            return dispatch()
+        return super().dispatch_request(**kwargs)
+
+
+class CachedResponse(NamedTuple):
+    headers: list[tuple[str, str]]
+    body: bytes
+    surrogate_keys: tuple[str, ...]
+
+
+# Requested versions of resources (?version=N) do not change, so each
+# worker keeps the most recently requested ones in memory
+response_cache = lru.LRUCache("response_cache", app.config["RESPONSE_CACHE_SIZE"])
+
+# the same versions may differ in a different database
+database.on_change("database")(response_cache.clear)
+
+# headers that are set anew for each response
+UNCACHED_HEADERS = ("Content-Length", "Date")
+
+
+def is_immutable(response: Response) -> bool:
+    # see cache.long_time
+    return (
+        response.status_code == 200
+        and response.cache_control.public
+        and response.cache_control.max_age == cache.LONG_TIME
+    )
+
+
+def cache_versioned_response(
+    content_type: str, kwargs: dict, dispatch: Callable[[], Any]
+) -> Response:
+    """Returns a cached response to a `GET` request for a version of a
+    resource, if there is one, otherwise calls `dispatch`. Responses
+    marked by `cache.long_time` as not changing are cached when they
+    have been sent: those of at least `SNAPSHOT_MIN_SIZE` bytes as
+    snapshot files (see `snapshots`), others in memory unless they are
+    larger than a quarter of `RESPONSE_CACHE_SIZE`."""
+    if (
+        request.method != "GET"
+        or "version" not in request.args
+        or (response_cache.max_size == 0 and not snapshots.enabled())
+        or artifacts.precomputing()
+    ):
+        return dispatch()
+
+    key = (
+        request.endpoint,
+        tuple(sorted(kwargs.items())),
+        tuple(sorted(request.args.items(multi=True))),
+        content_type,
+        # non-canonical representations include the requested URL
+        app.config["CANONICAL"] or request.host_url,
+    )
+    cached = response_cache.get(key)
+    if cached is not None:
+        cache.tag(*cached.surrogate_keys)
+        return Response(cached.body, 200, cached.headers)
+
+    snapshot_key = json.dumps(key, default=str)
+    snapshot_min_size = app.config["SNAPSHOT_MIN_SIZE"] if snapshots.enabled() else None
+    if snapshot_min_size is not None:
+        snapshot = snapshots.get(snapshot_key)
+        if snapshot is not None:
+            return snapshot
+
+    response = make_response(dispatch())
+    if not is_immutable(response):
+        return response
+
+    headers = [(k, v) for k, v in response.headers.items() if k not in UNCACHED_HEADERS]
+    surrogate_keys = cache.get_tags()
+    max_size = response_cache.max_size // 4
+
+    def store(body: bytes):
+        size = len(body) + sum(len(k) + len(v) for k, v in headers)
+        if size <= max_size:
+            response_cache.put(key, CachedResponse(headers, body, surrogate_keys), size)
+
+    if not response.is_streamed:
+        body = response.get_data()
+        if snapshot_min_size is not None and len(body) >= snapshot_min_size:
+            snapshots.save(snapshot_key, body, headers, surrogate_keys)
+        else:
+            store(body)
+        return response
+
+    def tee(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        body: Optional[list[bytes]] = []
+        size = 0
+        writer: Optional[snapshots.Writer] = None
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                if writer is not None:
+                    writer.write(chunk)
+                elif snapshot_min_size is not None and size >= snapshot_min_size:
+                    # too large to keep in memory: write it to a file
+                    writer = snapshots.Writer()
+                    for piece in body or ():
+                        writer.write(piece)
+                    writer.write(chunk)
+                    body = None
+                elif body is not None:
+                    if size <= max_size:
+                        body.append(chunk)
+                    else:
+                        body = None
+                yield chunk
+        except BaseException:
+            # including the client going away (GeneratorExit)
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is not None:
+            snapshots.put(snapshot_key, writer, headers, surrogate_keys)
+        elif body is not None:
+            store(b"".join(body))
+
+    # snapshots are recorded in the database once the body has been sent
+    response.response = stream_with_context(tee(response.iter_encoded()))
+    return response
+
 
 class ResourceError(Exception):
     def __init__(self, status, message):
@@ -125,6 +305,23 @@ def get_dataset(version=None):
     return dataset
 
 
+def get_dataset_validators(prefix, version=None) -> Optional[Validators]:
+    dataset = database.get_dataset_version(version)
+    if dataset is None:
+        return None
+    return Validators(
+        "{}-version-{}".format(prefix, dataset["id"]), dataset["created_at"]
+    )
+
+
+def get_entity_validators(kind: str, entity_id: str) -> Optional[Validators]:
+    version = request.args.get("version")
+    # missing entities are not found or gone, whatever the request's conditions
+    if latest.find_missing_key(entity_id, version) is not None:
+        return None
+    return get_dataset_validators(f"periodo-{kind}-{entity_id}", version)
+
+
 HTTP_METHODS = ["get", "put", "post", "patch", "delete"]
 
 
@@ -170,15 +367,24 @@ def register_resource(
 
     """
 
-    def make_ok_response(_, data, headers=None, filename=None):
+    content_types = (suffixes + ("html",)) if as_html else suffixes
+
+    def make_ok_response(
+        _, data, headers=None, filename=None, version=None, serve_stale=False
+    ):
         return representations.make_ok_response(
             data,
-            (suffixes + ("html",)) if as_html else suffixes,
+            content_types,
             as_html,
             headers,
             filename,
+            version,
+            serve_stale,
         )
 
+    def content_type(_):
+        return representations.select_content_type(content_types)
+
     def decorator(view_class: Type[Resource]):
         view = view_class.as_view(endpoint)
         methods = list(filter(lambda m: m in HTTP_METHODS, dir(view_class)))
@@ -212,6 +418,7 @@ def register_resource(
                         )
 
         setattr(view_class, "make_ok_response", make_ok_response)  # noqa: B010
+        setattr(view_class, "content_type", content_type)  # noqa: B010
 
         return view_class
 
@@ -232,10 +439,14 @@ def describe_endpoint(endpoint, description):
 INDEX = {
     "client": "PeriodO client (browse and edit periods)",
     "dataset": "PeriodO dataset",
+    "dataset-diff": "changes to the PeriodO dataset between two versions",
     "description": "description of the PeriodO dataset",
     "patches": "patches submitted to the PeriodO dataset",
     "history": "history of changes to the PeriodO dataset",
     "bags": "user-defined subsets of the PeriodO dataset",
+    "search": "full-text search of the periods in the PeriodO dataset",
+    "periods": "periods in the PeriodO dataset overlapping a range of years",
+    "places": "periods in the PeriodO dataset covering places",
     "identifier-map": "a map of skolem IRIs that have been replaced with persistent IRIs",
     "context": "PeriodO JSON-LD context",
     "vocabulary": "PeriodO RDF vocabulary",
@@ -257,11 +468,21 @@ class Index(Resource):
 
 VERSIONED_RESOURCE_ARGS = {"version": fields.Integer()}
 
+# see projection.py
+PROJECTION_ARGS = {
+    "fields": DelimitedList(fields.String()),
+    "exclude": DelimitedList(fields.String()),
+}
+
 
 @register_resource(
     "context", "/context", shortpath="/c", suffixes=("json",), as_html=True
 )
 class Context(Resource):
+    def get_validators(self):
+        args = parser.parse(VERSIONED_RESOURCE_ARGS, request, location="query")
+        return get_dataset_validators("periodo-context", args.get("version"))
+
     def get(self):
         args = parser.parse(VERSIONED_RESOURCE_ARGS, request, location="query")
         version = args.get("version")
@@ -271,19 +492,12 @@ class Context(Resource):
         except ResourceError as e:
             return e.response()
 
-        context_etag = "periodo-context-version-{}".format(dataset["id"])
-        if request.if_none_match.contains_weak(context_etag):
-            return "", 304
-
-        headers = {}
-        headers["Last-Modified"] = format_date_time(dataset["created_at"])
-
         context = json.loads(dataset["data"]).get("@context")
         if context is None:
             return "", 404
 
-        response = self.make_ok_response({"@context": context}, headers)
-        response.set_etag(context_etag, weak=True)
+        cache.tag_dataset(dataset["id"], latest=version is None)
+        response = self.make_ok_response({"@context": context})
 
         if version is None:
             return cache.no_time(response)
@@ -293,6 +507,10 @@ class Context(Resource):
 
 @register_resource("dataset", "/dataset/", shortpath="/d/")
 class Dataset(Resource):
+    def get_validators(self):
+        args = parser.parse(VERSIONED_RESOURCE_ARGS, request, location="query")
+        return get_dataset_validators("periodo-dataset", args.get("version"))
+
     def get(self):
         args = parser.parse(VERSIONED_RESOURCE_ARGS, request, location="query")
         version = args.get("version")
@@ -305,24 +523,31 @@ class Dataset(Resource):
         except ResourceError as e:
             return e.response()
 
-        dataset_etag = "periodo-dataset-version-{}".format(dataset["id"])
-        if request.if_none_match.contains_weak(dataset_etag):
-            return "", 304
-
-        headers = {}
-        headers["Last-Modified"] = format_date_time(dataset["created_at"])
+        cache.tag_dataset(dataset["id"], latest=version is None)
+        projected = projection.get(
+            parser.parse(PROJECTION_ARGS, request, location="query")
+        )
 
-        data = json.loads(dataset["data"])
-        if version is not None and "@context" in data:
-            data["@context"]["__version"] = version
-        if "inline-context" in request.args:
-            data["@context"]["__inline"] = True
+        def load_data():
+            data = json.loads(dataset["data"])
+            if version is not None and "@context" in data:
+                data["@context"]["__version"] = version
+            if "inline-context" in request.args:
+                data["@context"]["__inline"] = True
+            if projected is not None:
+                data = projected.dataset(data)
+            return attach_to_dataset(data)
 
         response = self.make_ok_response(
-            attach_to_dataset(data), headers, filename=filename
+            load_data,
+            filename=filename,
+            version=dataset["id"],
+            serve_stale=version is None,
         )
-        response.set_etag(dataset_etag, weak=True)
 
+        if response.status_code != 200:
+            # e.g. if translating to Turtle failed
+            return cache.no_store(response)
         if version is None:
             return cache.short_time(response, server_only=True)
         else:
@@ -341,14 +566,84 @@ class Dataset(Resource):
             return {"status": 400, "message": str(e)}, 400
 
 
+@register_resource(
+    "dataset-diff", "/dataset/diff", shortpath="/d/diff", suffixes=("json",)
+)
+class DatasetDiff(Resource):
+    DIFF_ARGS = {
+        "from": fields.Integer(required=True),
+        "to": fields.Integer(),
+    }
+
+    def get_validators(self):
+        args = parser.parse(self.DIFF_ARGS, request, location="query")
+        dataset = database.get_dataset_version(args.get("to"))
+        if dataset is None:
+            return None
+        return Validators(
+            "periodo-dataset-diff-{}-{}".format(args["from"], dataset["id"]),
+            dataset["created_at"],
+        )
+
+    def get(self):
+        args = parser.parse(self.DIFF_ARGS, request, location="query")
+        to_version = args.get("to")
+        from_dataset = database.get_dataset_version(args["from"])
+        to_dataset = database.get_dataset_version(to_version)
+        if from_dataset is None or to_dataset is None:
+            return ResourceError(404, "Could not find given version.").response()
+        if from_dataset["id"] > to_dataset["id"]:
+            return ResourceError(
+                400, "The from version must not be after the to version."
+            ).response()
+
+        cache.tag_dataset(to_dataset["id"], latest=to_version is None)
+        filename = "periodo-dataset-diff-v{}-v{}".format(
+            from_dataset["id"], to_dataset["id"]
+        )
+
+        def render():
+            return self.make_ok_response(
+                lambda: patching.compose(from_dataset["id"], to_dataset["id"]),
+                filename=filename,
+            )
+
+        if request.method == "HEAD":
+            response = render()
+        else:
+            # the diff between two versions never changes
+            response = artifacts.cached(
+                artifacts.request_key("json"),
+                "{}-{}".format(from_dataset["id"], to_dataset["id"]),
+                render,
+                store=True,
+            )
+
+        # the diff to the latest version is purged from the server cache
+        # by its surrogate keys when a patch is merged
+        if to_version is None:
+            return cache.until_tag_purged(response)
+        else:
+            return cache.long_time(response)
+
+
 @register_resource(
     "history", "/history", shortpath="/h", suffixes=("nt",), register_basepath=False
 )
 class History(Resource):
+    def get_validators(self):
+        return Validators(
+            "periodo-history-version-{}".format(database.get_history_version()),
+            database.get_history_last_modified(),
+        )
+
     def get(self):
+        cache.tag("history")
         response = self.make_ok_response(
-            provenance.history(include_entity_details=("full" in request.args)),
+            lambda: provenance.history(include_entity_details=("full" in request.args)),
             filename="periodo-history",
+            version=database.get_history_version(),
+            serve_stale=True,
         )
         return cache.medium_time(response, server_only=True)
 
@@ -362,20 +657,59 @@ class History(Resource):
     as_html=True,
 )
 class Authority(Resource):
+    def get_validators(self, authority_id):
+        return get_entity_validators("authority", authority_id)
+
     def get(self, authority_id):
         version = request.args.get("version")
         new_location = redirect_to_last_update(authority_id, version)
         if new_location is not None:
             return new_location
+        # check before negotiating, as HEAD requests never load the data
+        missing_key = latest.find_missing_key(authority_id, version)
+        if missing_key is not None:
+            abort_gone_or_not_found(missing_key)
+        if version is None:
+            # not tagged with the latest dataset version, as merges purge
+            # only the entities they change (or all, see purge_all_entities)
+            cache.tag(identifier.prefix(authority_id), "entities")
+        else:
+            cache.tag_dataset(version, latest=False)
         try:
-            authority = attach_to_dataset(database.get_authority(authority_id, version))
             filename = "periodo-authority-{}{}".format(
                 authority_id, "" if version is None else "-v{}".format(version)
             )
-            return self.make_ok_response(authority, filename=filename)
+            projected = projection.get(
+                parser.parse(PROJECTION_ARGS, request, location="query")
+            )
+
+            def load_data():
+                authority = latest.get_authority(authority_id, version)
+                if projected is not None:
+                    authority = projected.authority(authority)
+                return attach_to_dataset(authority)
+
+            response = self.make_ok_response(
+                load_data,
+                filename=filename,
+                version=version or database.get_latest_version(),
+            )
         except database.MissingKeyError as e:
             abort_gone_or_not_found(e.key)
 
+        if response.status_code != 200:
+            # e.g. if translating to Turtle failed
+            return cache.no_store(response)
+        # the latest version is purged from the server cache when a
+        # merged patch changes it, but projections of it only by their
+        # surrogate keys
+        if version is None and projection.requested():
+            return cache.until_tag_purged(response)
+        if version is None:
+            return cache.long_time(response, server_only=True)
+        else:
+            return cache.long_time(response)
+
 
 @register_resource(
     "period",
@@ -386,36 +720,288 @@ class Authority(Resource):
     as_html=True,
 )
 class Period(Resource):
+    def get_validators(self, period_id):
+        return get_entity_validators("period", period_id)
+
     def get(self, period_id):
         version = request.args.get("version")
         new_location = redirect_to_last_update(period_id, version)
         if new_location is not None:
             return new_location
+        # check before negotiating, as HEAD requests never load the data
+        missing_key = latest.find_missing_key(period_id, version)
+        if missing_key is not None:
+            abort_gone_or_not_found(missing_key)
+        if version is None:
+            # not tagged with the latest dataset version, as merges purge
+            # only the entities they change (or all, see purge_all_entities)
+            cache.tag(identifier.prefix(period_id), "entities")
+        else:
+            cache.tag_dataset(version, latest=False)
         try:
-            period = attach_to_dataset(database.get_period(period_id, version))
             filename = "periodo-period-{}{}".format(
                 period_id, "" if version is None else "-v{}".format(version)
             )
-            return self.make_ok_response(period, filename=filename)
+            projected = projection.get(
+                parser.parse(PROJECTION_ARGS, request, location="query")
+            )
+
+            def load_data():
+                period = latest.get_period(period_id, version)
+                if projected is not None:
+                    period = projected.period(period)
+                return attach_to_dataset(period)
+
+            response = self.make_ok_response(
+                load_data,
+                filename=filename,
+                version=version or database.get_latest_version(),
+            )
         except database.MissingKeyError as e:
             abort_gone_or_not_found(e.key)
 
+        if response.status_code != 200:
+            # e.g. if translating to Turtle failed
+            return cache.no_store(response)
+        # the latest version is purged from the server cache when a
+        # merged patch changes it, but projections of it only by their
+        # surrogate keys
+        if version is None and projection.requested():
+            return cache.until_tag_purged(response)
+        if version is None:
+            return cache.long_time(response, server_only=True)
+        else:
+            return cache.long_time(response)
+
 
-PATCH_QUERY = """
-SELECT patch_request.*, comment.message AS first_comment
-FROM patch_request
-LEFT JOIN (
-  SELECT patch_request_id, message
-  FROM patch_request_comment
-  WHERE id IN (
-    SELECT MIN(id)
-    FROM patch_request_comment
-    GROUP BY patch_request_id
-  )
-)
-AS comment
-ON comment.patch_request_id = patch_request.id
-"""
+@register_resource("search", "/search", suffixes=("json",))
+class Search(Resource):
+    SEARCH_ARGS = {
+        "q": fields.String(load_default=""),
+        "version": fields.Integer(),
+        "limit": fields.Integer(load_default=25),
+        "from": fields.Integer(load_default=0),
+    }
+
+    def get_validators(self):
+        args = parser.parse(self.SEARCH_ARGS, request, location="query")
+        return get_dataset_validators("periodo-search", args.get("version"))
+
+    def get(self):
+        args = parser.parse(self.SEARCH_ARGS, request, location="query")
+        version = args.get("version")
+        dataset = database.get_dataset_version(version)
+        if dataset is None:
+            if version:
+                return ResourceError(404, "Could not find given version.").response()
+            return ResourceError(501, "No dataset loaded yet.").response()
+
+        limit = args["limit"]
+        if limit < 0:
+            limit = 25
+        if limit > 250:
+            limit = 250
+        offset = max(args["from"], 0)
+
+        # fetch 1 more than the limit to know whether there is a next page
+        results = search.search(args["q"], dataset["id"], limit + 1, offset)
+        more = len(results) > limit
+        results = results[:limit]
+
+        def page_url(offset):
+            params = {k: v for k, v in request.args.items() if k != "from"}
+            params["from"] = str(offset)
+            return "{}?{}".format(url_for("search", _external=True), urlencode(params))
+
+        link_headers = []
+        if offset > 0:
+            link_headers.append(
+                '<{}>; rel="prev"'.format(page_url(max(offset - limit, 0)))
+            )
+        if more:
+            link_headers.append('<{}>; rel="next"'.format(page_url(offset + limit)))
+        headers = {"Link": ", ".join(link_headers)} if link_headers else {}
+
+        cache.tag_dataset(dataset["id"], latest=version is None)
+        response = self.make_ok_response(
+            {
+                "query": args["q"],
+                "version": dataset["id"],
+                "results": [
+                    {**result, "url": url_for("period", period_id=result["id"])}
+                    for result in results
+                ],
+            },
+            headers,
+            filename="periodo-search",
+        )
+
+        # the latest results are purged from the server cache by their
+        # surrogate keys when a patch is merged
+        if version is None:
+            return cache.until_tag_purged(response)
+        else:
+            return cache.long_time(response)
+
+
+def parse_year_range(value: str) -> Tuple[int, int]:
+    try:
+        earliest, latest = (int(year) for year in value.split(","))
+    except ValueError as e:
+        raise ResourceError(
+            400, "Years must be given as two ISO 8601 years, e.g. -0799,-0546."
+        ) from e
+    if earliest > latest:
+        raise ResourceError(400, "The first year must not be after the second.")
+    return earliest, latest
+
+
+@register_resource("periods", "/periods", suffixes=("json",))
+class Periods(Resource):
+    PERIODS_ARGS = {
+        "overlaps": fields.String(required=True),
+        "version": fields.Integer(),
+        "limit": fields.Integer(load_default=100),
+        "after": fields.String(),
+    }
+
+    def get_validators(self):
+        args = parser.parse(self.PERIODS_ARGS, request, location="query")
+        return get_dataset_validators("periodo-periods", args.get("version"))
+
+    def get(self):
+        args = parser.parse(self.PERIODS_ARGS, request, location="query")
+        version = args.get("version")
+        dataset = database.get_dataset_version(version)
+        if dataset is None:
+            if version:
+                return ResourceError(404, "Could not find given version.").response()
+            return ResourceError(501, "No dataset loaded yet.").response()
+        try:
+            earliest, latest_year = parse_year_range(args["overlaps"])
+            after = None if "after" not in args else decode_period_cursor(args["after"])
+        except ResourceError as e:
+            return e.response()
+
+        limit = args["limit"]
+        if limit < 0:
+            limit = 100
+        if limit > 1000:
+            limit = 1000
+
+        # fetch 1 more than the limit to know whether there is a next page
+        rows = intervals.overlapping(earliest, latest_year, version, limit + 1, after)
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        if "full" in request.args:
+            periods, _ = latest.get_periods_and_context(
+                [row["id"] for row in rows], version
+            )
+        else:
+            periods = {}
+
+        headers = {}
+        if more:
+            params = {k: v for k, v in request.args.items() if k != "after"}
+            params["after"] = encode_period_cursor(rows[-1])
+            headers["Link"] = '<{}?{}>; rel="next"'.format(
+                url_for("periods", _external=True), urlencode(params)
+            )
+
+        cache.tag_dataset(dataset["id"], latest=version is None)
+        response = self.make_ok_response(
+            {
+                "overlaps": [earliest, latest_year],
+                "version": dataset["id"],
+                "periods": [
+                    {
+                        "id": row["id"],
+                        "authority": row["authority"],
+                        "earliestYear": row["earliest_year"],
+                        "latestYear": row["latest_year"],
+                        "url": url_for("period", period_id=row["id"]),
+                        **({"period": periods[row["id"]]} if periods else {}),
+                    }
+                    for row in rows
+                ],
+            },
+            headers,
+            filename="periodo-periods",
+        )
+
+        # the latest results are purged from the server cache by their
+        # surrogate keys when a patch is merged
+        if version is None:
+            return cache.until_tag_purged(response)
+        else:
+            return cache.long_time(response)
+
+
+def encode_period_cursor(row) -> str:
+    # opaque to clients, who should only follow links
+    return (
+        base64.urlsafe_b64encode(json.dumps([row["earliest_year"], row["id"]]).encode())
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_period_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        earliest_year, id = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+    except ValueError as e:
+        raise ResourceError(400, "Invalid page cursor.") from e
+    if not (isinstance(earliest_year, int) and isinstance(id, str)):
+        raise ResourceError(400, "Invalid page cursor.")
+    return earliest_year, id
+
+
+@register_resource("places", "/places", suffixes=("json",))
+class Places(Resource):
+    PLACES_ARGS = {
+        "place": fields.List(fields.String(), required=True),
+        "version": fields.Integer(),
+    }
+    MAX_PLACES = 100
+
+    def get_validators(self):
+        args = parser.parse(self.PLACES_ARGS, request, location="query")
+        return get_dataset_validators("periodo-places", args.get("version"))
+
+    def get(self):
+        args = parser.parse(self.PLACES_ARGS, request, location="query")
+        version = args.get("version")
+        dataset = database.get_dataset_version(version)
+        if dataset is None:
+            if version:
+                return ResourceError(404, "Could not find given version.").response()
+            return ResourceError(501, "No dataset loaded yet.").response()
+        if len(args["place"]) > self.MAX_PLACES:
+            return ResourceError(
+                400, f"At most {self.MAX_PLACES} places may be given."
+            ).response()
+
+        periods = places.covering(
+            [places.place_iri(place) for place in args["place"]], dataset["id"]
+        )
+
+        cache.tag_dataset(dataset["id"], latest=version is None)
+        response = self.make_ok_response(
+            {"version": dataset["id"], "places": periods}, filename="periodo-places"
+        )
+
+        # the latest results are purged from the server cache by their
+        # surrogate keys when a patch is merged
+        if version is None:
+            return cache.until_tag_purged(response)
+        else:
+            return cache.long_time(response)
+
+
+PATCH_QUERY = "SELECT patch_request.* FROM patch_request"
 
 
 class PatchRequestSchema(Schema):
@@ -459,12 +1045,26 @@ class PatchRequestList(Resource):
         "merged": fields.Boolean(),
         "limit": fields.Integer(load_default=25),
         "from": fields.Integer(load_default=0),
+        "after": fields.String(),
+        "before": fields.String(),
     }
 
+    def get_validators(self):
+        version, last_modified = database.get_patch_requests_version()
+        return Validators(f"periodo-patches-version-{version}", last_modified)
+
     def get(self):
         args = parser.parse(self.PATCH_REQUEST_LIST_ARGS, request, location="query")
+        cache.tag("patches")
+        try:
+            return self.get_page(args)
+        except ResourceError as e:
+            return e.response()
+
+    def get_page(self, args):
+        sort, order = args["sort"], args["order"]
         query = PATCH_QUERY
-        params = ()
+        params: tuple = ()
 
         where = []
         if "open" in args:
@@ -473,10 +1073,25 @@ class PatchRequestList(Resource):
         if "merged" in args:
             where.append("merged = ?")
             params += (args.get("merged"),)
+
+        # Pages start after (or end before) the patch request identified by
+        # a cursor, so that later pages are found using the indexes on
+        # (sort, id) as quickly as the first one
+        cursor = args.get("after") or args.get("before")
+        backwards = "after" not in args and "before" in args
+        if cursor is not None:
+            value, id = decode_cursor(cursor, sort, order)
+            comparison = ">" if (order == "asc") != backwards else "<"
+            where.append(f"({sort}, patch_request.id) {comparison} (?, ?)")
+            params += (value, id)
+
         if where:
             query += f" WHERE {' AND '.join(where)}"
 
-        query += f" ORDER by {args['sort']} {args['order']}, patch_request.id DESC"
+        direction = order.upper()
+        if backwards:
+            direction = "DESC" if direction == "ASC" else "ASC"
+        query += f" ORDER BY {sort} {direction}, patch_request.id {direction}"
 
         limit = args["limit"]
         if limit < 0:
@@ -484,56 +1099,79 @@ class PatchRequestList(Resource):
         if limit > 250:
             limit = 250
 
+        query += f" LIMIT {limit + 1}"
+
+        # offsets are still accepted, but not used in links
         offset = args["from"]
-        if offset < 0:
-            offset = 0
-        query += f" LIMIT {limit + 1} OFFSET {offset}"
+        if cursor is None and offset > 0:
+            query += f" OFFSET {offset}"
 
         rows = database.query_db_for_all(query, params)
-        data = [process_patch_row(row) for row in rows][:limit]
-        count = database.query_db_for_one(
-            "SELECT COUNT(*) AS count FROM patch_request"
-        )["count"]
+        # We fetched 1 more than the limit. If there are limit+1 rows in the
+        # retrieved query, then there are more rows to be fetched
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        data = [process_patch_row(row) for row in rows]
 
         link_headers = []
 
-        if offset > 0:
-            prev_url = url_for("patches", _external=True)
-
-            prev_params = request.args.to_dict().copy()
-            prev_params["from"] = offset - limit
-            if prev_params["from"] <= 0:
-                prev_params.pop("from")
-
-            prev_params = urlencode(prev_params)
-            if prev_params:
-                prev_url += "?" + prev_params
-
-            link_headers.append('<{}>; rel="prev"'.format(prev_url))
+        def page_url(param, row):
+            params = {
+                k: v
+                for k, v in request.args.items()
+                if k not in ("from", "after", "before")
+            }
+            params[param] = encode_cursor(row, sort, order)
+            return "{}?{}".format(url_for("patches", _external=True), urlencode(params))
 
-        # We fetched 1 more than the limit. If there are limit+1 rows in the
-        # retrieved query, then there are more rows to be fetched
-        if len(rows) > limit:
-            next_url = url_for("patches", _external=True)
-            next_params = request.args.to_dict().copy()
+        if rows and (more if backwards else (cursor is not None or offset > 0)):
+            link_headers.append('<{}>; rel="prev"'.format(page_url("before", rows[0])))
 
-            next_params["from"] = offset + limit
-            link_headers.append(
-                '<{}?{}>; rel="next"'.format(next_url, urlencode(next_params))
-            )
+        if rows and (cursor is not None if backwards else more):
+            link_headers.append('<{}>; rel="next"'.format(page_url("after", rows[-1])))
 
         headers = {}
 
         if link_headers:
             headers["Link"] = ", ".join(link_headers)
 
-        headers["X-Total-Count"] = count
+        headers["X-Total-Count"] = database.count_patch_requests()
+        headers["X-Filtered-Count"] = database.count_patch_requests(
+            args.get("open"), args.get("merged")
+        )
 
         return self.make_ok_response(
             patchRequestListSchema.dump(data), headers, filename="periodo-patches"
         )
 
 
+def encode_cursor(row, sort: str, order: str) -> str:
+    # opaque to clients, who should only follow links
+    return (
+        base64.urlsafe_b64encode(
+            json.dumps([sort, order, row[sort], row["id"]]).encode()
+        )
+        .decode()
+        .rstrip("=")
+    )
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> Tuple[int, int]:
+    try:
+        cursor_sort, cursor_order, value, id = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+    except ValueError as e:
+        raise ResourceError(400, "Invalid page cursor.") from e
+    if (cursor_sort, cursor_order) != (sort, order):
+        raise ResourceError(400, "Page cursor is for a different sort order.")
+    if not (isinstance(value, int) and isinstance(id, int)):
+        raise ResourceError(400, "Invalid page cursor.")
+    return value, id
+
+
 class CommentSchema(Schema):
     author = fields.String()
     posted_at = W3CDTF()
@@ -550,12 +1188,20 @@ patchSchema = PatchSchema()
 
 @register_resource("patchrequest", "/patches/<int:id>/", suffixes=("json",))
 class PatchRequest(Resource):
+    def get_validators(self, id):
+        patch_request_version = database.get_patch_request_version(id)
+        if patch_request_version is None:
+            return None
+        version, last_modified = patch_request_version
+        return Validators(f"periodo-patch-{id}-version-{version}", last_modified)
+
     def get(self, id):
         row = database.query_db_for_one(
             PATCH_QUERY + " where patch_request.id = ?", (id,)
         )
         if not row:
             abort(404)
+        cache.tag(f"patch-{id}")
         data = process_patch_row(row)
         data["mergeable"] = patching.is_mergeable(data["original_patch"])
         data["comments"] = [dict(c) for c in database.get_patch_request_comments(id)]
@@ -584,6 +1230,7 @@ class Patch(Resource):
         )
         if not row:
             abort(404)
+        cache.tag(f"patch-{id}")
         if row["merged"]:
             patch = row["applied_patch"]
         else:
@@ -610,11 +1257,19 @@ class Patch(Resource):
 class PatchMerge(Resource):
     @auth.accept_patch_permission.require()
     def post(self, id):
-        try:
-            patching.merge(id, g.identity.id)
+        def purge(cursor):
+            cache.purge_patch_request(id)
             cache.purge_history()
             cache.purge_dataset()
             cache.purge_graphs()
+            cache.purge_patch_entities(id)
+            # committed along with the merge, so that they are not lost
+            cache.enqueue_request_purges_in(cursor)
+
+        try:
+            patching.merge(id, g.identity.id, before_commit=purge)
+            latest.publish()
+            artifacts.enqueue_precompute(id)
             return "", 204
         except patching.UnmergeablePatchError as e:
             return {"message": str(e)}, 400
@@ -628,6 +1283,7 @@ class PatchReject(Resource):
     def post(self, id):
         try:
             patching.reject(id, g.identity.id)
+            cache.purge_patch_request(id)
             return "", 204
         except patching.MergeError as e:
             return {"message": str(e)}, 404
@@ -649,6 +1305,8 @@ class PatchMessages(Resource):
 
         try:
             patching.add_comment(id, g.identity.id, message)
+            cache.purge_patch_request(id)
+            cache.purge_history()
             return "", 200, {"Location": url_for("patchrequest", id=id)}
         except patching.MergeError as e:
             return {"message": str(e)}, 404
@@ -660,16 +1318,16 @@ class PatchMessages(Resource):
     suffixes=("json",),
 )
 class IdentifierMap(Resource):
-    def get(self):
-        identifier_map, last_edited = database.get_identifier_map()
+    def get_validators(self):
+        version, last_modified = database.get_identifier_map_version()
+        return Validators(f"periodo-identifier-map-version-{version}", last_modified)
 
-        headers = {}
-        if last_edited is not None:
-            headers["Last-Modified"] = format_date_time(last_edited)
+    def get(self):
+        cache.tag("identifier-map")
+        identifier_map, _ = database.get_identifier_map()
 
         response = self.make_ok_response(
             {"identifier_map": identifier_map},
-            headers,
             filename="periodo-identifier-map",
         )
 
@@ -679,6 +1337,7 @@ class IdentifierMap(Resource):
 @register_resource("bags", "/bags/", suffixes=("json",), as_html=True)
 class Bags(Resource):
     def get(self):
+        cache.tag("bags")
         return self.make_ok_response(
             [
                 url_for("bag", uuid=uuid, _external=True)
@@ -689,6 +1348,9 @@ class Bags(Resource):
 
 @register_resource("bag", "/bags/<uuid:uuid>", suffixes=("json",), as_html=True)
 class Bag(Resource):
+    # the items of each version are taken from the latest dataset
+    immutable_versions = False
+
     @auth.update_bag_permission.require()
     def put(self, uuid):
         try:
@@ -705,7 +1367,7 @@ class Bag(Resource):
             return {"message": "A bag must have at least two items"}, 400
 
         try:
-            _, ctx = database.get_periods_and_context(items, raiseErrors=True)
+            _, ctx = latest.get_periods_and_context(items, raiseErrors=True)
         except database.MissingKeyError as e:
             return {"message": "No resource with key: " + e.key}, 400
 
@@ -730,8 +1392,18 @@ class Bag(Resource):
             return "", 403
 
         version = database.create_or_update_bag(uuid, g.identity.id, data)
+        cache.purge_bag(uuid)
         return "", 201, {"Location": url_for("bag", uuid=uuid, version=version)}
 
+    def get_validators(self, uuid):
+        args = parser.parse(VERSIONED_RESOURCE_ARGS, request, location="query")
+        bag = database.get_bag(uuid, version=args.get("version"))
+        if bag is None:
+            return None
+        return Validators(
+            "bag-{}-version-{}".format(uuid, bag["version"]), bag["created_at"]
+        )
+
     def get(self, uuid):
         args = parser.parse(VERSIONED_RESOURCE_ARGS, request, location="query")
         version = args.get("version")
@@ -740,22 +1412,21 @@ class Bag(Resource):
         if not bag:
             abort(404)
 
-        bag_etag = "bag-{}-version-{}".format(uuid, bag["version"])
-        if request.if_none_match.contains_weak(bag_etag):
-            return "", 304
-
-        headers = {}
-        headers["Last-Modified"] = format_date_time(bag["created_at"])
-
         data = json.loads(bag["data"])
-        defs, _ = database.get_periods_and_context(data["items"])
+        defs, _ = latest.get_periods_and_context(data["items"])
+        # the items are taken from the latest version of the dataset
+        cache.tag(f"bag-{uuid}", *data["items"])
 
         data["@id"] = identifier.prefix("bags/%s" % uuid)
         data["creator"] = bag["created_by"]
         data["items"] = defs
+        projected = projection.get(
+            parser.parse(PROJECTION_ARGS, request, location="query")
+        )
+        if projected is not None:
+            data = projected.bag(data)
 
-        response = self.make_ok_response(data, headers)
-        response.set_etag(bag_etag, weak=True)
+        response = self.make_ok_response(data)
 
         if version is None:
             return cache.no_time(response)
@@ -791,13 +1462,40 @@ def get_graphs(prefix=None):
 
 @register_resource("graphs", "/graphs/", suffixes=("json",))
 class Graphs(Resource):
+    def get_validators(self):
+        return Validators(
+            "periodo-graphs-version-{}-{}".format(
+                database.get_graphs_version(), database.get_latest_version()
+            )
+        )
+
     def get(self):
-        data = get_graphs()
-        dataset = database.get_dataset()
-        if dataset:
-            dataset_url = url_for("dataset-short", _external=True)
-            data["graphs"][dataset_url] = json.loads(dataset["data"])
-        return cache.medium_time(self.make_ok_response(data, filename="periodo-graphs"))
+        cache.tag("graphs")
+        latest_version = database.get_latest_version()
+        if latest_version is not None:
+            cache.tag_dataset(latest_version, latest=True)
+
+        def load_data():
+            data = get_graphs()
+            dataset = database.get_dataset()
+            if dataset:
+                dataset_url = url_for("dataset-short", _external=True)
+                data["graphs"][dataset_url] = json.loads(dataset["data"])
+            return data
+
+        def render():
+            return self.make_ok_response(load_data, filename="periodo-graphs")
+
+        if request.method == "HEAD":
+            response = render()
+        else:
+            # expensive to generate, so coalesce concurrent requests
+            response = artifacts.cached(
+                artifacts.request_key("json"),
+                "{}-{}".format(database.get_graphs_version(), latest_version),
+                render,
+            )
+        return cache.medium_time(response)
 
 
 @register_resource("graph", "/graphs/<path:id>", suffixes=("json",))
@@ -814,11 +1512,27 @@ class Graph(Resource):
         except ResourceError as e:
             return e.response()
 
+    def get_validators(self, id):
+        prefix = id[:-1] if id.endswith("/") else id
+        if database.has_graphs(prefix):
+            return Validators(
+                "graphs-{}-version-{}".format(prefix, database.get_graphs_version())
+            )
+
+        args = parser.parse(VERSIONED_RESOURCE_ARGS, request, location="query")
+        graph = database.get_graph_version(id, version=args.get("version"))
+        if graph is None:
+            return None
+        return Validators(
+            "graph-{}-version-{}".format(id, graph["version"]), graph["created_at"]
+        )
+
     def get(self, id):
         data = get_graphs(prefix=id)
         filename = "periodo-graph-{}".format(id.replace("/", "-"))
 
         if len(data["graphs"]) > 0:
+            cache.tag("graphs")
             return cache.medium_time(self.make_ok_response(data, filename=filename))
 
         args = parser.parse(VERSIONED_RESOURCE_ARGS, request, location="query")
@@ -829,16 +1543,9 @@ class Graph(Resource):
         if not graph:
             abort(404)
 
-        graph_etag = "graph-{}-version-{}".format(id, graph["version"])
-        if request.if_none_match.contains_weak(graph_etag):
-            return "", 304
-
-        headers = {}
-        headers["Last-Modified"] = format_date_time(graph["created_at"])
-
+        cache.tag(f"graph-{id}")
         data = graph_container(external_graph_url(graph, version), [graph], version)
-        response = self.make_ok_response(data, headers, filename=filename)
-        response.set_etag(graph_etag, weak=True)
+        response = self.make_ok_response(data, filename=filename)
 
         if version is None:
             return cache.medium_time(response)
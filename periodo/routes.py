@@ -1,3 +1,4 @@
+import hmac
 import json
 import random
 import httpx
@@ -13,7 +14,18 @@ from flask import (
     stream_with_context,
 )
 from markupsafe import escape
-from periodo import app, database, identifier, auth, highlight
+from periodo import (
+    app,
+    artifacts,
+    cache,
+    database,
+    identifier,
+    auth,
+    highlight,
+    metrics,
+    validators,
+)
+from periodo.validators import Validators
 from urllib.parse import urlencode
 from werkzeug.http import http_date
 from periodo.feed import generate_activity_feed
@@ -64,8 +76,10 @@ def vocab():
 def void():
     if request.accept_mimetypes.best == "text/html":
         return redirect(url_for("void_as_html"), code=303)
+    dataset = database.get_dataset()
+    cache.tag_dataset(dataset["id"], latest=True)
     return make_response(
-        database.get_dataset()["description"],
+        dataset["description"],
         200,
         {
             "Content-Type": "text/turtle",
@@ -77,14 +91,23 @@ def void():
 @app.route("/.well-known/void.ttl.html")
 @app.route("/.wellknown/void.ttl.html")
 def void_as_html():
-    ttl = database.get_dataset()["description"]
-    return make_response(
-        highlight.as_turtle(ttl),
-        200,
-        {
+    dataset = database.get_dataset()
+    cache.tag_dataset(dataset["id"], latest=True)
+
+    def render():
+        headers = {
             "Content-Type": "text/html; charset=utf-8",
             "Link": '</>; rel="alternate"; type="text/html"',
-        },
+        }
+        try:
+            html = highlight.as_turtle(dataset["description"])
+        except highlight.HighlightingUnavailable:
+            html = highlight.as_turtle(dataset["description"], plain=True)
+            headers["Cache-Control"] = "no-store"
+        return make_response(html, 200, headers)
+
+    return artifacts.cached(
+        artifacts.request_key("ttl.html"), dataset["id"], render, serve_stale=True
     )
 
 
@@ -230,7 +253,36 @@ def registered():
 def export():
     def generate():
         for line in database.dump():
-            if not line.startswith('INSERT INTO "user"'):
+            # skip user credentials, worker state, and indexes, which are
+            # rebuilt after importing
+            if not line.startswith(
+                (
+                    # the full-text and R*Tree indexes, their shadow tables,
+                    # and the triggers that maintain them
+                    "INSERT INTO sqlite_master(type,name,tbl_name,rootpage,sql)"
+                    "VALUES('table','period_search'",
+                    "INSERT INTO sqlite_master(type,name,tbl_name,rootpage,sql)"
+                    "VALUES('table','period_span_tree'",
+                    "CREATE TABLE 'period_search_",
+                    'CREATE TABLE "period_span_tree_',
+                    'INSERT INTO "period_search',
+                    'INSERT INTO "period_span_tree',
+                    "CREATE TRIGGER period_text_inserted ",
+                    "CREATE TRIGGER period_text_deleted ",
+                    "CREATE TRIGGER period_span_inserted ",
+                    "CREATE TRIGGER period_span_deleted ",
+                    'INSERT INTO "user"',
+                    'INSERT INTO "artifact"',
+                    'INSERT INTO "snapshot"',
+                    'INSERT INTO "feed_entry"',
+                    'INSERT INTO "period_text"',
+                    'INSERT INTO "period_span"',
+                    'INSERT INTO "period_place"',
+                    'INSERT INTO "purge_queue"',
+                    'INSERT INTO "lease"',
+                    'INSERT INTO "data_version"',
+                )
+            ):
                 yield "%s\n" % line
 
     return Response(
@@ -247,13 +299,44 @@ def export():
 
 @app.route("/feed.xml")
 def feed():
-    activity_feed = generate_activity_feed()
-    if activity_feed is None:
-        return abort(404)
+    def generate():
+        activity_feed = generate_activity_feed()
+        if activity_feed is None:
+            return abort(404)
+        return make_response(
+            activity_feed,
+            200,
+            {
+                "Content-Type": "application/atom+xml",
+            },
+        )
+
+    cache.tag("patches")
+    version, last_modified = database.get_activity_version()
+    return validators.conditional(
+        Validators(f"periodo-feed-version-{version}", last_modified),
+        lambda: artifacts.cached(
+            artifacts.request_key("atom"), version, generate, serve_stale=True
+        ),
+    )
+
+
+@app.route("/metrics")
+def show_metrics():
+    token = app.config["METRICS_TOKEN"]
+    if token is None:
+        abort(404)
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()
+    ):
+        return make_response(
+            "", 401, {"WWW-Authenticate": 'Bearer realm="PeriodO metrics"'}
+        )
     return make_response(
-        activity_feed,
+        metrics.as_text(),
         200,
         {
-            "Content-Type": "application/atom+xml",
+            "Content-Type": "text/plain; version=0.0.4",
+            "Cache-Control": "no-store",
         },
     )
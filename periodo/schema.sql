@@ -32,6 +32,9 @@ CREATE TABLE IF NOT EXISTS patch_request (
   original_patch TEXT NOT NULL,
   applied_patch TEXT,
 
+  -- the message of the first comment (see add_first_comment)
+  first_comment TEXT,
+
   FOREIGN KEY(created_by) REFERENCES user(id),
   FOREIGN KEY(merged_by) REFERENCES user(id),
 
@@ -48,6 +51,66 @@ BEGIN
   WHERE id = old.id;
 END;
 
+-- for paging through lists of patch requests (see PatchRequestList)
+CREATE INDEX IF NOT EXISTS patch_request_updated_at
+ON patch_request (updated_at, id);
+CREATE INDEX IF NOT EXISTS patch_request_created_at
+ON patch_request (created_at, id);
+CREATE INDEX IF NOT EXISTS patch_request_open_updated_at
+ON patch_request (open, merged, updated_at, id);
+CREATE INDEX IF NOT EXISTS patch_request_open_created_at
+ON patch_request (open, merged, created_at, id);
+-- for lists filtered by only one of open and merged
+CREATE INDEX IF NOT EXISTS patch_request_only_open_updated_at
+ON patch_request (open, updated_at, id);
+CREATE INDEX IF NOT EXISTS patch_request_only_open_created_at
+ON patch_request (open, created_at, id);
+CREATE INDEX IF NOT EXISTS patch_request_only_merged_updated_at
+ON patch_request (merged, updated_at, id);
+CREATE INDEX IF NOT EXISTS patch_request_only_merged_created_at
+ON patch_request (merged, created_at, id);
+CREATE INDEX IF NOT EXISTS patch_request_merged_at
+ON patch_request (merged_at);
+
+-- numbers of patch requests by state, so that they need not be counted
+CREATE TABLE IF NOT EXISTS patch_request_count (
+  open BOOLEAN NOT NULL,
+  merged BOOLEAN NOT NULL,
+  count INTEGER NOT NULL,
+
+  PRIMARY KEY(open, merged)
+);
+INSERT OR IGNORE INTO patch_request_count (open, merged, count)
+SELECT o.value, m.value, (
+  SELECT COUNT(*) FROM patch_request WHERE open = o.value AND merged = m.value
+)
+FROM (SELECT 0 AS value UNION SELECT 1) AS o,
+     (SELECT 0 AS value UNION SELECT 1) AS m;
+
+CREATE TRIGGER IF NOT EXISTS count_created_patch_request
+AFTER INSERT ON patch_request
+BEGIN
+  UPDATE patch_request_count SET count = count + 1
+  WHERE open = new.open AND merged = new.merged;
+END;
+
+CREATE TRIGGER IF NOT EXISTS count_changed_patch_request
+AFTER UPDATE OF open, merged ON patch_request
+WHEN old.open != new.open OR old.merged != new.merged
+BEGIN
+  UPDATE patch_request_count SET count = count - 1
+  WHERE open = old.open AND merged = old.merged;
+  UPDATE patch_request_count SET count = count + 1
+  WHERE open = new.open AND merged = new.merged;
+END;
+
+CREATE TRIGGER IF NOT EXISTS count_deleted_patch_request
+AFTER DELETE ON patch_request
+BEGIN
+  UPDATE patch_request_count SET count = count - 1
+  WHERE open = old.open AND merged = old.merged;
+END;
+
 CREATE TABLE IF NOT EXISTS patch_request_comment (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   posted_at INTEGER DEFAULT (strftime('%s', 'now')),
@@ -59,6 +122,185 @@ CREATE TABLE IF NOT EXISTS patch_request_comment (
   FOREIGN KEY (author) REFERENCES user(id)
 );
 
+CREATE INDEX IF NOT EXISTS patch_request_comment_patch_request_id
+ON patch_request_comment (patch_request_id, id);
+
+CREATE TRIGGER IF NOT EXISTS add_first_comment
+AFTER INSERT ON patch_request_comment
+BEGIN
+  UPDATE patch_request SET first_comment = new.message
+  WHERE id = new.patch_request_id AND first_comment IS NULL;
+END;
+
+-- what happened to patch requests, newest last (see feed.py)
+CREATE TABLE IF NOT EXISTS activity_event (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  occurred_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+  patch_request_id INTEGER NOT NULL,
+  -- submitted, updated, merged, rejected or commented on
+  action TEXT NOT NULL,
+  user_id TEXT NOT NULL,
+  comment_id INTEGER,
+
+  FOREIGN KEY (patch_request_id) REFERENCES patch_request(id),
+  FOREIGN KEY (user_id) REFERENCES user(id),
+  FOREIGN KEY (comment_id) REFERENCES patch_request_comment(id)
+);
+
+CREATE INDEX IF NOT EXISTS activity_event_occurred_at
+ON activity_event (occurred_at, id);
+CREATE INDEX IF NOT EXISTS activity_event_patch_request_id
+ON activity_event (patch_request_id, id);
+
+-- reconstruct the activity of databases created without it
+INSERT INTO activity_event (
+  occurred_at, patch_request_id, action, user_id, comment_id)
+SELECT occurred_at, patch_request_id, action, user_id, comment_id
+FROM (
+  SELECT
+  created_at AS occurred_at,
+  id AS patch_request_id,
+  'submitted' AS action,
+  created_by AS user_id,
+  NULL AS comment_id,
+  0 AS step
+  FROM patch_request
+  UNION ALL
+  SELECT updated_at, id, 'updated', updated_by, NULL, 1
+  FROM patch_request
+  WHERE updated_at > created_at
+  UNION ALL
+  SELECT posted_at, patch_request_id, 'commented on', author, id, 2
+  FROM patch_request_comment
+  UNION ALL
+  SELECT merged_at, id, CASE WHEN merged THEN 'merged' ELSE 'rejected' END,
+  merged_by, NULL, 3
+  FROM patch_request
+  WHERE merged_at IS NOT NULL
+)
+WHERE NOT EXISTS (SELECT 1 FROM activity_event)
+ORDER BY occurred_at, patch_request_id, step, comment_id;
+
+-- HTML content of the entries in the feed, which does not change after
+-- the event, with links to the canonical server URL (see feed.py)
+CREATE TABLE IF NOT EXISTS feed_entry (
+  event_id INTEGER PRIMARY KEY,
+  content TEXT NOT NULL,
+
+  FOREIGN KEY (event_id) REFERENCES activity_event(id)
+);
+
+-- text of periods, as of each version of the dataset (see indexes.py)
+CREATE TABLE IF NOT EXISTS period_text (
+  rowid INTEGER PRIMARY KEY,
+  period_key TEXT NOT NULL,
+  authority_key TEXT NOT NULL,
+  from_version INTEGER NOT NULL,
+  -- the version in which the text changed, or NULL if it is current
+  until_version INTEGER,
+  label TEXT NOT NULL,
+  localized_labels TEXT NOT NULL,
+  spatial_coverage_description TEXT NOT NULL,
+  source_title TEXT NOT NULL,
+
+  FOREIGN KEY(from_version) REFERENCES dataset(id)
+);
+
+CREATE INDEX IF NOT EXISTS period_text_authority_key
+ON period_text(authority_key, until_version);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS period_search USING fts5(
+  label,
+  localized_labels,
+  spatial_coverage_description,
+  source_title,
+  content='period_text',
+  content_rowid='rowid',
+  tokenize='unicode61 remove_diacritics 2'
+);
+
+-- rows are only inserted, or deleted by a rebuild; closing a row by
+-- setting its until_version does not change its text
+CREATE TRIGGER IF NOT EXISTS period_text_inserted AFTER INSERT ON period_text
+BEGIN
+  INSERT INTO period_search (
+    rowid, label, localized_labels, spatial_coverage_description, source_title)
+  VALUES (
+    new.rowid, new.label, new.localized_labels,
+    new.spatial_coverage_description, new.source_title);
+END;
+
+CREATE TRIGGER IF NOT EXISTS period_text_deleted AFTER DELETE ON period_text
+BEGIN
+  INSERT INTO period_search (
+    period_search, rowid, label, localized_labels,
+    spatial_coverage_description, source_title)
+  VALUES (
+    'delete', old.rowid, old.label, old.localized_labels,
+    old.spatial_coverage_description, old.source_title);
+END;
+
+-- temporal bounds of periods, as of each version of the dataset (see
+-- indexes.py and intervals.py)
+CREATE TABLE IF NOT EXISTS period_span (
+  rowid INTEGER PRIMARY KEY,
+  period_key TEXT NOT NULL,
+  authority_key TEXT NOT NULL,
+  from_version INTEGER NOT NULL,
+  -- the version in which the bounds changed, or NULL if they are current
+  until_version INTEGER,
+  earliest_year INTEGER NOT NULL,
+  latest_year INTEGER NOT NULL,
+
+  FOREIGN KEY(from_version) REFERENCES dataset(id)
+);
+
+CREATE INDEX IF NOT EXISTS period_span_authority_key
+ON period_span(authority_key, until_version);
+
+-- current bounds, for finding periods in the latest version (see
+-- intervals.py)
+CREATE INDEX IF NOT EXISTS period_span_current
+ON period_span(earliest_year, period_key, latest_year, authority_key)
+WHERE until_version IS NULL;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS period_span_tree USING rtree_i32(
+  id,
+  earliest_year,
+  latest_year
+);
+
+CREATE TRIGGER IF NOT EXISTS period_span_inserted AFTER INSERT ON period_span
+BEGIN
+  INSERT INTO period_span_tree (id, earliest_year, latest_year)
+  VALUES (new.rowid, new.earliest_year, new.latest_year);
+END;
+
+CREATE TRIGGER IF NOT EXISTS period_span_deleted AFTER DELETE ON period_span
+BEGIN
+  DELETE FROM period_span_tree WHERE id = old.rowid;
+END;
+
+-- places covered by periods, as of each version of the dataset (see
+-- indexes.py and places.py)
+CREATE TABLE IF NOT EXISTS period_place (
+  rowid INTEGER PRIMARY KEY,
+  period_key TEXT NOT NULL,
+  authority_key TEXT NOT NULL,
+  from_version INTEGER NOT NULL,
+  -- the version in which the place was removed, or NULL if it is current
+  until_version INTEGER,
+  place TEXT NOT NULL,
+
+  FOREIGN KEY(from_version) REFERENCES dataset(id)
+);
+
+CREATE INDEX IF NOT EXISTS period_place_authority_key
+ON period_place(authority_key, until_version);
+
+CREATE INDEX IF NOT EXISTS period_place_place
+ON period_place(place, until_version);
+
 CREATE TABLE IF NOT EXISTS bag (
   uuid TEXT NOT NULL,
   version integer NOT NULL DEFAULT 0,
@@ -81,6 +323,44 @@ CREATE TABLE IF NOT EXISTS graph (
   PRIMARY KEY(id, version)
 );
 
+CREATE TABLE IF NOT EXISTS artifact (
+  key TEXT NOT NULL,
+  version TEXT NOT NULL,
+  created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+  headers TEXT NOT NULL,
+  data BLOB NOT NULL,
+  -- when a newer version was first requested
+  stale_since INTEGER,
+
+  PRIMARY KEY(key, version)
+);
+
+-- responses stored as files named by the digest of their contents
+CREATE TABLE IF NOT EXISTS snapshot (
+  key TEXT PRIMARY KEY NOT NULL,
+  digest TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  created_at INTEGER NOT NULL DEFAULT (strftime('%s', 'now')),
+  headers TEXT NOT NULL,
+  surrogate_keys TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS purge_queue (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  key TEXT UNIQUE NOT NULL,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  next_attempt_at REAL NOT NULL DEFAULT 0,
+  -- incremented when the key is enqueued again before it has been purged
+  generation INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS lease (
+  key TEXT PRIMARY KEY NOT NULL,
+  holder TEXT NOT NULL,
+  expires_at REAL NOT NULL,
+  waiters INTEGER NOT NULL DEFAULT 0
+);
+
 CREATE TABLE IF NOT EXISTS user (
   id TEXT PRIMARY KEY NOT NULL,
   name TEXT NOT NULL,
@@ -103,3 +383,57 @@ BEGIN
   SET credentials_updated_at = (strftime('%s', 'now'))
   WHERE id = old.id;
 END;
+
+-- Counters of changes to tables that workers keep in-process caches of,
+-- so that they notice changes made by other workers. The 'database' row
+-- tells databases apart.
+CREATE TABLE IF NOT EXISTS data_version (
+  name TEXT PRIMARY KEY NOT NULL,
+  version INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO data_version (name, version)
+VALUES ('database', abs(random()));
+INSERT OR IGNORE INTO data_version (name) VALUES ('dataset');
+INSERT OR IGNORE INTO data_version (name) VALUES ('user');
+INSERT OR IGNORE INTO data_version (name) VALUES ('patch_request');
+
+CREATE TRIGGER IF NOT EXISTS dataset_inserted AFTER INSERT ON dataset
+BEGIN
+  UPDATE data_version SET version = version + 1 WHERE name = 'dataset';
+END;
+
+CREATE TRIGGER IF NOT EXISTS dataset_updated AFTER UPDATE ON dataset
+BEGIN
+  UPDATE data_version SET version = version + 1 WHERE name = 'dataset';
+END;
+
+CREATE TRIGGER IF NOT EXISTS dataset_deleted AFTER DELETE ON dataset
+BEGIN
+  UPDATE data_version SET version = version + 1 WHERE name = 'dataset';
+END;
+
+-- only created and closed patch requests change identities
+CREATE TRIGGER IF NOT EXISTS patch_request_inserted AFTER INSERT ON patch_request
+BEGIN
+  UPDATE data_version SET version = version + 1 WHERE name = 'patch_request';
+END;
+
+CREATE TRIGGER IF NOT EXISTS patch_request_closed AFTER UPDATE OF open ON patch_request
+BEGIN
+  UPDATE data_version SET version = version + 1 WHERE name = 'patch_request';
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_inserted AFTER INSERT ON user
+BEGIN
+  UPDATE data_version SET version = version + 1 WHERE name = 'user';
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_updated AFTER UPDATE ON user
+BEGIN
+  UPDATE data_version SET version = version + 1 WHERE name = 'user';
+END;
+
+CREATE TRIGGER IF NOT EXISTS user_deleted AFTER DELETE ON user
+BEGIN
+  UPDATE data_version SET version = version + 1 WHERE name = 'user';
+END;
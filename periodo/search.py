@@ -0,0 +1,69 @@
+from periodo import database, indexes
+from typing import Optional
+
+# Periods are indexed for full-text search by their labels, localized
+# labels and spatial coverage descriptions, and the titles of the sources
+# of their authorities. The period_text index (see indexes.py) holds this
+# text for each version of the dataset, and period_search indexes it
+# (see schema.sql).
+
+TEXT_COLUMNS = (
+    "label",
+    "localized_labels",
+    "spatial_coverage_description",
+    "source_title",
+)
+
+
+def source_title(authority: dict) -> str:
+    source = authority.get("source", {})
+    return source.get("title") or source.get("partOf", {}).get("title") or ""
+
+
+@indexes.index("period_text", TEXT_COLUMNS)
+def get_text(authority: dict, period: dict) -> list[tuple[str, ...]]:
+    return [
+        (
+            period.get("label", ""),
+            " ".join(
+                label
+                for labels in period.get("localizedLabels", {}).values()
+                for label in labels
+            ),
+            period.get("spatialCoverageDescription", ""),
+            source_title(authority),
+        )
+    ]
+
+
+def to_query(text: str) -> str:
+    # every word, as a prefix, quoted so that it is not parsed as syntax
+    return " ".join('"{}"*'.format(word.replace('"', '""')) for word in text.split())
+
+
+def search(text: str, version: Optional[int], limit: int, offset: int) -> list[dict]:
+    """Returns periods matching the text in the given version of the
+    dataset (by default the latest), best matches first, with snippets
+    of the matching text."""
+    if version is None:
+        version = database.get_latest_version()
+    query = to_query(text)
+    if not query:
+        return []
+    rows = database.query_db_for_all(
+        """
+    SELECT
+    period_text.period_key AS id,
+    period_text.authority_key AS authority,
+    snippet(period_search, -1, '[', ']', '…', 12) AS snippet
+    FROM period_search
+    JOIN period_text ON period_text.rowid = period_search.rowid
+    WHERE period_search MATCH ?
+    AND period_text.from_version <= ?
+    AND (period_text.until_version IS NULL OR period_text.until_version > ?)
+    ORDER BY period_search.rank, period_text.period_key
+    LIMIT ? OFFSET ?
+    """,
+        (query, version, version, limit, offset),
+    )
+    return [dict(row) for row in rows]
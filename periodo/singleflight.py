@@ -0,0 +1,104 @@
+import time
+import uuid
+from periodo import app, database, metrics
+from typing import Callable, Optional, TypeVar
+
+# Expensive results are computed by one request at a time, across threads
+# and worker processes. The others wait for it to store the result where
+# they can find it, using leases held in the database.
+
+T = TypeVar("T")
+
+MAX_POLL_INTERVAL = 0.5  # seconds
+
+
+def acquire(key: str) -> Optional[str]:
+    """Takes the lease on `key` if no one holds it (or their lease has
+    expired). Returns an ID identifying the holder, or `None`."""
+    holder = uuid.uuid4().hex
+    now = time.time()
+    with database.open_cursor(write=True) as cursor:
+        cursor.execute(
+            """
+        INSERT INTO lease (key, holder, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT (key) DO UPDATE
+        SET holder = excluded.holder, expires_at = excluded.expires_at, waiters = 0
+        WHERE lease.expires_at < ?
+        """,
+            (key, holder, now + app.config["SINGLE_FLIGHT_TIMEOUT"], now),
+        )
+        acquired = cursor.rowcount == 1
+    return holder if acquired else None
+
+
+def wait(key: str) -> None:
+    "Records that a request is waiting for the holder of the lease."
+    with database.open_cursor(write=True) as cursor:
+        cursor.execute("UPDATE lease SET waiters = waiters + 1 WHERE key = ?", (key,))
+
+
+def has_waiters(key: str, holder: str) -> bool:
+    row = database.query_db_for_one(
+        "SELECT waiters FROM lease WHERE key = ? AND holder = ?", (key, holder)
+    )
+    return row is not None and row["waiters"] > 0
+
+
+def release(key: str, holder: str) -> None:
+    with database.open_cursor(write=True) as cursor:
+        cursor.execute("DELETE FROM lease WHERE key = ? AND holder = ?", (key, holder))
+
+
+def run(
+    key: str,
+    get: Callable[[], Optional[T]],
+    compute: Callable[[Callable[[], bool]], T],
+) -> T:
+    """Returns the result for `key`, computing it only if no one else is.
+
+    `compute` is called with a function returning whether other requests
+    are waiting for the result, in which case it should store the result
+    where `get` will find it. While someone else holds the lease, `get`
+    is polled until it returns the result or the lease is released.
+    After `SINGLE_FLIGHT_TIMEOUT` seconds of waiting, the result is
+    computed anyway.
+
+    """
+    started = time.monotonic()
+    deadline = started + app.config["SINGLE_FLIGHT_TIMEOUT"]
+    interval = 0.01
+    waiting = False
+    while True:
+        holder = acquire(key)
+        if holder is not None:
+            try:
+                if waiting:
+                    # the previous holder may have just stored it
+                    result = get()
+                    if result is not None:
+                        metrics.increment("single_flight_coalesced_total")
+                        return result
+                metrics.increment("single_flight_computed_total")
+                return compute(lambda: has_waiters(key, holder))
+            finally:
+                release(key, holder)
+
+        if not waiting:
+            wait(key)
+            waiting = True
+        elif (result := get()) is not None:
+            metrics.increment("single_flight_coalesced_total")
+            metrics.increment(
+                "single_flight_wait_seconds_total", time.monotonic() - started
+            )
+            return result
+
+        if time.monotonic() >= deadline:
+            metrics.increment("single_flight_timeouts_total")
+            metrics.increment(
+                "single_flight_wait_seconds_total", time.monotonic() - started
+            )
+            return compute(lambda: False)
+
+        time.sleep(interval)
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
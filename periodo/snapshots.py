@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import tempfile
+from flask import request, Response
+from periodo import app, cache, database, metrics
+from typing import Optional
+from werkzeug.wsgi import wrap_file
+
+# Large responses that never change (see resources.is_immutable) are
+# written to files named by the SHA-256 of their contents, so that they
+# can be sent without passing through Python: either by the WSGI server
+# (wsgi.file_wrapper, usually sendfile) or, if SNAPSHOT_ACCEL_PREFIX is
+# set, by nginx (X-Accel-Redirect). Identical responses share a file.
+#
+# The snapshot table maps requests to files, along with the headers and
+# surrogate keys of the responses.
+
+
+def get_dir() -> str:
+    return app.config["SNAPSHOT_DIR"] or f"{app.config['DATABASE']}.snapshots"
+
+
+def get_path(digest: str) -> str:
+    return os.path.join(get_dir(), digest[:2], digest)
+
+
+def enabled() -> bool:
+    return app.config["SNAPSHOT_STORE_SIZE"] > 0
+
+
+class Writer:
+    "Writes a snapshot file in pieces, naming it when it is complete."
+
+    def __init__(self):
+        os.makedirs(get_dir(), exist_ok=True)
+        fd, self.tmp = tempfile.mkstemp(dir=get_dir(), prefix=".snapshot-")
+        self.file = os.fdopen(fd, "wb")
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.file.write(chunk)
+        self.hash.update(chunk)
+        self.size += len(chunk)
+
+    def close(self) -> str:
+        "Returns the digest of the snapshot."
+        self.file.close()
+        return self.hash.hexdigest()
+
+    def commit(self, digest: str) -> None:
+        path = get_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # identical contents, so it doesn't matter which file wins
+        os.replace(self.tmp, path)
+
+    def abort(self) -> None:
+        self.file.close()
+        os.unlink(self.tmp)
+
+
+def get(key: str) -> Optional[Response]:
+    "Returns a response sending the snapshot stored for `key`, if any."
+    row = database.query_db_for_one(
+        "SELECT digest, size, headers, surrogate_keys FROM snapshot WHERE key = ?",
+        (key,),
+    )
+    if row is None:
+        return None
+
+    path = get_path(row["digest"])
+    headers = json.loads(row["headers"])
+    accel_prefix = app.config["SNAPSHOT_ACCEL_PREFIX"]
+    if accel_prefix is not None:
+        # nginx replaces the body with the file (and sets Content-Length)
+        response = Response(b"", 200, headers)
+        response.headers[
+            "X-Accel-Redirect"
+        ] = f"{accel_prefix.rstrip('/')}/{row['digest'][:2]}/{row['digest']}"
+    else:
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # evicted since the row was read, or deleted from the volume
+            forget(key)
+            return None
+        response = Response(
+            wrap_file(request.environ, f), 200, headers, direct_passthrough=True
+        )
+        response.headers["Content-Length"] = str(row["size"])
+
+    cache.tag(*json.loads(row["surrogate_keys"]))
+    metrics.increment("snapshot_served_total")
+    return response
+
+
+def put(
+    key: str,
+    writer: Writer,
+    headers: list[tuple[str, str]],
+    surrogate_keys: tuple[str, ...],
+) -> None:
+    digest = writer.close()
+    with database.open_cursor(write=True) as cursor:
+        cursor.execute(
+            """
+        INSERT OR REPLACE INTO snapshot (key, digest, size, headers, surrogate_keys)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+            (key, digest, writer.size, json.dumps(headers), json.dumps(surrogate_keys)),
+        )
+        # named while holding the write lock, so that no other worker can
+        # delete it as unused before the row is committed
+        writer.commit(digest)
+        evict(cursor)
+
+
+def save(
+    key: str,
+    body: bytes,
+    headers: list[tuple[str, str]],
+    surrogate_keys: tuple[str, ...],
+) -> None:
+    writer = Writer()
+    writer.write(body)
+    put(key, writer, headers, surrogate_keys)
+
+
+def forget(key: str) -> None:
+    with database.open_cursor(write=True) as cursor:
+        cursor.execute("DELETE FROM snapshot WHERE key = ?", (key,))
+        delete_unused_files(cursor)
+
+
+def evict(cursor) -> None:
+    # delete the oldest snapshots that don't fit within the size budget,
+    # counting each file once
+    cursor.execute(
+        """
+    DELETE FROM snapshot
+    WHERE digest IN (
+      SELECT digest FROM (
+        SELECT
+        digest,
+        SUM(size) OVER (ORDER BY created_at DESC, digest) AS total
+        FROM (
+          SELECT digest, MAX(size) AS size, MAX(created_at) AS created_at
+          FROM snapshot
+          GROUP BY digest
+        )
+      )
+      WHERE total > ?
+    )
+    """,
+        (app.config["SNAPSHOT_STORE_SIZE"],),
+    )
+    if cursor.rowcount > 0:
+        delete_unused_files(cursor)
+
+
+def delete_unused_files(cursor) -> None:
+    cursor.execute("SELECT DISTINCT digest FROM snapshot")
+    used = {row["digest"] for row in cursor.fetchall()}
+    root = get_dir()
+    if not os.path.isdir(root):
+        return
+    for subdir in os.listdir(root):
+        if len(subdir) != 2:
+            continue
+        for digest in os.listdir(os.path.join(root, subdir)):
+            if digest not in used:
+                # workers already sending it keep their open file
+                os.unlink(os.path.join(root, subdir, digest))
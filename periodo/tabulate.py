@@ -0,0 +1,192 @@
+import csv
+import io
+from typing import Iterator
+from urllib.parse import urljoin
+
+# Columns (and their order) of the rows produced by periods-as-csv.rq
+COLUMNS = (
+    "period",
+    "label",
+    "spatial_coverage",
+    "start",
+    "stop",
+    "authority",
+    "source",
+    "publication_year",
+    "broader_periods",
+    "narrower_periods",
+)
+
+
+def entity_id(d):
+    if isinstance(d, str):
+        return d
+    return d.get("id", d.get("@id", ""))
+
+
+def as_list(x):
+    if x is None:
+        return []
+    if isinstance(x, list):
+        return x
+    return [x]
+
+
+def literal(x):
+    if isinstance(x, bool):
+        return str(x).lower()
+    return str(x)
+
+
+def distinct(values):
+    return list(dict.fromkeys(v for v in values if v is not None))
+
+
+def years(bound, *keys):
+    description = bound.get("in", {}) if isinstance(bound, dict) else {}
+    return [literal(description[k]) for k in keys if k in description]
+
+
+def integer(values):
+    # mimic xsd:integer(...) in the query: the cast fails (and the value
+    # is unbound) unless there is exactly one integer-valued year
+    if len(values) != 1:
+        return None
+    try:
+        int(values[0])
+    except ValueError:
+        return None
+    return values[0]
+
+
+def source_nodes(source):
+    # dcterms:source/dcterms:isPartOf?
+    nodes = []
+    if isinstance(source, dict):
+        nodes.append(source)
+        nodes += [p for p in as_list(source.get("partOf")) if isinstance(p, dict)]
+    return nodes
+
+
+def agent_names(agents):
+    return sorted(
+        literal(agent["name"])
+        for agent in as_list(agents)
+        if isinstance(agent, dict) and "name" in agent
+    )
+
+
+def source_descriptions(source):
+    # dc:title|((dc:creator|dc:contributor)/foaf:name), in the order the
+    # query's GROUP_CONCAT gave them: titles, then creators and then
+    # contributors, each ordered by name
+    descriptions = []
+    for node in source_nodes(source):
+        descriptions += [literal(title) for title in as_list(node.get("title"))]
+        descriptions += agent_names(node.get("creators"))
+        descriptions += agent_names(node.get("contributors"))
+    return descriptions
+
+
+def publication_years(source):
+    return [
+        literal(node["yearPublished"])
+        for node in source_nodes(source)
+        if "yearPublished" in node
+    ]
+
+
+def find_periods(data):
+    """Yields (period, authority) pairs for all periods in a PeriodO
+    dataset, authority, or period JSON object. `authority` is the
+    authority object if it is present, otherwise just its ID."""
+    if "authorities" in data:
+        for authority in data["authorities"].values():
+            yield from find_periods(authority)
+    elif "periods" in data:
+        for period in data["periods"].values():
+            yield period, data
+    elif "authority" in data:
+        yield data, data["authority"]
+
+
+def period_rows(data) -> list[dict]:
+    """Returns the rows of periods-as-csv.rq for a PeriodO dataset,
+    authority, or period, without translating it to RDF first."""
+    base = data.get("@context", {}).get("@base", "")
+
+    def iri(x):
+        return urljoin(base, entity_id(x))
+
+    periods = [
+        (period, authority)
+        for period, authority in find_periods(data)
+        if period.get("type") == "Period" and "label" in period
+    ]
+
+    narrower = {}
+    for period, _ in periods:
+        for broader in as_list(period.get("broader")):
+            narrower.setdefault(iri(broader), []).append(iri(period))
+
+    rows = []
+    for period, authority in periods:
+        source = authority.get("source") if isinstance(authority, dict) else None
+        spatial_coverage = as_list(period.get("spatialCoverageDescription")) + [
+            place["label"]
+            for place in as_list(period.get("spatialCoverage"))
+            if isinstance(place, dict) and "label" in place
+        ]
+        rows.append(
+            {
+                "period": iri(period),
+                "label": "|".join(distinct(as_list(period["label"]))),
+                "spatial_coverage": " | ".join(
+                    distinct(literal(s) for s in spatial_coverage)
+                ),
+                "start": integer(
+                    distinct(years(period.get("start"), "year", "earliestYear"))
+                ),
+                "stop": "|".join(
+                    distinct(years(period.get("stop"), "year", "latestYear"))
+                ),
+                "authority": iri(authority),
+                "source": " | ".join(distinct(source_descriptions(source))),
+                "publication_year": "|".join(distinct(publication_years(source))),
+                "broader_periods": " ".join(
+                    distinct(iri(b) for b in as_list(period.get("broader")))
+                ),
+                "narrower_periods": " ".join(distinct(narrower.get(iri(period), []))),
+            }
+        )
+
+    # ORDER BY ?publication_year ?source ?spatial_coverage ?start
+    # (unbound values sort first)
+    return sorted(
+        rows,
+        key=lambda row: (
+            row["publication_year"],
+            row["source"],
+            row["spatial_coverage"],
+            (0, 0) if row["start"] is None else (1, int(row["start"])),
+        ),
+    )
+
+
+def as_csv(data) -> Iterator[str]:
+    """Yields the lines of a CSV table describing the periods in a
+    PeriodO dataset, authority, or period."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(COLUMNS)
+    yield flush()
+    for row in period_rows(data):
+        writer.writerow([row[column] or "" for column in COLUMNS])
+        yield flush()
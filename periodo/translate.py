@@ -75,7 +75,3 @@ def jsonld_to(serialization: str, jsonld: dict | list) -> str:
 
 def jsonld_to_turtle(jsonld: dict | list) -> str:
     return jsonld_to("ttl", jsonld)
-
-
-def jsonld_to_csv(jsonld: dict | list) -> str:
-    return jsonld_to("csv", jsonld)
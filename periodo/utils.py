@@ -11,6 +11,12 @@ def absolute_url(base, endpoint, **kwargs):
         return url_for(endpoint, _external=True, **kwargs)
 
 
+def canonical_url_root():
+    return "{}://{}/".format(
+        app.config["PREFERRED_URL_SCHEME"], app.config["SERVER_NAME"]
+    )
+
+
 def isoformat(posix_timestamp):
     return datetime.fromtimestamp(posix_timestamp, tz=timezone.utc).isoformat()
 
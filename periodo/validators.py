@@ -0,0 +1,48 @@
+from flask import make_response, request, Response
+from typing import Any, Callable, NamedTuple, Optional
+from wsgiref.handlers import format_date_time
+
+
+class Validators(NamedTuple):
+    # opaque tag identifying a version of a representation
+    etag: str
+    # POSIX timestamp of the last modification, if known
+    last_modified: Optional[int] = None
+
+
+def is_fresh(validators: Validators) -> bool:
+    # If-None-Match takes precedence over If-Modified-Since
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(validators.etag)
+    if validators.last_modified is not None and request.if_modified_since:
+        return validators.last_modified <= request.if_modified_since.timestamp()
+    return False
+
+
+def add_validators(response: Response, validators: Validators) -> Response:
+    # representations may differ byte-wise between requests (e.g. blank
+    # node labels in RDF), so all validators are weak
+    response.set_etag(validators.etag, weak=True)
+    if validators.last_modified is not None:
+        response.headers["Last-Modified"] = format_date_time(validators.last_modified)
+    return response
+
+
+def conditional(validators: Validators, generate: Callable[[], Any]) -> Response:
+    """Returns a 304 Not Modified response if the conditional request
+    headers show that the requester's copy of the representation
+    identified by `validators` is current, without calling `generate`.
+
+    Otherwise calls `generate` to produce the response, and adds the
+    validators to it if it is successful. Responses that must not be
+    stored (such as degraded or stale ones) get no validators, as they
+    may not be the representation the validators identify.
+
+    """
+    if is_fresh(validators):
+        return add_validators(make_response("", 304), validators)
+
+    response = make_response(generate())
+    if response.status_code == 200 and not response.cache_control.no_store:
+        add_validators(response, validators)
+    return response
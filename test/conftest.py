@@ -2,8 +2,11 @@ import httpx
 import json
 import os
 import pytest
+import shutil
 import tempfile
+import threading
 from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse
 from flask_principal import ActionNeed
 from periodo import app, commands, auth, DEV_SERVER_NAME
@@ -29,6 +32,9 @@ def load_json(shared_datadir):
 @pytest.fixture
 def init_db(shared_datadir):
     app.config["TESTING"] = True
+    app.config["PRECOMPUTE_ARTIFACTS"] = False
+    app.config["HIGHLIGHT_WORKERS"] = 0
+    app.config["PURGE_IN_BACKGROUND"] = False
     db_fd, app.config["DATABASE"] = tempfile.mkstemp()
     commands.init_db()
     commands.load_data(shared_datadir / "test-data.json")
@@ -36,6 +42,9 @@ def init_db(shared_datadir):
     # teardown
     os.close(db_fd)
     os.unlink(app.config["DATABASE"])
+    if os.path.exists(app.config["DATABASE"] + ".latest"):
+        os.unlink(app.config["DATABASE"] + ".latest")
+    shutil.rmtree(app.config["DATABASE"] + ".snapshots", ignore_errors=True)
 
 
 @pytest.fixture
@@ -134,3 +143,62 @@ def submit_and_merge_patch(active_user, admin_user, client, bearer_auth, load_js
         )
 
     return _submit_and_merge_patch
+
+
+class CachePurgerHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers["Content-Length"])
+        self.server.purges.append(json.loads(self.rfile.read(length)))
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def cache_purger():
+    """A stand-in for the cache purger that records the keys posted to
+    it. Set `status` to make it fail."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CachePurgerHandler)
+    server.purges = []
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    app.config["CACHE_PURGER_URL"] = "http://127.0.0.1:{}/".format(
+        server.server_address[1]
+    )
+    yield server
+    app.config["CACHE_PURGER_URL"] = None
+    server.shutdown()
+    server.server_close()
+
+
+class LocalCache:
+    """A reference implementation of `periodo.cache.Purger` that caches
+    responses by URL path, like a proxy that supports surrogate keys."""
+
+    purges_tags = True
+
+    def __init__(self):
+        self.responses = {}
+
+    def get(self, client, url):
+        if url not in self.responses:
+            self.responses[url] = client.get(url)
+        return self.responses[url]
+
+    def purge(self, urls, tags):
+        tags = set(tags)
+        for url, response in list(self.responses.items()):
+            keys = response.headers.get("Surrogate-Key", "").split(" ")
+            if url in urls or tags.intersection(keys):
+                del self.responses[url]
+
+
+@pytest.fixture
+def local_cache():
+    cache = LocalCache()
+    app.config["CACHE_PURGER"] = cache
+    yield cache
+    app.config["CACHE_PURGER"] = "url"
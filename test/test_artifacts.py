@@ -0,0 +1,227 @@
+import httpx
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rdflib import Graph
+from rdflib.compare import isomorphic
+from periodo import (
+    DEV_SERVER_NAME,
+    app,
+    artifacts,
+    cache,
+    database,
+    metrics,
+    tabulate,
+    translate,
+)
+
+HOST = f"http://{DEV_SERVER_NAME}"
+
+
+def stored_keys():
+    with app.app_context():
+        return {
+            row["key"]: row["version"]
+            for row in database.query_db_for_all("SELECT key, version FROM artifact")
+        }
+
+
+def test_precompute_after_merge(client, submit_and_merge_patch):
+    res = submit_and_merge_patch("test-patch-replace-values-1.json")
+    assert res.status_code == httpx.codes.NO_CONTENT
+    assert stored_keys() == {}
+
+    artifacts.precompute(2)
+
+    keys = stored_keys()
+    assert keys[f"csv {HOST}/d.csv"] == "2"
+    assert keys[f"csv {HOST}/dataset.csv"] == "2"
+    assert keys[f"nt {HOST}/h.nt"] == "2-0"
+    assert keys[f"nt {HOST}/history.nt?full="] == "2-0"
+    assert keys[f"ttl.html {HOST}/.wellknown/void.ttl.html"] == "2"
+    assert keys[f"json {HOST}/d.json?fields=id%2Clabel%2Cstart%2Cstop"] == "2"
+    # patch updated p0trgkv and p0trgkvwbjd
+    assert keys[f"json.html {HOST}/trgkv.json.html"] == "2"
+    assert keys[f"jsonld.html {HOST}/trgkvwbjd.jsonld.html"] == "2"
+    assert f"json.html {HOST}/trgkvkhrv.json.html" not in keys
+
+
+def test_serve_precomputed_artifacts(client, submit_and_merge_patch, bearer_auth):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    live = client.get("/h.nt?full")
+    artifacts.precompute(2)
+
+    res = client.get("/h.nt?full")
+    assert res.status_code == httpx.codes.OK
+    assert isomorphic(
+        Graph().parse(data=res.text, format="nt"),
+        Graph().parse(data=live.text, format="nt"),
+    )
+    assert res.headers["Content-Type"] == "application/n-triples"
+    assert res.headers["Content-Disposition"] == (
+        'attachment; filename="periodo-history.nt"'
+    )
+
+    with app.app_context():
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("UPDATE artifact SET data = 'precomputed'")
+
+    assert client.get("/h.nt?full").text == "precomputed"
+    assert client.get("/d.csv").text == "precomputed"
+    assert client.get("/trgkv.json.html").text == "precomputed"
+    assert client.get("/.wellknown/void.ttl.html").text == "precomputed"
+    # not precomputed
+    assert client.get("/trgkvkhrv.json.html").text != "precomputed"
+
+    # comments change the history, so precomputed history is stale: it is
+    # served while the history is regenerated in the background
+    client.post(
+        "/patches/2/messages",
+        json={"message": "Nice"},
+        auth=bearer_auth("this-token-has-normal-permissions"),
+    )
+    res = client.get("/h.nt?full")
+    assert res.text == "precomputed"
+    assert res.headers["Cache-Control"] == "no-store"
+    assert "ETag" not in res.headers
+    artifacts.executor.submit(lambda: None).result()
+    assert client.get("/h.nt?full").text != "precomputed"
+    assert client.get("/d.csv").text == "precomputed"
+
+
+def test_stale_artifacts_are_not_served_too_long(
+    client, submit_and_merge_patch, monkeypatch
+):
+    client.get("/h.nt")
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    with app.app_context():
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("UPDATE artifact SET data = 'stale'")
+            cursor.execute("UPDATE artifact SET stale_since = 0")
+
+    assert client.get("/h.nt").text != "stale"
+
+
+def test_stale_artifacts_replace_errors(client, submit_and_merge_patch, monkeypatch):
+    monkeypatch.setattr(translate, "jsonld_to_turtle", lambda data: "turtle\n")
+    res = client.get("/d.ttl")
+    assert res.headers["Cache-Control"] == (
+        f"public, max-age={cache.SHORT_TIME}, "
+        f"stale-while-revalidate={app.config['ARTIFACT_MAX_STALENESS']}, "
+        f"stale-if-error={cache.STALE_IF_ERROR}"
+    )
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+
+    def translator_down(data):
+        raise translate.RDFTranslationError(503)
+
+    monkeypatch.setattr(translate, "jsonld_to_turtle", translator_down)
+    monkeypatch.setitem(app.config, "ARTIFACT_MAX_STALENESS", -1)
+    res = client.get("/d.ttl")
+    assert res.status_code == httpx.codes.OK
+    assert res.text == "turtle\n"
+    assert res.headers["Cache-Control"] == "no-store"
+
+
+def test_precompute_versioned_html(client, submit_and_merge_patch):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    artifacts.precompute(2)
+
+    keys = stored_keys()
+    assert keys[f"json.html {HOST}/trgkvwbjd.json.html?version=2"] == "2"
+    assert keys[f"jsonld.html {HOST}/trgkv.jsonld.html?version=2"] == "2"
+
+
+def test_cache_highlighted_html(client):
+    res = client.get("/trgkv.json.html?version=1")
+    assert res.status_code == httpx.codes.OK
+    assert stored_keys() == {f"json.html {HOST}/trgkv.json.html?version=1": "1"}
+
+    res = client.get("/trgkvwbjd.jsonld.html")
+    assert res.status_code == httpx.codes.OK
+    assert stored_keys()[f"jsonld.html {HOST}/trgkvwbjd.jsonld.html"] == "1"
+
+    # other representations are not cached
+    client.get("/trgkv.json?version=1")
+    client.get("/trgkv.csv?version=1")
+    assert len(stored_keys()) == 2
+
+
+def test_evict_highlighted_html(client, monkeypatch):
+    client.get("/trgkv.json.html")
+    with app.app_context():
+        size = database.query_db_for_one("SELECT LENGTH(data) AS size FROM artifact")[
+            "size"
+        ]
+
+    monkeypatch.setitem(app.config, "ARTIFACT_STORE_SIZE", size + 1)
+    client.get("/trgkvwbjd.json.html")
+    # the oldest artifact was evicted to make room
+    assert list(stored_keys()) == [f"json.html {HOST}/trgkvwbjd.json.html"]
+
+
+def test_head_precomputed_artifact(client, submit_and_merge_patch):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    artifacts.precompute(2)
+
+    get = client.get("/d.csv")
+    res = client.head("/d.csv")
+    assert res.status_code == httpx.codes.OK
+    assert res.content == b""
+    assert res.headers["Content-Length"] == str(len(get.content))
+    for header in ("Content-Type", "Content-Disposition", "Cache-Control", "ETag"):
+        assert res.headers[header] == get.headers[header]
+
+
+def slow_csv(monkeypatch, seconds):
+    calls = []
+    as_csv = tabulate.as_csv
+
+    def _slow_csv(data):
+        # lazily, like the lines of the table
+        calls.append(data)
+        time.sleep(seconds)
+        yield from as_csv(data)
+
+    monkeypatch.setattr(tabulate, "as_csv", _slow_csv)
+    return calls
+
+
+def get_concurrently(client, url, n, delay=0):
+    "Requests `url` `n` times, starting the others `delay` seconds after the first."
+
+    def get(i):
+        time.sleep(delay if i else 0)
+        return client.get(url)
+
+    with ThreadPoolExecutor(max_workers=n) as executor:
+        return list(executor.map(get, range(n)))
+
+
+def test_concurrent_requests_are_coalesced(client, monkeypatch):
+    calls = slow_csv(monkeypatch, 0.5)
+    coalesced = metrics.counter("single_flight_coalesced_total")
+
+    # the others arrive while the first is generating the table
+    responses = get_concurrently(client, "/trgkv.csv", 3, delay=0.2)
+
+    assert len(calls) == 1
+    assert metrics.counter("single_flight_coalesced_total") == coalesced + 2
+    assert {res.status_code for res in responses} == {httpx.codes.OK}
+    assert len({res.content for res in responses}) == 1
+    # stored because others were waiting for it
+    assert f"csv {HOST}/trgkv.csv" in stored_keys()
+    with app.app_context():
+        assert database.query_db_for_all("SELECT * FROM lease") == []
+
+
+def test_coalesced_requests_time_out(client, monkeypatch):
+    monkeypatch.setitem(app.config, "SINGLE_FLIGHT_TIMEOUT", 0.1)
+    calls = slow_csv(monkeypatch, 0.5)
+    coalesced = metrics.counter("single_flight_coalesced_total")
+
+    responses = get_concurrently(client, "/d.csv", 2)
+
+    # the waiting request gave up and generated it too
+    assert len(calls) == 2
+    assert metrics.counter("single_flight_coalesced_total") == coalesced
+    assert {res.status_code for res in responses} == {httpx.codes.OK}
@@ -1,8 +1,9 @@
 import httpx
 import json
 import pytest
+import sqlite3
 from urllib.parse import urlparse
-from periodo import app, database
+from periodo import app, database, metrics
 
 
 def test_unauthorized_user(unauthorized_user):
@@ -220,3 +221,65 @@ def test_creator_identity_update_merged_patch(
         + '"The access token does not provide sufficient privileges", '
         + 'error_uri="http://tools.ietf.org/html/rfc6750#section-6.2.3"'
     )
+
+
+@pytest.mark.client_auth_token("this-token-has-admin-permissions")
+def test_admin_can_update_open_patches(
+    admin_user, active_user, client, load_json, bearer_auth
+):
+    admin_user, active_user
+
+    res = client.patch(
+        "/d/",
+        auth=bearer_auth("this-token-has-normal-permissions"),
+        json=load_json("test-patch-replace-values-1.json"),
+    )
+    patch_url = urlparse(res.headers["Location"]).path
+    res = client.put(
+        patch_url + "patch.jsonpatch",
+        json=load_json("test-patch-replace-values-2.json"),
+    )
+    assert res.status_code == httpx.codes.OK
+
+    res = client.post(patch_url + "reject")
+    assert res.status_code == httpx.codes.NO_CONTENT
+    res = client.put(
+        patch_url + "patch.jsonpatch",
+        json=load_json("test-patch-replace-values-1.json"),
+    )
+    assert res.status_code == httpx.codes.FORBIDDEN
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_identities_are_cached(active_user, client):
+    active_user
+    assert client.get("/identity.json").status_code == httpx.codes.OK
+    hits = metrics.counter("identity_cache_hits_total")
+    assert client.get("/identity.json").status_code == httpx.codes.OK
+    assert metrics.counter("identity_cache_hits_total") == hits + 1
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_permission_changes_are_seen(active_user, client):
+    assert client.get("/identity.json").status_code == httpx.codes.OK
+
+    # as if by another worker
+    with sqlite3.connect(app.config["DATABASE"]) as db:
+        db.execute("UPDATE user SET permissions = '[]' WHERE id = ?", (active_user.id,))
+    db.close()
+
+    assert client.get("/identity.json").status_code == httpx.codes.FORBIDDEN
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_expired_tokens_are_not_cached(active_user, client):
+    assert client.get("/identity.json").status_code == httpx.codes.OK
+    with sqlite3.connect(app.config["DATABASE"]) as db:
+        db.execute(
+            "UPDATE user SET token_expires_at = 0 WHERE id = ?", (active_user.id,)
+        )
+    db.close()
+
+    res = client.get("/identity.json")
+    assert res.status_code == httpx.codes.UNAUTHORIZED
+    assert res.text == "The access token expired"
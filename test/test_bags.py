@@ -150,3 +150,19 @@ def test_update_bag_must_be_owner(
         auth=bearer_auth("this-token-has-admin-permissions"),
     )
     assert res.status_code == httpx.codes.FORBIDDEN
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_bag_versions_have_the_latest_items(
+    active_user, client, load_json, submit_and_merge_patch
+):
+    id = UUID("6f2c64e2-c65f-4e2d-b028-f89dfb71ce69")
+    res = client.put(f"/bags/{id}", json=load_json("test-bag.json"))
+    bag_url = res.headers["Location"]
+    stop = client.get(bag_url).json()["items"]["p0trgkvwbjd"]["stop"]
+    assert stop["label"] == "547 B.C."
+
+    # moves the stop of p0trgkvwbjd to 577 B.C.
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    stop = client.get(bag_url).json()["items"]["p0trgkvwbjd"]["stop"]
+    assert stop["label"] == "577 B.C."
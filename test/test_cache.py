@@ -0,0 +1,436 @@
+import hashlib
+import httpx
+import os
+import sqlite3
+import time
+from periodo import (
+    app,
+    cache,
+    database,
+    latest,
+    lru,
+    metrics,
+    representations,
+    resources,
+    snapshots,
+)
+
+
+def queued_keys():
+    with app.app_context():
+        return [
+            row["key"]
+            for row in database.query_db_for_all(
+                "SELECT key FROM purge_queue ORDER BY id"
+            )
+        ]
+
+
+def test_merge_enqueues_purges(client, submit_and_merge_patch, cache_purger):
+    res = submit_and_merge_patch("test-patch-replace-values-1.json")
+    assert res.status_code == httpx.codes.NO_CONTENT
+    # nothing is sent until the queue is processed
+    assert cache_purger.purges == []
+
+    keys = queued_keys()
+    assert len(keys) == len(set(keys))
+    assert "/d.json" in keys
+    assert "/d.json?inline-context" in keys
+    assert "/h.nt?full" in keys
+    assert "/graphs/" in keys
+
+    assert cache.process_purge_queue() is None
+    # sent in one batch, without the surrogate keys
+    assert cache_purger.purges == [[key for key in keys if key.startswith("/")]]
+    assert queued_keys() == []
+
+
+def test_purges_are_claimed_once(client, submit_and_merge_patch, cache_purger):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    with app.app_context():
+        claimed = cache.claim_purges()
+        assert [row["key"] for row in claimed] == queued_keys()
+        # until the claim times out
+        assert cache.claim_purges() == []
+
+
+def test_purges_enqueued_while_sending_are_kept(client, monkeypatch):
+    class Purger:
+        purges_tags = False
+        purges = []
+
+        def purge(self, urls, tags):
+            if not self.purges:
+                # as if by a merge while the first purge is being sent
+                cache.enqueue_purge(["/d.json"])
+            self.purges.append(urls)
+
+    monkeypatch.setitem(app.config, "CACHE_PURGER", Purger())
+    with app.app_context():
+        cache.enqueue_purge(["/d.json"])
+        assert queued_keys() == ["/d.json"]
+        assert cache.process_purge_queue() is None
+    assert Purger.purges == [["/d.json"], ["/d.json"]]
+    assert queued_keys() == []
+
+
+def test_merge_purges_are_enqueued_with_the_merge(
+    client, submit_and_merge_patch, cache_purger, monkeypatch
+):
+    # as if the worker died after the merge was committed
+    monkeypatch.setattr(cache, "enqueue_purge", lambda keys: None)
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    assert "/d.json" in queued_keys()
+
+
+def test_merge_purges_changed_entities(client, submit_and_merge_patch, cache_purger):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    keys = queued_keys()
+    for key in (
+        "/trgkv",
+        "/trgkv.json",
+        "/trgkv.json.html",
+        "/trgkv.ttl.html",
+        "/trgkv.csv",
+        "/trgkvwbjd",
+        "/trgkvwbjd.jsonld.html",
+        "/trgkvwbjd.ttl",
+    ):
+        assert key in keys
+    # unchanged entities are not purged
+    assert not any(key.startswith("/trgkvkhrv") for key in keys)
+
+
+def test_entities_are_cached_until_purged(client):
+    res = client.get("/trgkv.json")
+    assert res.headers["X-Accel-Expires"] == str(cache.LONG_TIME)
+    assert res.headers["Cache-Control"] == "public, max-age=0"
+    res = client.get("/trgkv.json?version=1")
+    assert res.headers["Cache-Control"] == f"public, max-age={cache.LONG_TIME}"
+
+
+def test_head_of_missing_entity(client):
+    assert client.head("/trgkv.json").status_code == httpx.codes.OK
+    assert client.head("/trgkvwbjd.json").status_code == httpx.codes.OK
+    assert client.head("/tzzzz.json").status_code == httpx.codes.NOT_FOUND
+    assert client.head("/trgkv999.json").status_code == httpx.codes.NOT_FOUND
+
+
+def test_failed_purges_are_retried(client, submit_and_merge_patch, cache_purger):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    keys = queued_keys()
+    urls = [key for key in keys if key.startswith("/")]
+
+    cache_purger.status = 503
+    delay = cache.process_purge_queue()
+    assert 0 < delay <= cache.PURGE_RETRY_DELAY
+    assert cache_purger.purges == [urls]
+    assert queued_keys() == keys
+
+    # not retried until the delay has passed
+    assert cache.process_purge_queue() > 0
+    assert len(cache_purger.purges) == 1
+
+    with app.app_context():
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("UPDATE purge_queue SET next_attempt_at = 0")
+
+    cache_purger.status = 200
+    assert cache.process_purge_queue() is None
+    assert cache_purger.purges == [urls, urls]
+    assert queued_keys() == []
+
+
+def test_retry_delay_increases(client, cache_purger):
+    cache_purger.status = 500
+    with app.app_context():
+        cache.purge(["/d.json"])
+        for attempts in range(12):
+            with database.open_cursor(write=True) as cursor:
+                cursor.execute("UPDATE purge_queue SET next_attempt_at = 0")
+            delay = cache.process_purge_queue()
+            assert delay <= min(
+                cache.PURGE_RETRY_DELAY * 2**attempts, cache.PURGE_MAX_RETRY_DELAY
+            )
+            assert (
+                delay
+                > min(
+                    cache.PURGE_RETRY_DELAY * 2**attempts, cache.PURGE_MAX_RETRY_DELAY
+                )
+                - 1
+            )
+    assert queued_keys() == ["/d.json"]
+
+
+def test_purge_in_background(client, submit_and_merge_patch, cache_purger, monkeypatch):
+    monkeypatch.setitem(app.config, "PURGE_IN_BACKGROUND", True)
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    for _ in range(100):
+        if queued_keys() == []:
+            break
+        time.sleep(0.05)
+    assert queued_keys() == []
+    assert len(cache_purger.purges) == 1
+
+
+def surrogate_keys(res):
+    return res.headers["Surrogate-Key"].split(" ")
+
+
+def test_responses_are_tagged(client):
+    res = client.get("/d.json")
+    assert surrogate_keys(res) == ["dataset-v1", "dataset"]
+    assert res.headers["Cache-Tag"] == "dataset-v1,dataset"
+    assert surrogate_keys(client.get("/d.json?version=1")) == ["dataset-v1"]
+    assert surrogate_keys(client.get("/trgkv.json")) == ["p0trgkv", "entities"]
+    assert surrogate_keys(client.get("/trgkv.json?version=1")) == ["dataset-v1"]
+    assert surrogate_keys(client.get("/trgkvwbjd.ttl.html")) == [
+        "p0trgkvwbjd",
+        "entities",
+    ]
+    assert surrogate_keys(client.head("/trgkvwbjd.ttl")) == ["p0trgkvwbjd", "entities"]
+    assert surrogate_keys(client.get("/h.nt")) == ["history"]
+    assert surrogate_keys(client.get("/patches/")) == ["patches"]
+    assert surrogate_keys(client.get("/graphs/")) == [
+        "graphs",
+        "dataset-v1",
+        "dataset",
+    ]
+    assert "Surrogate-Key" not in client.get("/trgkv.json?version=99").headers
+
+
+def test_merge_purges_by_tag(client, submit_and_merge_patch, local_cache):
+    urls = (
+        "/d.json",
+        "/d.json?inline-context",
+        "/trgkv.json",
+        "/trgkvwbjd.ttl.html",
+        "/trgkvkhrv.json",
+        "/trgkv.json?version=1",
+        "/graphs/",
+        "/h.nt",
+    )
+    for url in urls:
+        local_cache.get(client, url)
+
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    assert cache.process_purge_queue() is None
+
+    assert set(local_cache.responses) == {"/trgkvkhrv.json", "/trgkv.json?version=1"}
+
+
+def test_tag_purger(client, submit_and_merge_patch, cache_purger, monkeypatch):
+    monkeypatch.setitem(app.config, "CACHE_PURGER", "tag")
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    assert cache.process_purge_queue() is None
+    [purge] = cache_purger.purges
+    assert "dataset" in purge["tags"]
+    assert "p0trgkvwbjd" in purge["tags"]
+    assert not any(tag.startswith("/") for tag in purge["tags"])
+
+
+def test_context_changes_purge_all_entities(
+    client, submit_and_merge_patch, cache_purger, monkeypatch
+):
+    submit_and_merge_patch("test-patch-modify-context.json")
+    keys = queued_keys()
+    assert "entities" in keys
+    for key in ("/trgkv.ttl", "/trgkvkhrv.csv", "/trgkvwbjd.ttl.html"):
+        assert key in keys
+
+    # purged by the shared surrogate key alone
+    with app.app_context():
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("DELETE FROM purge_queue")
+    monkeypatch.setitem(app.config, "CACHE_PURGER", "tag")
+    submit_and_merge_patch("test-patch-modify-context.json")
+    keys = queued_keys()
+    assert "entities" in keys
+    assert not any(key.startswith("/trgkvkhrv") for key in keys)
+
+
+def test_query_responses_are_cached_only_if_tags_are_purged(
+    client, cache_purger, monkeypatch
+):
+    urls = (
+        "/search.json?q=archaic",
+        "/periods.json?overlaps=-0600,-0500",
+        "/trgkv.json?fields=label",
+        "/d/diff.json?from=1",
+    )
+    # purging by URL path would leave these stale
+    for url in urls:
+        res = client.get(url)
+        assert res.status_code == httpx.codes.OK, url
+        assert res.headers["X-Accel-Expires"] == "0", url
+        assert res.headers["Cache-Control"] == "public, max-age=0", url
+
+    monkeypatch.setitem(app.config, "CACHE_PURGER", "tag")
+    for url in urls:
+        res = client.get(url)
+        assert res.headers["X-Accel-Expires"] == str(cache.LONG_TIME), url
+        assert res.headers["Cache-Control"] == "public, max-age=0", url
+
+    # entities are purged by their URL paths
+    monkeypatch.setitem(app.config, "CACHE_PURGER", "url")
+    res = client.get("/trgkv.json")
+    assert res.headers["X-Accel-Expires"] == str(cache.LONG_TIME)
+
+
+def test_versioned_responses_are_cached(client):
+    hits = metrics.counter("response_cache_hits_total")
+    first = client.get("/trgkv.json?version=1")
+    assert metrics.counter("response_cache_hits_total") == hits
+    second = client.get("/trgkv.json?version=1")
+    assert metrics.counter("response_cache_hits_total") == hits + 1
+    assert second.content == first.content
+    for header in ("Content-Type", "Cache-Control", "ETag", "Surrogate-Key"):
+        assert second.headers[header] == first.headers[header]
+
+    # other representations and entities are cached separately
+    assert client.get("/trgkv.csv?version=1").headers["Content-Type"] == "text/csv"
+    res = client.get("/trgkvwbjd.json?version=1")
+    assert res.json()["id"] == "p0trgkvwbjd"
+    assert metrics.counter("response_cache_hits_total") == hits + 1
+
+    # the latest versions are not
+    client.get("/trgkv.json")
+    client.get("/trgkv.json")
+    assert metrics.counter("response_cache_hits_total") == hits + 1
+
+
+def test_streamed_versioned_responses_are_cached(client, monkeypatch):
+    monkeypatch.setattr(representations, "JSON_CHUNK_SIZE", 256)
+    hits = metrics.counter("response_cache_hits_total")
+    first = client.get("/d.json?version=1")
+    assert "Content-Length" not in first.headers
+    second = client.get("/d.json?version=1")
+    assert metrics.counter("response_cache_hits_total") == hits + 1
+    assert second.content == first.content
+    assert second.headers["Content-Length"] == str(len(first.content))
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru_cache = lru.LRUCache("test_cache", 10)
+    lru_cache.put("a", "a", 4)
+    lru_cache.put("b", "b", 4)
+    assert lru_cache.get("a") == "a"
+    lru_cache.put("c", "c", 4)
+    assert lru_cache.get("b") is None
+    assert lru_cache.get("a") == "a"
+    assert lru_cache.size == 8
+    assert not lru_cache.put("d", "d", 11)
+    assert metrics.gauge("test_cache_bytes") == 8
+
+
+def test_changes_by_other_workers_are_seen(client):
+    assert client.get("/trgkv.json").json()["source"]["locator"] != "Changed"
+
+    # as if by another worker
+    with sqlite3.connect(app.config["DATABASE"]) as db:
+        db.execute(
+            """
+        UPDATE dataset
+        SET data = json_set(data, '$.authorities.p0trgkv.source.locator', 'Changed')
+        WHERE id = (SELECT MAX(id) FROM dataset)
+        """
+        )
+    db.close()
+
+    assert client.get("/trgkv.json").json()["source"]["locator"] == "Changed"
+
+
+def test_versioned_responses_are_forgotten_with_the_database(client):
+    client.get("/trgkv.json?version=1")
+    assert resources.response_cache.size > 0
+
+    # as if another worker had replaced the database
+    with sqlite3.connect(app.config["DATABASE"]) as db:
+        db.execute("UPDATE data_version SET version = -1 WHERE name = 'database'")
+    db.close()
+
+    client.get("/trgkv.json")
+    assert resources.response_cache.size == 0
+
+
+def test_latest_dataset_is_published(client, submit_and_merge_patch):
+    client.get("/trgkvwbjd.json")
+    with app.app_context():
+        snapshot = latest.get_snapshot()
+        assert snapshot.version == latest.get_version()
+        data = database.get_data()
+        assert snapshot.load(snapshot.index["authorities"]["p0trgkv"]) == (
+            data["authorities"]["p0trgkv"]
+        )
+        assert snapshot.load(snapshot.index["periods"]["p0trgkvwbjd"]) == (
+            data["authorities"]["p0trgkv"]["periods"]["p0trgkvwbjd"]
+        )
+        assert snapshot.load(snapshot.index["context"]) == data["@context"]
+
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    with app.app_context():
+        # republished by the merge, replacing the file mapped before
+        assert latest.open_snapshot().version == latest.get_version()
+        assert snapshot.version != latest.get_version()
+    with app.app_context():
+        data = database.get_data()
+    period = client.get("/trgkvwbjd.json").json()
+    assert period["label"] == (
+        data["authorities"]["p0trgkv"]["periods"]["p0trgkvwbjd"]["label"]
+    )
+    authority = client.get("/trgkv.json").json()
+    assert authority["source"] == data["authorities"]["p0trgkv"]["source"]
+
+
+def snapshot_files():
+    root = app.config["DATABASE"] + ".snapshots"
+    return [name for _, _, names in os.walk(root) for name in names]
+
+
+def test_large_versioned_responses_are_snapshotted(client, monkeypatch):
+    monkeypatch.setitem(app.config, "SNAPSHOT_MIN_SIZE", 0)
+    served = metrics.counter("snapshot_served_total")
+    first = client.get("/d.json?version=1")
+    assert metrics.counter("snapshot_served_total") == served
+    [digest] = snapshot_files()
+    assert digest == hashlib.sha256(first.content).hexdigest()
+
+    second = client.get("/d.json?version=1")
+    assert metrics.counter("snapshot_served_total") == served + 1
+    assert second.content == first.content
+    assert second.headers["Content-Length"] == str(len(first.content))
+    for header in ("Content-Type", "Cache-Control", "ETag", "Surrogate-Key"):
+        assert second.headers[header] == first.headers[header]
+
+    # identical responses share a file
+    with app.test_request_context():
+        snapshots.save("other", first.content, [], ())
+    assert len(snapshot_files()) == 1
+
+    # handed to nginx if configured
+    monkeypatch.setitem(app.config, "SNAPSHOT_ACCEL_PREFIX", "/snapshots/")
+    res = client.get("/d.json?version=1")
+    assert res.headers["X-Accel-Redirect"] == f"/snapshots/{digest[:2]}/{digest}"
+    assert res.content == b""
+
+
+def test_streamed_responses_are_snapshotted(client, monkeypatch):
+    monkeypatch.setattr(representations, "JSON_CHUNK_SIZE", 256)
+    monkeypatch.setitem(app.config, "SNAPSHOT_MIN_SIZE", 1024)
+    first = client.get("/d.json?version=1")
+    assert "Content-Length" not in first.headers
+    assert len(snapshot_files()) == 1
+    second = client.get("/d.json?version=1")
+    assert second.content == first.content
+    assert second.headers["Content-Length"] == str(len(first.content))
+
+
+def test_snapshots_are_evicted(client, monkeypatch):
+    monkeypatch.setitem(app.config, "SNAPSHOT_MIN_SIZE", 0)
+    size = len(client.get("/trgkv.json?version=1").content)
+    monkeypatch.setitem(app.config, "SNAPSHOT_STORE_SIZE", size)
+    client.get("/trgkvwbjd.json?version=1")
+    assert len(snapshot_files()) == 1
+    served = metrics.counter("snapshot_served_total")
+    client.get("/trgkv.json?version=1")
+    assert metrics.counter("snapshot_served_total") == served
@@ -0,0 +1,104 @@
+import httpx
+import pytest
+from jsonpatch import JsonPatch
+from periodo import app, database, patching
+
+STOP = "/authorities/p0trgkv/periods/p0trgkvwbjd/stop"
+
+
+def get_data(version):
+    with app.app_context():
+        return database.get_data(version)
+
+
+def test_minimize_overwritten_operations():
+    assert patching.minimize(
+        [
+            {"op": "replace", "path": f"{STOP}/label", "value": "a"},
+            {"op": "test", "path": f"{STOP}/label", "value": "a"},
+            {"op": "replace", "path": f"{STOP}/in/year", "value": "-0576"},
+            {"op": "replace", "path": f"{STOP}/label", "value": "b"},
+            {"op": "replace", "path": STOP, "value": {"label": "c"}},
+        ]
+    ) == [{"op": "replace", "path": STOP, "value": {"label": "c"}}]
+
+
+def test_minimize_added_then_replaced():
+    assert patching.minimize(
+        [
+            {"op": "add", "path": "/a", "value": 1},
+            {"op": "replace", "path": "/a", "value": 2},
+            {"op": "add", "path": "/b", "value": 1},
+            {"op": "remove", "path": "/b"},
+        ]
+    ) == [
+        {"op": "add", "path": "/a", "value": 2},
+        {"op": "add", "path": "/b", "value": 1},
+        {"op": "remove", "path": "/b"},
+    ]
+
+
+def test_minimize_keeps_array_operations():
+    operations = [
+        {"op": "add", "path": "/a/0", "value": 1},
+        {"op": "remove", "path": "/a/0"},
+        {"op": "replace", "path": "/a/0/b", "value": 2},
+    ]
+    assert patching.minimize(operations) == operations
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_dataset_diff(submit_and_merge_patch, client):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    submit_and_merge_patch("test-patch-replace-values-2.json")
+
+    res = client.get("/d/diff?from=2&to=3")
+    assert res.status_code == httpx.codes.OK
+    assert res.json() == [
+        {"op": "replace", "path": f"{STOP}/label", "value": "577 B.C."},
+        {"op": "replace", "path": f"{STOP}/in/year", "value": "-0577"},
+    ]
+    assert res.headers["Cache-Control"] == "public, max-age=31557600"
+    assert res.headers["ETag"] == 'W/"periodo-dataset-diff-2-3"'
+
+    # the changes by the first patch are replaced by the second
+    res = client.get("/d/diff?from=1&to=3")
+    assert len(res.json()) == 2
+    assert JsonPatch(res.json()).apply(get_data(1)) == get_data(3)
+
+    res = client.get("/d/diff.json?from=1")
+    assert JsonPatch(res.json()).apply(get_data(1)) == get_data(3)
+    assert res.headers["Cache-Control"] != "public, max-age=31557600"
+
+    assert client.get("/d/diff?from=3&to=3").json() == []
+
+
+def test_dataset_diffs_are_stored(client):
+    client.get("/d/diff?from=1&to=1")
+    with app.app_context():
+        versions = [
+            row["version"]
+            for row in database.query_db_for_all("SELECT version FROM artifact")
+        ]
+    assert versions == ["1-1"]
+
+
+def test_head_of_dataset_diff_is_not_stored(client):
+    res = client.head("/d/diff?from=0&to=1")
+    assert res.status_code == httpx.codes.OK
+    assert res.content == b""
+    res = client.get("/d/diff?from=0&to=1")
+    assert JsonPatch(res.json()).apply(get_data(0)) == get_data(1)
+
+
+def test_invalid_dataset_diffs(client):
+    assert client.get("/d/diff").status_code == 422
+    assert client.get("/d/diff?from=1&to=2").status_code == 404
+    assert client.get("/d/diff?from=-1&to=1").status_code == 404
+    assert client.get("/d/diff?from=1&to=0").status_code == 400
+
+
+def test_dataset_diff_from_empty_dataset(client):
+    # version 0 is the empty dataset
+    res = client.get("/d/diff?from=0&to=1")
+    assert JsonPatch(res.json()).apply(get_data(0)) == get_data(1)
@@ -0,0 +1,108 @@
+import httpx
+import pytest
+from lxml import etree
+from urllib.parse import urlparse
+from periodo import app, database, feed
+
+ATOM = "{http://www.w3.org/2005/Atom}"
+
+
+def entry_titles(res):
+    feed = etree.fromstring(res.content)
+    return [entry.findtext(f"{ATOM}title") for entry in feed.iter(f"{ATOM}entry")]
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_feed_lists_events(admin_user, active_user, client, load_json, bearer_auth):
+    res = client.patch("/d/", json=load_json("test-patch-replace-values-1.json"))
+    patch_url = urlparse(res.headers["Location"]).path
+    client.put(
+        patch_url + "patch.jsonpatch",
+        json=load_json("test-patch-replace-values-2.json"),
+    )
+    client.post(patch_url + "messages", json={"message": "a comment"})
+    client.post(
+        patch_url + "merge", auth=bearer_auth("this-token-has-admin-permissions")
+    )
+
+    res = client.get("/feed.xml")
+    assert res.status_code == httpx.codes.OK
+    assert res.headers["Content-Type"] == "application/atom+xml"
+    assert entry_titles(res) == [
+        "Super Admin merged change #2",
+        "Testy Testerson commented on change #2",
+        "Testy Testerson updated change #2",
+        "Testy Testerson submitted change #2",
+        "initial data loader merged change #1",
+        "initial data loader submitted change #1",
+    ]
+    # with the comments posted so far
+    assert b"a comment" not in etree.tostring(
+        etree.fromstring(res.content).findall(f"{ATOM}entry")[2]
+    )
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_feed_is_cached_until_the_next_event(
+    active_user, client, load_json, monkeypatch
+):
+    # not serving the previous version while generating the next
+    monkeypatch.setitem(app.config, "ARTIFACT_MAX_STALENESS", -1)
+    first = client.get("/feed.xml")
+    assert client.get("/feed.xml").headers["ETag"] == first.headers["ETag"]
+
+    res = client.patch("/d/", json=load_json("test-patch-replace-values-1.json"))
+    patch_url = urlparse(res.headers["Location"]).path
+    second = client.get("/feed.xml")
+    assert second.headers["ETag"] != first.headers["ETag"]
+
+    client.post(patch_url + "messages", json={"message": "a comment"})
+    third = client.get("/feed.xml")
+    assert third.headers["ETag"] != second.headers["ETag"]
+    assert entry_titles(third)[0] == "Testy Testerson commented on change #2"
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_feed_entry_contents_are_stored(active_user, client, load_json):
+    res = client.patch("/d/", json=load_json("test-patch-replace-values-1.json"))
+    patch_url = urlparse(res.headers["Location"]).path
+    client.post(patch_url + "messages", json={"message": "a comment"})
+    with app.test_request_context():
+        rendered = feed.generate_activity_feed()
+        assert database.query_db_for_one("SELECT COUNT(*) AS count FROM feed_entry")[
+            "count"
+        ] == len(feed.get_recent_activity())
+        # the same, from the stored contents
+        assert feed.generate_activity_feed() == rendered
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("UPDATE feed_entry SET content = 'stored'")
+        assert b'<content type="html">stored</content>' in (
+            feed.generate_activity_feed()
+        )
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_feed_entry_contents_are_stored_only_for_the_canonical_url(
+    active_user, client, load_json
+):
+    client.patch("/d/", json=load_json("test-patch-replace-values-1.json"))
+    with app.test_request_context(base_url="http://example.org"):
+        assert b"example.org" in feed.generate_activity_feed()
+        assert database.query_db_for_all("SELECT * FROM feed_entry") == []
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_feed_entry_contents_are_deleted_after_leaving_the_feed(
+    active_user, client, load_json, monkeypatch
+):
+    monkeypatch.setattr(feed, "FEED_SIZE", 2)
+    res = client.patch("/d/", json=load_json("test-patch-replace-values-1.json"))
+    patch_url = urlparse(res.headers["Location"]).path
+    for message in ("one", "two", "three"):
+        client.post(patch_url + "messages", json={"message": message})
+        with app.test_request_context():
+            feed.generate_activity_feed()
+            stored = database.query_db_for_all("SELECT event_id FROM feed_entry")
+            assert {row["event_id"] for row in stored} == {
+                event["id"] for event in feed.get_recent_activity()
+            }
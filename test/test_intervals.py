@@ -0,0 +1,70 @@
+import httpx
+import pytest
+from urllib.parse import urlparse
+from periodo import app, database, intervals
+
+
+def period_ids(res):
+    return [period["id"] for period in res.json()["periods"]]
+
+
+def test_periods_overlapping_years(client):
+    res = client.get("/periods?overlaps=-0700,-0680")
+    assert res.status_code == httpx.codes.OK
+    assert period_ids(res) == ["p0trgkv4kxb", "p0trgkvkhrv"]
+    assert res.json()["periods"][0] == {
+        "id": "p0trgkv4kxb",
+        "authority": "p0trgkv",
+        "earliestYear": -1184,
+        "latestYear": -679,
+        "url": "/p0trgkv4kxb",
+    }
+    # bounds are inclusive
+    assert period_ids(client.get("/periods?overlaps=-0546,0")) == ["p0trgkvwbjd"]
+    assert period_ids(client.get("/periods?overlaps=-2000,-1185")) == []
+
+
+def test_periods_overlapping_years_in_full(client):
+    res = client.get("/periods?overlaps=-0546,-0546&full")
+    assert res.json()["periods"][0]["period"]["label"] == "Archaic"
+
+
+def test_periods_overlapping_years_pages(client):
+    res = client.get("/periods?overlaps=-0700,-0600&limit=2")
+    assert period_ids(res) == ["p0trgkv4kxb", "p0trgkvkhrv"]
+    next_url = urlparse(res.headers["Link"].split(";")[0][1:-1])
+    res = client.get(f"{next_url.path}?{next_url.query}")
+    assert period_ids(res) == ["p0trgkvwbjd"]
+    assert "Link" not in res.headers
+
+
+def test_invalid_year_ranges(client):
+    assert client.get("/periods").status_code == 422
+    assert client.get("/periods?overlaps=-0700").status_code == 400
+    assert client.get("/periods?overlaps=-0600,-0700").status_code == 400
+    assert client.get("/periods?overlaps=0,1&after=nope").status_code == 400
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_periods_overlapping_years_in_versions(submit_and_merge_patch, client):
+    # moves the stop of p0trgkvwbjd from -0546 to -0576
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    assert period_ids(client.get("/periods?overlaps=-0560,-0550")) == ["p0trgkvkhrv"]
+    assert period_ids(client.get("/periods?overlaps=-0560,-0550&version=1")) == [
+        "p0trgkvkhrv",
+        "p0trgkvwbjd",
+    ]
+    assert client.get("/periods?overlaps=0,1&version=3").status_code == 404
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_latest_periods_are_found_among_current_bounds(submit_and_merge_patch, client):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    with app.app_context():
+        [plan] = database.query_db_for_all(
+            "EXPLAIN QUERY PLAN " + intervals.CURRENT_QUERY, (-560, -550)
+        )
+        assert "period_span_current" in plan["detail"]
+        assert [row["id"] for row in intervals.overlapping(-560, -550, None, 10)] == [
+            "p0trgkvkhrv"
+        ]
@@ -5,7 +5,8 @@ import re
 from rdflib import Graph
 from rdflib.namespace import Namespace
 from urllib.parse import urlparse
-from periodo import app, database, identifier, cache, DEV_SERVER_NAME
+from periodo import app, commands, database, identifier, cache, DEV_SERVER_NAME
+from periodo.resources import PATCH_QUERY, encode_cursor
 
 PERIODO = Namespace("http://n2t.net/ark:/99152/")
 PROV = Namespace("http://www.w3.org/ns/prov#")
@@ -60,6 +61,90 @@ def test_submit_patch(active_user, client, load_json):
     assert patches[0]["url"] == patch_url
 
 
+def links(res):
+    return {
+        rel: url
+        for url, rel in re.findall(
+            r'<([^>]+)>; rel="(\w+)"', res.headers.get("Link", "")
+        )
+    }
+
+
+def urls(res):
+    return [patch["url"] for patch in res.json()]
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_patch_list_pages(active_user, client, load_json):
+    active_user
+    for _ in range(4):
+        client.patch("/d/", json=load_json("test-patch-replace-values-1.json"))
+    everything = urls(client.get("/patches/"))
+    assert len(everything) == 5
+
+    res = client.get("/patches/", params={"limit": 2})
+    assert "prev" not in links(res)
+    pages = [urls(res)]
+    while "next" in links(res):
+        res = client.get(links(res)["next"])
+        pages.append(urls(res))
+    assert pages == [everything[0:2], everything[2:4], everything[4:5]]
+
+    res = client.get(links(res)["prev"])
+    assert urls(res) == everything[2:4]
+    res = client.get(links(res)["prev"])
+    assert urls(res) == everything[0:2]
+    assert "prev" not in links(res)
+    assert urls(client.get(links(res)["next"])) == everything[2:4]
+
+    # sorted in the other direction
+    res = client.get("/patches/", params={"limit": 3, "order": "asc"})
+    assert urls(res) == everything[::-1][0:3]
+    assert urls(client.get(links(res)["next"])) == everything[::-1][3:5]
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_patch_list_counts(active_user, client, load_json):
+    active_user
+    for _ in range(2):
+        client.patch("/d/", json=load_json("test-patch-replace-values-1.json"))
+    res = client.get("/patches/", params={"open": "true"})
+    assert res.headers["X-Total-Count"] == "3"
+    assert res.headers["X-Filtered-Count"] == "2"
+    res = client.get("/patches/", params={"merged": "true"})
+    assert res.headers["X-Filtered-Count"] == "1"
+    with app.app_context():
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("UPDATE patch_request SET open = 0 WHERE id = 2")
+    res = client.get("/patches/", params={"open": "false", "merged": "false"})
+    assert res.headers["X-Filtered-Count"] == "1"
+    assert res.headers["X-Total-Count"] == "3"
+
+
+def test_patch_list_filters_use_indexes(client):
+    filters = ["", "open = ?", "merged = ?", "open = ? AND merged = ?"]
+    with app.app_context():
+        for where in filters:
+            for sort in ("created_at", "updated_at"):
+                query = PATCH_QUERY + (f" WHERE {where}" if where else "")
+                query += f" ORDER BY {sort} DESC, patch_request.id DESC"
+                plan = database.query_db_for_all(
+                    "EXPLAIN QUERY PLAN " + query, (True,) * where.count("?")
+                )
+                # sorted by the index rather than afterwards
+                assert "USE TEMP B-TREE FOR ORDER BY" not in [
+                    row["detail"] for row in plan
+                ]
+
+
+def test_invalid_patch_list_cursors(client):
+    res = client.get("/patches/", params={"after": "nonsense"})
+    assert res.status_code == httpx.codes.BAD_REQUEST
+    cursor = encode_cursor({"updated_at": 0, "id": 1}, "updated_at", "desc")
+    res = client.get("/patches/", params={"sort": "created_at", "after": cursor})
+    assert res.status_code == httpx.codes.BAD_REQUEST
+
+
 @pytest.mark.client_auth_token("this-token-has-normal-permissions")
 def test_update_patch(active_user, client, load_json):
     active_user
@@ -176,6 +261,24 @@ def test_comment_on_patch(active_user, client, load_json):
         assert patch["first_comment"] == "a comment"
 
 
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_add_first_comment_column(active_user, client, load_json):
+    res = client.patch("/d/", json=load_json("test-patch-adds-items.json"))
+    patch_url = urlparse(res.headers["Location"]).path
+    client.post(patch_url + "messages", json={"message": "first"})
+    client.post(patch_url + "messages", json={"message": "second"})
+    with app.app_context():
+        # as if created before the column existed
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("DROP TRIGGER add_first_comment")
+            cursor.execute("ALTER TABLE patch_request DROP COLUMN first_comment")
+
+    commands.migrate()
+    commands.migrate()
+
+    assert client.get(patch_url).json()["first_comment"] == "first"
+
+
 def test_versioning(client, submit_and_merge_patch):
 
     submit_and_merge_patch("test-patch-adds-items.json")
@@ -204,7 +307,7 @@ def test_versioning(client, submit_and_merge_patch):
         ctx = res.json()["@context"]
         assert ctx[0] == f"http://{DEV_SERVER_NAME}/c?version={version}"
         res = client.get("/history.nt")
-        assert res.headers["Cache-Control"] == "public, max-age=0"
+        assert res.headers["Cache-Control"].startswith("public, max-age=0, ")
         assert res.headers["X-Accel-Expires"] == f"{cache.MEDIUM_TIME}"
 
 
@@ -0,0 +1,68 @@
+import httpx
+import pytest
+from urllib.parse import urlparse
+
+
+def test_periods_covering_places(client):
+    res = client.get(
+        "/places",
+        params={
+            "place": [
+                "http://www.wikidata.org/entity/Q43",
+                "http://www.wikidata.org/entity/Q38",
+            ]
+        },
+    )
+    assert res.status_code == httpx.codes.OK
+    assert res.json() == {
+        "version": 1,
+        "places": {
+            "http://www.wikidata.org/entity/Q43": ["p0trgkv4kxb", "p0trgkvwbjd"],
+            "http://www.wikidata.org/entity/Q38": [],
+        },
+    }
+
+
+def test_periods_covering_wikidata_ids(client):
+    res = client.get("/places?place=Q29")
+    assert res.json()["places"] == {
+        "http://www.wikidata.org/entity/Q29": ["p0trgkvkhrv"]
+    }
+
+
+def test_invalid_places(client):
+    assert client.get("/places").status_code == 422
+    res = client.get("/places", params={"place": [f"Q{i}" for i in range(1, 102)]})
+    assert res.status_code == 400
+    assert client.get("/places?place=Q29&version=2").status_code == 404
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_periods_covering_places_in_versions(
+    active_user, admin_user, client, bearer_auth
+):
+    res = client.patch(
+        "/d/",
+        json=[
+            {
+                "op": "replace",
+                "path": "/authorities/p0trgkv/periods/p0trgkvwbjd/spatialCoverage",
+                "value": [
+                    {"id": "http://www.wikidata.org/entity/Q38", "label": "Italy"}
+                ],
+            }
+        ],
+    )
+    patch_url = urlparse(res.headers["Location"]).path
+    client.post(
+        patch_url + "merge", auth=bearer_auth("this-token-has-admin-permissions")
+    )
+    assert client.get("/places?place=Q43").json()["places"] == {
+        "http://www.wikidata.org/entity/Q43": ["p0trgkv4kxb"]
+    }
+    assert client.get("/places?place=Q38").json()["places"] == {
+        "http://www.wikidata.org/entity/Q38": ["p0trgkvwbjd"]
+    }
+    assert client.get("/places?place=Q43&version=1").json()["places"] == {
+        "http://www.wikidata.org/entity/Q43": ["p0trgkv4kxb", "p0trgkvwbjd"]
+    }
@@ -0,0 +1,64 @@
+import httpx
+import pytest
+from periodo import app, database
+
+
+def test_dataset_fields(client):
+    res = client.get("/d.json?fields=id,label,start,stop")
+    assert res.status_code == httpx.codes.OK
+    data = res.json()
+    authority = data["authorities"]["p0trgkv"]
+    assert set(authority) == {"id", "type", "periods"}
+    assert set(authority["periods"]["p0trgkvwbjd"]) == {
+        "id",
+        "type",
+        "label",
+        "start",
+        "stop",
+    }
+    assert "@context" in data
+    assert "primaryTopicOf" in data
+
+
+def test_dataset_exclude(client):
+    data = client.get("/d.json?exclude=source,spatialCoverage").json()
+    authority = data["authorities"]["p0trgkv"]
+    assert "source" not in authority
+    period = authority["periods"]["p0trgkvwbjd"]
+    assert "spatialCoverage" not in period
+    assert period["label"] == "Archaic"
+
+
+def test_entity_fields(client):
+    authority = client.get("/trgkv.json?fields=source").json()
+    assert "source" in authority
+    assert set(authority["periods"]["p0trgkvwbjd"]) == {"id", "type"}
+
+    period = client.get("/trgkvwbjd.json?fields=label").json()
+    assert period["label"] == "Archaic"
+    assert "start" not in period
+    assert period["authority"] == "p0trgkv"
+    assert period["id"] == "p0trgkvwbjd"
+
+    period = client.get("/trgkvwbjd.json?exclude=authority,label").json()
+    assert "authority" not in period
+    assert "label" not in period
+    assert "start" in period
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_bag_fields(active_user, client, load_json):
+    id = "ac9f9d8f-0e45-4b64-87d0-9d7d1a3a0a39"
+    client.put(f"/bags/{id}", json=load_json("test-bag.json"))
+    data = client.get(f"/bags/{id}?fields=label").json()
+    assert set(data["items"]["p0trgkvwbjd"]) == {"id", "type", "label", "authority"}
+    assert data["title"] == "Minimal bag of periods"
+
+
+def test_projections_are_stored(client):
+    assert client.get("/d.json?fields=label").status_code == httpx.codes.OK
+    with app.app_context():
+        keys = [
+            row["key"] for row in database.query_db_for_all("SELECT key FROM artifact")
+        ]
+    assert any(key.endswith("/d.json?fields=label") for key in keys)
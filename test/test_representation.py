@@ -3,11 +3,30 @@ import json
 import csv
 import os
 import pytest
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from rdflib import Graph, URIRef
 from rdflib.plugins import sparql
+from rdflib.plugins.sparql import aggregates
+from rdflib.plugins.sparql.sparql import NotBoundError
 from rdflib.namespace import Namespace, DCTERMS, RDF
 from urllib.parse import urlparse, urlencode
-from periodo import DEV_SERVER_NAME, cache
+from periodo import (
+    DEV_SERVER_NAME,
+    app,
+    cache,
+    commands,
+    database,
+    highlight,
+    intervals,
+    metrics,
+    provenance,
+    representations,
+    search,
+    tabulate,
+    translate,
+)
 
 VOID = Namespace("http://rdfs.org/ns/void#")
 SKOS = Namespace("http://www.w3.org/2004/02/skos/core#")
@@ -15,6 +34,11 @@ PERIODO = Namespace("http://n2t.net/ark:/99152/")
 FOAF = Namespace("http://xmlns.com/foaf/0.1/")
 HOST = Namespace("http://localhost.localdomain:5000/")
 
+# added to the Cache-Control of representations that may be served stale
+STALE_DIRECTIVES = ", stale-while-revalidate={}, stale-if-error={}".format(
+    app.config["ARTIFACT_MAX_STALENESS"], cache.STALE_IF_ERROR
+)
+
 
 def queryForValue(graph, query, bindings, value):
     return next(iter(graph.query(query, initBindings=bindings)))[value].value
@@ -443,6 +467,169 @@ def test_period_json(client):
     assert "Content-Disposition" not in res.headers
 
 
+def test_large_html_is_not_highlighted(client, monkeypatch):
+    res = client.get("/trgkv.json.html")
+    assert res.status_code == httpx.codes.OK
+    assert 'class="highlighttable"' in res.text
+    assert '<a href="http://www.wikidata.org/entity/Q29">' in res.text
+
+    monkeypatch.setitem(app.config, "HIGHLIGHT_MAX_SIZE", 1000)
+    res = client.get("/trgkv.json.html?version=1")
+    assert res.status_code == httpx.codes.OK
+    assert res.headers["Content-Type"] == "text/html; charset=utf-8"
+    assert 'class="highlighttable"' not in res.text
+    assert "<pre>{\n" in res.text
+    assert "&quot;" not in res.text
+    assert "http://www.wikidata.org/entity/Q29" in res.text
+
+
+def test_iterencode_json(load_json):
+    for data in (
+        load_json("test-data.json"),
+        load_json("test-graph.json"),
+        {"a": [], "b": {}, "c": [1.5, None, True, "ü"], "d": {1: "x"}},
+    ):
+        expected = json.dumps(data, ensure_ascii=False)
+        assert "".join(representations.iterencode_json(data)) == expected
+        assert "".join(representations.iterencode_json(data, 0, 1)) == expected
+
+
+def test_stream_large_json(client, monkeypatch):
+    res = client.get("/d.json")
+    assert res.headers["Content-Length"] == str(len(res.content))
+
+    monkeypatch.setattr(representations, "JSON_CHUNK_SIZE", 1024)
+    streamed = client.get("/d.json")
+    assert streamed.status_code == httpx.codes.OK
+    assert "Content-Length" not in streamed.headers
+    assert streamed.content == res.content
+
+
+def test_head_does_not_generate_representation(client, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("representation was generated")
+
+    monkeypatch.setattr(tabulate, "period_rows", fail)
+    monkeypatch.setattr(translate, "jsonld_to_turtle", fail)
+    monkeypatch.setattr(provenance, "history", fail)
+
+    res = client.head("/d.csv")
+    assert res.status_code == httpx.codes.OK
+    assert res.content == b""
+    assert "Content-Length" not in res.headers
+    assert res.headers["Content-Type"] == "text/csv"
+    assert res.headers["Content-Disposition"] == (
+        'attachment; filename="periodo-dataset.csv"'
+    )
+    assert res.headers["Cache-Control"] == "public, max-age={}{}".format(
+        cache.MEDIUM_TIME, STALE_DIRECTIVES
+    )
+    assert res.headers["ETag"] == 'W/"periodo-dataset-version-1.csv"'
+
+    res = client.head("/trgkv.ttl?version=1")
+    assert res.status_code == httpx.codes.OK
+    assert res.headers["Content-Type"] == "text/turtle"
+    assert res.headers["Content-Disposition"] == (
+        'attachment; filename="periodo-authority-trgkv-v1.ttl"'
+    )
+
+    res = client.head("/h.nt")
+    assert res.status_code == httpx.codes.OK
+    assert res.headers["Content-Type"] == "application/n-triples"
+
+
+def test_highlight_in_worker_process(client, monkeypatch):
+    monkeypatch.setitem(app.config, "HIGHLIGHT_WORKERS", 1)
+    monkeypatch.setitem(app.config, "HIGHLIGHT_TIMEOUT", 60)
+    renders = metrics.counter("highlight_renders_total")
+    try:
+        res = client.get("/trgkv.json.html")
+    finally:
+        highlight.shutdown_pool()
+    assert res.status_code == httpx.codes.OK
+    assert 'class="highlighttable"' in res.text
+    assert '<a href="http://www.wikidata.org/entity/Q29">' in res.text
+    assert metrics.counter("highlight_renders_total") == renders + 1
+    assert metrics.gauge("highlight_queue_depth") == 0
+
+    monkeypatch.setitem(app.config, "HIGHLIGHT_WORKERS", 0)
+    res = client.get("/metrics")
+    assert res.status_code == httpx.codes.NOT_FOUND
+    monkeypatch.setitem(app.config, "METRICS_TOKEN", "metrics-token")
+    res = client.get("/metrics")
+    assert res.status_code == httpx.codes.UNAUTHORIZED
+    res = client.get("/metrics", headers={"Authorization": "Bearer metrics-token"})
+    assert res.status_code == httpx.codes.OK
+    assert "# TYPE periodo_highlight_queue_depth gauge" in res.text
+    renders = metrics.counter("highlight_renders_total")
+    assert f"periodo_highlight_renders_total {renders}" in res.text
+
+
+def test_highlighting_timeout_stops_render(client, monkeypatch):
+    monkeypatch.setitem(app.config, "HIGHLIGHT_WORKERS", 1)
+    monkeypatch.setitem(app.config, "HIGHLIGHT_TIMEOUT", 0)
+    timeouts = metrics.counter("highlight_timeouts_total")
+    try:
+        res = client.get("/trgkv.json.html?version=1")
+    finally:
+        highlight.shutdown_pool()
+    assert res.status_code == httpx.codes.OK
+    assert 'class="highlighttable"' not in res.text
+    assert metrics.counter("highlight_timeouts_total") == timeouts + 1
+    # the processes running the render were replaced
+    assert highlight._pool is None
+    assert metrics.gauge("highlight_queue_depth") == 0
+
+
+def test_highlighting_timeout_fails_other_renders_at_once(client, monkeypatch):
+    monkeypatch.setitem(app.config, "HIGHLIGHT_WORKERS", 1)
+    monkeypatch.setitem(app.config, "HIGHLIGHT_TIMEOUT", 30)
+    pool = highlight.get_pool()
+    # keeps the only process busy, so that the next render is queued
+    pool.apply_async(time.sleep, (5,))
+
+    def render():
+        with app.app_context():
+            return highlight.render("{}", "json")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        queued = executor.submit(render)
+        while metrics.gauge("highlight_queue_depth") == 0:
+            time.sleep(0.01)
+        started = time.monotonic()
+        # as if another render had timed out
+        highlight.shutdown_pool(pool)
+        with pytest.raises(highlight.HighlightingUnavailable):
+            queued.result()
+    assert time.monotonic() - started < 1
+    assert metrics.gauge("highlight_queue_depth") == 0
+
+
+def test_unhighlighted_html_when_highlighting_unavailable(client, monkeypatch):
+    monkeypatch.setitem(app.config, "HIGHLIGHT_WORKERS", 1)
+    monkeypatch.setitem(app.config, "HIGHLIGHT_QUEUE_SIZE", 0)
+    rejected = metrics.counter("highlight_rejected_total")
+
+    res = client.get("/trgkv.json.html?version=1")
+    assert res.status_code == httpx.codes.OK
+    assert 'class="highlighttable"' not in res.text
+    assert "http://www.wikidata.org/entity/Q29" in res.text
+    assert res.headers["Cache-Control"] == "no-store"
+    assert metrics.counter("highlight_rejected_total") == rejected + 1
+
+    res = client.get("/.wellknown/void.ttl.html")
+    assert res.status_code == httpx.codes.OK
+    assert res.headers["Cache-Control"] == "no-store"
+
+    res = client.get("/notanidentifier")
+    assert res.status_code == httpx.codes.NOT_FOUND
+    assert "notanidentifier is not a valid PeriodO identifier" in res.text
+
+    # unhighlighted HTML is not stored
+    with app.app_context():
+        assert database.query_db_for_all("SELECT key FROM artifact") == []
+
+
 @pytest.mark.skipif(
     os.environ.get("SKIP_TRANSLATION") == "true",
     reason="RDF translation tests require access to private network",
@@ -520,10 +707,6 @@ def test_dataset_turtle(client):
     assert res.status_code == httpx.codes.NOT_FOUND
 
 
-@pytest.mark.skipif(
-    os.environ.get("SKIP_TRANSLATION") == "true",
-    reason="RDF translation tests require access to private network",
-)
 def test_dataset_csv(client):
     res = client.get("/dataset.csv")
     data = res.text
@@ -531,8 +714,8 @@ def test_dataset_csv(client):
         print(data)
     assert res.status_code == httpx.codes.OK
     assert res.headers["Content-Type"] == "text/csv"
-    assert res.headers["Cache-Control"] == "public, max-age={}".format(
-        cache.MEDIUM_TIME
+    assert res.headers["Cache-Control"] == "public, max-age={}{}".format(
+        cache.MEDIUM_TIME, STALE_DIRECTIVES
     )
     assert (
         res.headers["Content-Disposition"]
@@ -569,6 +752,72 @@ def test_dataset_csv(client):
     ]
 
 
+@pytest.fixture
+def sparql_csv(monkeypatch):
+    # rdflib raises an error instead of skipping unbound values when
+    # evaluating DISTINCT aggregates, so make it behave as SPARQL specifies
+    use_row = aggregates.Accumulator.use_row
+
+    def skip_unbound(self, row):
+        try:
+            return use_row(self, row)
+        except NotBoundError:
+            return False
+
+    monkeypatch.setattr(aggregates.Accumulator, "use_row", skip_unbound)
+
+    with open(os.path.join(os.path.dirname(__file__), "..", "periods-as-csv.rq")) as f:
+        query = f.read()
+
+    def _sparql_csv(jsonld):
+        g = Graph().parse(data=json.dumps(jsonld), format="json-ld")
+        return g.query(query).serialize(format="csv").decode()
+
+    return _sparql_csv
+
+
+def test_csv_matches_sparql_query(client, sparql_csv):
+    context = client.get("/c").json()
+
+    def split(column, value):
+        # xsd:integer(...) drops the leading zeros of the start year
+        if column == "start":
+            return int(value) if value else None
+        return value
+
+    def parse(data):
+        rows = csv.reader(data.splitlines())
+        header = next(rows)
+        return header, [
+            {column: split(column, value) for column, value in zip(header, row)}
+            for row in rows
+        ]
+
+    def order_agents(data):
+        # rdflib concatenates values in the order of the graph's triples,
+        # whereas the triplestore the query ran on ordered agents by name
+        if isinstance(data, dict):
+            return {
+                key: (
+                    sorted(value, key=lambda agent: agent["name"])
+                    if key in ("creators", "contributors")
+                    else order_agents(value)
+                )
+                for key, value in data.items()
+            }
+        if isinstance(data, list):
+            return [order_agents(value) for value in data]
+        return data
+
+    for path in ("/d.csv", "/trgkv.csv", "/trgkvkhrv.csv"):
+        jsonld = order_agents(client.get(path.replace(".csv", ".jsonld")).json())
+        expected = parse(sparql_csv({**jsonld, **context}))
+
+        res = client.get(path)
+        assert res.status_code == httpx.codes.OK
+        assert parse(res.text) == expected
+
+
 def test_h_nt(client, submit_and_merge_patch):
     submit_and_merge_patch("test-patch-replace-values-1.json")
 
@@ -576,7 +825,7 @@ def test_h_nt(client, submit_and_merge_patch):
     assert res.status_code == httpx.codes.OK
     assert res.headers["Content-Type"] == "application/n-triples"
     assert res.headers["X-Accel-Expires"] == f"{cache.MEDIUM_TIME}"
-    assert res.headers["Cache-Control"] == "public, max-age=0"
+    assert res.headers["Cache-Control"] == "public, max-age=0" + STALE_DIRECTIVES
     assert (
         res.headers["Content-Disposition"]
         == 'attachment; filename="periodo-history.nt"'
@@ -603,7 +852,7 @@ def test_history_nt(client, submit_and_merge_patch):
     res = client.get("/history.nt")
     assert res.headers["Content-Type"] == "application/n-triples"
     assert res.headers["X-Accel-Expires"] == f"{cache.MEDIUM_TIME}"
-    assert res.headers["Cache-Control"] == "public, max-age=0"
+    assert res.headers["Cache-Control"] == "public, max-age=0" + STALE_DIRECTIVES
     assert (
         res.headers["Content-Disposition"]
         == 'attachment; filename="periodo-history.nt"'
@@ -627,3 +876,48 @@ def test_export(client):
     res = client.get("/export.sql")
     assert res.status_code == httpx.codes.OK
     assert res.headers["Content-Type"] == "text/plain"
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_export_can_be_imported(active_user, client, load_json, tmp_path, monkeypatch):
+    res = client.patch("/d/", json=load_json("test-patch-replace-values-1.json"))
+    patch_url = urlparse(res.headers["Location"]).path
+    client.post(patch_url + "messages", json={"message": "period_search is slow"})
+
+    export = client.get("/export.sql").text
+    # the indexes are left out, but not the tables they index
+    assert not any(
+        line.startswith(("INSERT INTO sqlite_master", "CREATE TRIGGER period_"))
+        or "period_search" in line.split("VALUES")[0]
+        or "period_span_tree" in line.split("VALUES")[0]
+        for line in export.splitlines()
+    )
+    assert "CREATE TABLE period_text" in export
+    assert "CREATE TABLE period_span" in export
+    assert "period_search is slow" in export
+
+    # as by `make import`
+    with sqlite3.connect(tmp_path / "imported.db") as db:
+        db.executescript(export)
+    monkeypatch.setitem(app.config, "DATABASE", str(tmp_path / "imported.db"))
+    commands.init_db()
+    commands.rebuild_indexes()
+    with app.app_context():
+        assert [row["id"] for row in search.search("archaic", None, 10, 0)] == [
+            "p0trgkvwbjd"
+        ]
+        assert [row["id"] for row in intervals.overlapping(-546, 0, 1, 10)] == [
+            "p0trgkvwbjd"
+        ]
+
+
+def test_translation_failures_are_not_cached(client, monkeypatch):
+    def fail(data):
+        raise translate.RDFTranslationError(503)
+
+    monkeypatch.setattr(translate, "jsonld_to_turtle", fail)
+    for path in ("/trgkv.ttl", "/trgkvwbjd.ttl?version=1", "/d.ttl?version=1"):
+        res = client.get(path)
+        assert res.status_code == httpx.codes.SERVICE_UNAVAILABLE
+        assert res.headers["Cache-Control"] == "no-store"
+        assert "X-Accel-Expires" not in res.headers
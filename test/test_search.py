@@ -0,0 +1,81 @@
+import httpx
+import pytest
+from urllib.parse import urlparse
+from periodo import app, database, indexes
+
+
+def result_ids(res):
+    return [result["id"] for result in res.json()["results"]]
+
+
+def test_search_periods(client):
+    res = client.get("/search?q=archaic")
+    assert res.status_code == httpx.codes.OK
+    data = res.json()
+    assert data["version"] == 1
+    assert result_ids(res) == ["p0trgkvwbjd"]
+    assert data["results"][0]["authority"] == "p0trgkv"
+    assert data["results"][0]["url"] == "/p0trgkvwbjd"
+    assert "[Archaic]" in data["results"][0]["snippet"]
+
+
+def test_search_prefixes_and_source_titles(client):
+    assert result_ids(client.get("/search?q=herak")) == ["p0trgkv4kxb"]
+    assert sorted(result_ids(client.get("/search?q=lakonian+sardis"))) == [
+        "p0trgkv4kxb",
+        "p0trgkvkhrv",
+        "p0trgkvwbjd",
+    ]
+    # not parsed as query syntax
+    assert result_ids(client.get('/search?q=iron+OR+"age')) == []
+
+
+def test_search_pages(client):
+    res = client.get("/search?q=sardis&limit=2")
+    assert len(result_ids(res)) == 2
+    assert 'rel="next"' in res.headers["Link"]
+    next_url = urlparse(res.headers["Link"].split(";")[0][1:-1])
+    res = client.get(f"{next_url.path}?{next_url.query}")
+    assert len(result_ids(res)) == 1
+    assert 'rel="prev"' in res.headers["Link"]
+
+
+@pytest.mark.client_auth_token("this-token-has-normal-permissions")
+def test_search_versions(active_user, admin_user, client, bearer_auth):
+    res = client.patch(
+        "/d/",
+        json=[
+            {
+                "op": "replace",
+                "path": "/authorities/p0trgkv/periods/p0trgkvwbjd/label",
+                "value": "Geometric",
+            },
+            {
+                "op": "replace",
+                "path": "/authorities/p0trgkv/periods/p0trgkvwbjd/localizedLabels",
+                "value": {"eng-latn": ["Geometric"]},
+            },
+        ],
+    )
+    patch_url = urlparse(res.headers["Location"]).path
+    client.post(
+        patch_url + "merge", auth=bearer_auth("this-token-has-admin-permissions")
+    )
+
+    assert result_ids(client.get("/search?q=archaic")) == []
+    assert result_ids(client.get("/search?q=geometric")) == ["p0trgkvwbjd"]
+    assert result_ids(client.get("/search?q=archaic&version=1")) == ["p0trgkvwbjd"]
+    assert result_ids(client.get("/search?q=geometric&version=1")) == []
+    res = client.get("/search?q=archaic&version=1")
+    assert res.headers["Cache-Control"] == "public, max-age=31557600"
+    assert client.get("/search?q=archaic&version=3").status_code == 404
+
+
+def test_rebuild_search_index(client):
+    with app.app_context():
+        with database.open_cursor(write=True) as cursor:
+            cursor.execute("DELETE FROM period_text")
+    assert result_ids(client.get("/search?q=archaic")) == []
+    with app.app_context():
+        indexes.rebuild()
+    assert result_ids(client.get("/search?q=archaic")) == ["p0trgkvwbjd"]
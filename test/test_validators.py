@@ -0,0 +1,138 @@
+import httpx
+import pytest
+from email.utils import format_datetime, parsedate_to_datetime
+from datetime import timedelta
+
+
+def revalidate(client, url, res):
+    return client.get(url, headers={"If-None-Match": res.headers["ETag"]})
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/trgkv.json",
+        "/trgkvwbjd.jsonld",
+        "/h.nt",
+        "/patches/",
+        "/identifier-map/",
+        "/feed.xml",
+        "/graphs/",
+    ],
+)
+def test_not_modified(client, submit_and_merge_patch, url):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    res = client.get(url)
+    assert res.status_code == httpx.codes.OK
+    assert res.headers["ETag"].startswith('W/"')
+    res = revalidate(client, url, res)
+    assert res.status_code == httpx.codes.NOT_MODIFIED
+    assert res.content == b""
+
+
+def test_representations_have_different_etags(client):
+    etags = {
+        client.get(url).headers["ETag"]
+        for url in ("/d.json", "/d.jsonld", "/d.csv", "/trgkv.json", "/trgkv.csv")
+    }
+    assert len(etags) == 5
+    assert client.get("/d.json").headers["ETag"] == 'W/"periodo-dataset-version-1"'
+
+
+def test_html_redirect_is_not_conditional(client):
+    res = client.get("/c", headers={"Accept": "text/html", "If-None-Match": "*"})
+    assert res.status_code == httpx.codes.SEE_OTHER
+    res = client.get("/c.json.html", headers={"If-None-Match": "*"})
+    assert res.status_code == httpx.codes.NOT_MODIFIED
+
+
+def test_if_modified_since(client):
+    res = client.get("/d.json")
+    last_modified = parsedate_to_datetime(res.headers["Last-Modified"])
+
+    res = client.get(
+        "/d.json", headers={"If-Modified-Since": format_datetime(last_modified, True)}
+    )
+    assert res.status_code == httpx.codes.NOT_MODIFIED
+
+    res = client.get(
+        "/d.json",
+        headers={
+            "If-Modified-Since": format_datetime(
+                last_modified - timedelta(seconds=1), True
+            )
+        },
+    )
+    assert res.status_code == httpx.codes.OK
+
+    # If-None-Match takes precedence
+    res = client.get(
+        "/d.json",
+        headers={
+            "If-Modified-Since": format_datetime(last_modified, True),
+            "If-None-Match": 'W/"periodo-dataset-version-0"',
+        },
+    )
+    assert res.status_code == httpx.codes.OK
+
+
+def test_merge_changes_validators(client, submit_and_merge_patch):
+    dataset = client.get("/d.json")
+    period = client.get("/trgkvwbjd.json")
+    identifier_map = client.get("/identifier-map/")
+
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+
+    assert revalidate(client, "/d.json", dataset).status_code == httpx.codes.OK
+    assert revalidate(client, "/trgkvwbjd.json", period).status_code == httpx.codes.OK
+    # versioned representations do not change
+    res = client.get("/trgkvwbjd.json?version=1")
+    res = revalidate(client, "/trgkvwbjd.json?version=1", res)
+    assert res.status_code == httpx.codes.NOT_MODIFIED
+    # the patch did not add any identifiers
+    res = revalidate(client, "/identifier-map/", identifier_map)
+    assert res.status_code == httpx.codes.NOT_MODIFIED
+
+
+def test_comment_changes_validators(client, submit_and_merge_patch, bearer_auth):
+    submit_and_merge_patch("test-patch-replace-values-1.json")
+    urls = ("/h.nt", "/patches/", "/patches/1/", "/feed.xml")
+    responses = {url: client.get(url) for url in urls}
+    dataset = client.get("/d.json")
+
+    client.post(
+        "/patches/1/messages",
+        json={"message": "Nice"},
+        auth=bearer_auth("this-token-has-normal-permissions"),
+    )
+
+    for url in urls:
+        assert revalidate(client, url, responses[url]).status_code == httpx.codes.OK
+    assert revalidate(client, "/d.json", dataset).status_code == (
+        httpx.codes.NOT_MODIFIED
+    )
+
+
+def test_missing_resources_are_not_conditional(client):
+    res = client.get("/patches/99/", headers={"If-None-Match": "*"})
+    assert res.status_code == httpx.codes.NOT_FOUND
+    res = client.get("/d.json?version=99", headers={"If-None-Match": "*"})
+    assert res.status_code == httpx.codes.NOT_FOUND
+    for url in ("/tzzzz.json", "/trgkv999.json", "/trgkvwbjd.json?version=0"):
+        res = client.get(url, headers={"If-None-Match": "*"})
+        assert res.status_code == httpx.codes.NOT_FOUND, url
+        res = client.get(
+            url, headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"}
+        )
+        assert res.status_code == httpx.codes.NOT_FOUND, url
+
+
+def test_removed_entities_are_not_conditional(client, submit_and_merge_patch):
+    submit_and_merge_patch("test-patch-remove-authority.json")
+    for url in ("/trgkv.json", "/trgkvwbjd.json"):
+        res = client.get(url, headers={"If-None-Match": "*"})
+        assert res.status_code == httpx.codes.GONE, url
+        res = client.get(
+            url, headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"}
+        )
+        assert res.status_code == httpx.codes.GONE, url